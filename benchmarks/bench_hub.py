@@ -0,0 +1,104 @@
+"""Thread count and CPU use of ElmoHub against one ElmoClient per panel.
+
+The simulated control unit runs in a separate process, so the CPU time
+measured here is the one spent by the clients only. Run from the
+repository root:
+
+    python benchmarks/bench_hub.py --panels 10 100 1000
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from elmoclient import ElmoClient  # noqa: E402
+from elmoclient.hub import ElmoHub  # noqa: E402
+
+
+def start_simulator():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "elmoclient.simulator"],
+        stdout=subprocess.PIPE,
+        env=env,
+    )
+    port = int(proc.stdout.readline())
+    return proc, port
+
+
+def wait_connected(panels, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not all(panel.connected for panel in panels):
+        if time.monotonic() > deadline:
+            raise RuntimeError("panels did not connect")
+        time.sleep(0.05)
+
+
+def measure(window):
+    threads = threading.active_count()
+    cpu = time.process_time()
+    time.sleep(window)
+    return threads, (time.process_time() - cpu) / window * 100
+
+
+def bench_hub(port, panels, window):
+    hub = ElmoHub()
+    clients = [hub.add_panel("127.0.0.1", port) for _ in range(panels)]
+    for client in clients:
+        client.polling_enabled = True
+    hub.start()
+    try:
+        wait_connected(clients)
+        return measure(window)
+    finally:
+        hub.stop()
+
+
+def bench_threads(port, panels, window):
+    clients = [ElmoClient("127.0.0.1", port) for _ in range(panels)]
+    for client in clients:
+        client.polling_enabled = True
+        client.start()
+    try:
+        wait_connected(clients)
+        return measure(window)
+    finally:
+        for client in clients:
+            client.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--panels", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--window", type=float, default=5, help="seconds measured")
+    parser.add_argument(
+        "--max-threaded",
+        type=int,
+        default=100,
+        help="largest panel count also run with one ElmoClient per panel",
+    )
+    args = parser.parse_args()
+    logging.getLogger("elmoclient").setLevel(logging.WARNING)
+
+    proc, port = start_simulator()
+    try:
+        print(f"{'panels':>7} {'mode':>8} {'threads':>8} {'cpu %':>7}")
+        for panels in args.panels:
+            threads, cpu = bench_hub(port, panels, args.window)
+            print(f"{panels:>7} {'hub':>8} {threads:>8} {cpu:>7.1f}")
+            if panels <= args.max_threaded:
+                threads, cpu = bench_threads(port, panels, args.window)
+                print(f"{panels:>7} {'threads':>8} {threads:>8} {cpu:>7.1f}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Memory and lookup cost of the client status against the old dict-of-lists status.
+
+The old layout kept one list [value, callback, ...] per position in a dict
+per sigtype; it is reproduced here as LegacyStatus. The new one is timed
+through the client itself: the status is one int bitmask per sigtype,
+get() reads a bit of the current snapshot and update_signals() replaces
+the bitmask and publishes a new snapshot, visiting the changed bits only
+when a callback or change-set subscriber listens. The bitmasks take a
+fraction of the memory and an update nobody listens to is much cheaper,
+while a single get() and an update with every position subscribed cost
+more than the old lists. Run from the repository root:
+
+    python benchmarks/bench_status.py --positions 128 1024
+"""
+import argparse
+import itertools
+import os
+import sys
+import timeit
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from elmoclient.base import SIGTYPES  # noqa: E402
+from elmoclient.replay import ReplayClient  # noqa: E402
+
+
+class LegacyStatus:
+    def __init__(self):
+        self._status = {sigtype: {} for sigtype in SIGTYPES}
+        self._masks = dict.fromkeys(SIGTYPES, 0)
+
+    def get(self, sigtype, pos):
+        try:
+            return self._status[sigtype][pos][0]
+        except KeyError:
+            return 0
+
+    def subscribe(self, sigtype, pos, callback):
+        self._status[sigtype].setdefault(pos, [0]).append(callback)
+
+    def update(self, sigtype, data):
+        changed = self._masks[sigtype] ^ data
+        self._masks[sigtype] = data
+        status = self._status[sigtype]
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            pos = bit.bit_length()
+            value = 1 if data & bit else 0
+            try:
+                status[pos][0] = value
+                for callback in status[pos][1:]:
+                    callback(sigtype[0], pos, value)
+            except KeyError:
+                status[pos] = [value]
+
+
+class ClientStatus:
+    def __init__(self, positions):
+        client = ReplayClient(num_ingressi=positions, num_uscite=positions, metrics=False)
+        # metodi del client, senza un livello di chiamata in più
+        self.get = client.get
+        self.subscribe = client.subscribe
+        self.update = client.update_signals
+
+
+def measure(name, factory, positions):
+    full = (1 << positions) - 1
+    tracemalloc.start()
+    status = factory()
+    for sigtype in SIGTYPES:
+        # ogni posizione viene vista almeno una volta
+        status.update(sigtype, full)
+        status.update(sigtype, 0)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    number = 200000
+    get = timeit.timeit(lambda: status.get("ingresso", positions // 2), number=number)
+    # alterna tutto attivo / tutto a riposo: ogni update cambia tutte le posizioni
+    masks = itertools.cycle((full, 0))
+    update = timeit.timeit(lambda: status.update("ingresso", next(masks)), number=2000)
+    # con una callback su ogni posizione tutte le modifiche vanno notificate
+    for pos in range(1, positions + 1):
+        status.subscribe("ingresso", pos, _noop)
+    subscribed = timeit.timeit(lambda: status.update("ingresso", next(masks)), number=2000)
+    print(
+        f"{name:>8} {positions:>6} positions: {memory / 1024:8.1f} KiB, "
+        f"get {get / number * 1e9:6.0f} ns, "
+        f"full update {update / 2000 * 1e6:7.1f} us, "
+        f"subscribed {subscribed / 2000 * 1e6:7.1f} us"
+    )
+
+
+def _noop(sigtype, pos, value):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--positions", type=int, nargs="+", default=[128, 1024])
+    args = parser.parse_args()
+    for positions in args.positions:
+        measure("legacy", LegacyStatus, positions)
+        measure("client", lambda: ClientStatus(positions), positions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Benchmark suite for the hot paths of elmoclient.
+
+Every case is run `--warmup` times, then timed in `--repeat` samples of
+`--number` calls each; the report gives the per-call percentiles and the
+peak memory allocated by one call (tracemalloc). Run from the repository root:
+
+    python benchmarks/run.py                      # all the cases
+    python benchmarks/run.py -k update_signals    # only matching cases
+    python benchmarks/run.py -o before.json       # save the results
+    python benchmarks/run.py --compare before.json after.json
+
+With --compare the p50 of every case of the two files are compared and
+the exit status is 1 when one got slower than --threshold.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import elmoclient.elmoprocessor as proc  # noqa: E402
+from elmoclient import AsyncElmoClient  # noqa: E402
+from elmoclient.base import ElmoBase  # noqa: E402
+from elmoclient.protocol import ElmoProtocol  # noqa: E402
+
+allrid_portachiusa = bytes.fromhex(
+    "02442800011090109010900101040004010000000000000000000000000000000000010000001082000000000000000000000000000000000000000000000000000000108300000000000000000000ae03"
+)
+allrid_portaaperta = bytes.fromhex(
+    "02442800011090109010900101040004010000220000000000000000000000000000010000001082000000000000000000000000000000000000000000000000000000108300000000000000000000d003"
+)
+lettura_settori_inseribili_no_primo = bytes.fromhex("020628000104007f7fffff10832f03")
+lettura_stato_ingressi = bytes.fromhex(
+    "022228000110901090000000080000000000000000000000000001000000108200000000000000000000007603"
+)
+# corpo di frame con molti byte da proteggere col DLE
+stuffing_payload = bytes(range(256))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run_case(func, warmup, repeat, number):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+
+    # memoria: picco durante una chiamata e quanto resta allocato dopo
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50": percentile(samples, 50),
+        "p90": percentile(samples, 90),
+        "p99": percentile(samples, 99),
+        "min": min(samples),
+        "mean": sum(samples) / len(samples),
+        "peak_bytes": peak - base,
+        "retained_bytes": current - base,
+    }
+
+
+def signals_client(subscribers):
+    client = ElmoBase(num_ingressi=128)
+
+    def callback(sigtype, pos, value):
+        pass
+
+    for i in range(subscribers):
+        client.subscribe("ingresso", i % 128 + 1, callback)
+    masks = [(1 << 128) - 1, 0]
+
+    def update():
+        # ogni chiamata cambia tutte le 128 posizioni
+        masks.reverse()
+        client.update_signals("ingresso", masks[0])
+
+    return update
+
+
+def parser_cases():
+    allrid = proc.recive(allrid_portachiusa)[4:]
+    inseribili = proc.recive(lettura_settori_inseribili_no_primo)[4:]
+    ingressi = proc.recive(lettura_stato_ingressi)[4:]
+    stuffed = proc.byte_stuffing_fast(stuffing_payload)
+    cases = {
+        "stuffing": lambda: proc.byte_stuffing_fast(stuffing_payload),
+        "unstuffing": lambda: proc.byte_unstuffing_fast(stuffed),
+        "crc": lambda: proc.crc2_fast(stuffing_payload),
+        "framing": lambda: proc.parse_to_send(proc.rq_cmd(bytearray(stuffing_payload[:200]))),
+        "recive": lambda: proc.recive(allrid_portachiusa),
+        "read_stato_allineamento_ridotto": lambda: proc.read_stato_allineamento_ridotto(allrid, as_mask=True),
+        "read_settori_inseribili": lambda: proc.read_settori_inseribili(inseribili, as_mask=True),
+        "read_stato_ingressi": lambda: proc.read_stato_ingressi(ingressi, as_mask=True),
+        "build_frame_inserisci_settore": lambda: proc.build_frame(proc.cmd_inserisci_settore(5)),
+        "frame_inserisci_settore_cached": lambda: proc.frame_inserisci_settore(5),
+        "build_frame_accesso_sistema": lambda: proc.build_frame(proc.cmd_accesso_sistema(1, "123456")),
+    }
+    for subscribers in (0, 100, 10000):
+        cases[f"update_signals_{subscribers}_subscribers"] = signals_client(subscribers)
+    cases["protocol_poll_unchanged"] = protocol_poll([allrid_portachiusa])
+    cases["protocol_poll_changed"] = protocol_poll([allrid_portachiusa, allrid_portaaperta])
+    return cases
+
+
+def protocol_poll(frames):
+    """A poll request and its reply through ElmoProtocol, cycling over `frames`."""
+    protocol = ElmoProtocol()
+    frames = list(frames)
+
+    def poll():
+        frames.append(frames.pop(0))
+        protocol.send("allineamento_ridotto")
+        return protocol.receive_data(frames[0])
+
+    return poll
+
+
+class PollCycle:
+    """One ALLINEAMENTORIDOTTO request and reply against a simulated panel process."""
+
+    def __enter__(self):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        self.panel = subprocess.Popen(
+            [sys.executable, "-m", "elmoclient.simulator"],
+            stdout=subprocess.PIPE,
+            env=env,
+        )
+        port = int(self.panel.stdout.readline())
+        self.loop = asyncio.new_event_loop()
+        self.client = AsyncElmoClient("127.0.0.1", port)
+        self.loop.run_until_complete(self.client.start())
+        self.loop.run_until_complete(self.client.wait_connected(5))
+        return self
+
+    def __call__(self):
+        self.loop.run_until_complete(self.client.allineamento_ridotto())
+
+    def __exit__(self, *exc):
+        self.loop.run_until_complete(self.client.stop())
+        self.loop.close()
+        self.panel.terminate()
+        self.panel.wait()
+
+
+def run(args):
+    results = {}
+    cases = parser_cases()
+    selected = [name for name in list(cases) + ["poll_cycle"] if not args.k or args.k in name]
+    print(f"{'case':<40} {'p50':>10} {'p90':>10} {'p99':>10} {'peak bytes':>11}")
+    for name in selected:
+        if name == "poll_cycle":
+            with PollCycle() as cycle:
+                # l'andata e ritorno sul socket è migliaia di volte più lenta
+                stats = run_case(cycle, args.warmup, args.repeat, max(1, args.number // 100))
+        else:
+            stats = run_case(cases[name], args.warmup, args.repeat, args.number)
+        results[name] = stats
+        print(
+            f"{name:<40} {format_time(stats['p50'])} {format_time(stats['p90'])} "
+            f"{format_time(stats['p99'])} {stats['peak_bytes']:>11}"
+        )
+    return results
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:>8.2f}{unit:>2}"
+    return f"{seconds / 1e-9:>8.1f}ns"
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    print(f"{'case':<40} {'old p50':>10} {'new p50':>10} {'change':>8}")
+    regressions = 0
+    for name, stats in new["results"].items():
+        if name not in old["results"]:
+            continue
+        before = old["results"][name]["p50"]
+        after = stats["p50"]
+        change = after / before - 1
+        flag = ""
+        if change > threshold:
+            flag = "  slower"
+            regressions += 1
+        print(f"{name:<40} {format_time(before)} {format_time(after)} {change:>+8.1%}{flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", help="run only the cases whose name contains this")
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=30, help="timed samples per case")
+    parser.add_argument("--number", type=int, default=1000, help="calls per sample")
+    parser.add_argument("-o", "--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown reported by --compare")
+    args = parser.parse_args()
+    logging.getLogger("elmoclient").setLevel(logging.WARNING)
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
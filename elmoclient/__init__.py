@@ -1,35 +1,42 @@
+import errno
+import os
+import select
 import socket
-import binascii
 import logging
 import time
 import threading
-import queue
+from .base import ElmoBase, QueuedElmoBase, CommandResult, Change, ChangeSet, SIGTYPES, set_socket_options
+from .status import Snapshot
+from .scheduler import PollScheduler, Backoff
+from .commandqueue import CommandQueue
+from .dispatcher import CallbackDispatcher
+from .metrics import Metrics, NullMetrics, prometheus_text
+from .trace import WireTrace, TX, RX
+from .events import Event, stream_events, load_cursor, save_cursor
+from .config import PanelInfo, PanelConfig, load_config
+from .protocol import (
+    ElmoProtocol,
+    Reply,
+    StatusFrame,
+    InseribiliFrame,
+    IngressiFrame,
+    LoginResult,
+    EventLogFrame,
+    CommandReply,
+    InvalidFrame,
+    UnsolicitedFrame,
+)
+from .statefile import SavedState, load_state
+from .asyncclient import AsyncElmoClient
 from .elmoprocessor import (
-    cmd_accesso_sistema, cmd_inserisci_settore,
-    cmd_disinserisci_settore,
-    cmd_lettura_settori_inseribili,
-    cmd_lettura_stato_ingressi,
-    rq_cmd,
-    recive,
-    parse_to_send,
-    read_stato_allineamento_ridotto,
-    read_settori_inseribili,
-    read_stato_ingressi,
+    FrameError,
+    FrameReader,
+    CMD_ALLINEAMENTO_RIDOTTO,
 )
 
 _LOGGER = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.DEBUG, format="[%(levelname)s] (%(threadName)-10s) %(message)s"
-)
-SIGTYPES = [
-    "ingresso",
-    "uscita",
-    "settore",
-    "uscita_dedicata",
-    "memoria_uscita_dedicata",
-    "anomalia",
-    "settore_inseribile",
-]
+# la configurazione del logging spetta all'applicazione
+_LOGGER.addHandler(logging.NullHandler())
 
 
 class PollThread(threading.Thread):
@@ -44,144 +51,227 @@ class PollThread(threading.Thread):
     def _handle_socket_error(self):
         """Handle socket errors by setting restart_connection flag."""
         with self.elmo.restart_lock:
+            if self.elmo.restart_connection is False and not self._stop_event.is_set():
+                self.elmo._metrics.connection_lost()
             self.elmo.restart_connection = True
             self.elmo.connected = False  # Mark as disconnected to prevent further operations
+        # il supervisore riapre subito la connessione
+        self.elmo.connection_thread.wake()
+
+    def _recv_reply(self):
+        """Read from the socket until the protocol returns the reply to the pending request."""
+        reply = None
+        while reply is None:
+            data = self.elmo.socket.recv(4096)
+            if not data:
+                raise ConnectionResetError("connection closed by the control unit")
+            for event in self.elmo.data_received(data):
+                if type(event) is UnsolicitedFrame:
+                    self.elmo.handle_event(event)
+                else:
+                    reply = event
+        return reply
 
     def run(self):
         """Start the Elmo outgoing packet processing thread."""
         _LOGGER.debug("polling thread start")
 
+        next_poll = time.monotonic() + self.elmo.poll_scheduler.next_delay()
         while not self._stop_event.is_set():
+            timeout = max(0, next_poll - time.monotonic())
+            # si sveglia appena arriva un comando o alla scadenza del poll
+            item = self.elmo.tx_queue.get(timeout)
+            if item is not None:
+                # i comandi hanno la precedenza sul poll
+                self._send_command(*item)
+                continue
+            if self._stop_event.is_set() or time.monotonic() < next_poll:
+                # svegliato da join()
+                continue
 
-            # process the queue
-            while self.elmo.connected is True and not self.elmo.tx_queue.empty():
-                command, tx = self.elmo.tx_queue.get()
-                if self.elmo.restart_connection is False:
-                    _LOGGER.debug(
-                        f"TX:{command} <{str(binascii.hexlify(tx), 'ascii')}>"
-                    )
-                    try:
-                        self.elmo.socket.sendall(tx)
-                    except socket.error:
-                        self._handle_socket_error()
-                    else:
-                        try:
-                            data = self.elmo.socket.recv(4096)
-                            _LOGGER.debug(
-                                f"RX:{command} <{str(binascii.hexlify(data), 'ascii')}>"
-                            )
-                            if command == "lettura_inseribili":
-                                self.elmo.parse_settori_inseribili(data)
-                            elif command == "accesso_sistema":
-                                self.elmo.parse_accesso_sistema(data)
-                        except TimeoutError:
-                            _LOGGER.debug(f"Socket timeout while receiving data for {command}")
-                            self._handle_socket_error()
-                        except socket.error:
-                            self._handle_socket_error()
-
-            time.sleep(0.2)
             # request a status update
             if (
                 self.elmo.connected is True
                 and self.elmo.restart_connection is False
                 and self.elmo.polling_enabled is True
             ):
-                try:
-                    self.elmo.socket.send(bytes.fromhex("02010800003f004803"))
-                    try:
-                        data = self.elmo.socket.recv(4096)
-                        self.elmo.parse_update(data)
-                    except TimeoutError:
-                        _LOGGER.debug("Socket timeout while receiving status update")
-                        self._handle_socket_error()
-                    except socket.error:
-                        self._handle_socket_error()
-                except socket.error:
-                    self._handle_socket_error()
-                # print('Received: %r' % binascii.hexlify(data))
+                self.elmo._metrics.poll_started(next_poll)
+                self._request("allineamento_ridotto", CMD_ALLINEAMENTO_RIDOTTO)
+            next_poll = time.monotonic() + self.elmo.poll_scheduler.next_delay()
 
         _LOGGER.debug("polling thread stop")
 
+    def _send_command(self, command, tx, future):
+        """Send a queued command and resolve its future with the reply."""
+        if not future.set_running_or_notify_cancel():
+            return
+        if self.elmo.restart_connection is not False:
+            future.set_exception(ConnectionError(f"{command} not sent, reconnecting"))
+            return
+        self._request(command, tx, future)
+
+    def _request(self, command, tx, future=None):
+        """Send a request and apply its reply; `future`, if any, gets the CommandResult."""
+        metrics = self.elmo._metrics
+        try:
+            tx = self.elmo.send_request(command, tx)
+            self.elmo.socket.sendall(tx)
+            metrics.sent(len(tx))
+            event = self._recv_reply()
+        except (TimeoutError, socket.timeout):
+            _LOGGER.debug(f"Socket timeout while receiving data for {command}")
+            metrics.timeout()
+            if future is not None:
+                future.set_exception(TimeoutError(f"no reply to {command}"))
+            self._handle_socket_error()
+            return
+        except socket.error as err:
+            if future is not None:
+                future.set_exception(err)
+            self._handle_socket_error()
+            return
+        try:
+            result = self.elmo.handle_event(event)
+        except FrameError as err:
+            # già contato in frames_rejected
+            if future is not None:
+                future.set_exception(err)
+        else:
+            if future is not None:
+                future.set_result(result)
+
     def join(self, timeout=None):
         """Stop the Elmo outgoing packet processing thread."""
         self._stop_event.set()
+        # sveglia il thread fermo su tx_queue.get() o in attesa di una risposta
+        self.elmo.tx_queue.wake()
+        try:
+            self.elmo.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         _LOGGER.debug("stop event set() in polling")
         threading.Thread.join(self, timeout)
 
 
-class ConnectionThread(threading.Thread):
-    """Manage the socket connection to the control processor."""
+class ConnectionSupervisor(threading.Thread):
+    """Manage the socket connection to the control processor.
+
+    The thread sleeps until something happens: the connection is lost, a
+    reconnection attempt is due or stop() is called. Failed attempts are
+    retried after the delays of the client's Backoff. Every connection
+    gets its own PollThread, and the login is replayed on the new
+    connection if the client had logged in.
+    """
 
     def __init__(self, elmo):
         """Set up the socket management thread."""
         self._stop_event = threading.Event()
         self.elmo = elmo
+        # scrivere su _waker sveglia il thread fermo in _wait()
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._waker.setblocking(False)
         threading.Thread.__init__(self, name="Connection")
 
+    def wake(self):
+        """Make the supervisor check the connection now."""
+        try:
+            self._waker.send(b"\0")
+        except OSError:
+            pass
+
+    def _wait(self, timeout, sock=None):
+        """Wait up to `timeout` seconds for wake(); return True if `sock` became writable."""
+        readable, writable, _ = select.select([self._wakeup], [sock] if sock else [], [], timeout)
+        if readable:
+            try:
+                while self._wakeup.recv(4096):
+                    pass
+            except OSError:
+                pass
+        return bool(writable)
+
+    def _connect(self):
+        """Open a connection to the control unit, or return None."""
+        elmo = self.elmo
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            err = sock.connect_ex((elmo.host, elmo.port))
+            if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                if not self._wait(elmo.timeout, sock):
+                    # scaduto il timeout oppure stop()
+                    err = errno.ETIMEDOUT
+                else:
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise OSError(err, os.strerror(err))
+            sock.settimeout(elmo.timeout)
+            set_socket_options(sock)
+        except OSError:
+            sock.close()
+            return None
+        return sock
+
     def run(self):
         """Start the socket management thread."""
         _LOGGER.debug("connection thread start")
-
+        elmo = self.elmo
+        elmo.backoff.reset()
         warning_posted = False
 
         while not self._stop_event.is_set():
-            try:
-                self.elmo.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.elmo.socket.settimeout(self.elmo.timeout)
-                self.elmo.socket.connect((self.elmo.host, self.elmo.port))
-            except socket.error:
-                self.elmo.socket.close()
+            sock = self._connect()
+            if sock is None:
                 if warning_posted is False:
-                    _LOGGER.debug(
-                        f"attempting to connect to {self.elmo.host}:{self.elmo.port}, "
-                        "no success yet"
-                    )
+                    _LOGGER.debug(f"attempting to connect to {elmo.host}:{elmo.port}, no success yet")
                     warning_posted = True
-                if not self._stop_event.is_set():
-                    time.sleep(1)
+                self._wait(elmo.backoff.next_delay())
+                continue
+
+            warning_posted = False
+            elmo.backoff.reset()
+            _LOGGER.debug(f"connected to {elmo.host}:{elmo.port}")
+            elmo.socket = sock
+            elmo.protocol.reset()
+            elmo.restart_connection = False
+            elmo.connected = True
+            elmo._metrics.connection_restored()
+            if elmo.logged_in:
+                # la sessione non sopravvive alla connessione
+                _LOGGER.debug("replaying login")
+                elmo._replay_login()
+            # un thread non può ripartire: uno nuovo per ogni connessione
+            elmo.poll_thread = PollThread(elmo)
+            elmo.poll_thread.start()
+
+            while not self._stop_event.is_set() and elmo.restart_connection is False:
+                self._wait(None)
+            elmo.poll_thread.join()
+            elmo.connected = False
+            sock.close()
+            if self._stop_event.is_set():
+                _LOGGER.debug(f"closed connection to {elmo.host}:{elmo.port}")
             else:
-                warning_posted = False
-                _LOGGER.debug(f"connected to {self.elmo.host}:{self.elmo.port}")
-                # Always start the poll thread when a connection is established
-                self.elmo.poll_thread.start()
-                self.elmo.restart_connection = False
-                while (
-                    not self._stop_event.is_set()
-                    and self.elmo.restart_connection is False
-                ):
-                    time.sleep(1)
-                if not self._stop_event.is_set():
-                    # If we're restarting, make sure to stop the poll thread first
-                    if self.elmo.restart_connection and hasattr(self.elmo, 'poll_thread') and self.elmo.poll_thread.is_alive():
-                        _LOGGER.debug("stopping poll thread before reconnection")
-                        self.elmo.poll_thread.join()
-
-                    self.elmo.connected = False
-                    self.elmo.socket.close()
-                    _LOGGER.debug(
-                        f"lost connection to {self.elmo.host}:{self.elmo.port}"
-                    )
-                else:
-                    # close all threads
-                    self.elmo.poll_thread.join()
-                    self.elmo.connected = False
-                    _LOGGER.debug(
-                        f"closed connection to {self.elmo.host}:{self.elmo.port}"
-                    )
-
-        self.elmo.socket.close()
-        self.elmo.connected = False
+                _LOGGER.debug(f"lost connection to {elmo.host}:{elmo.port}")
+
+        self._wakeup.close()
+        self._waker.close()
         _LOGGER.debug("connection thread stop")
 
     def join(self, timeout=None):
         """Stop the socket management thread."""
         self._stop_event.set()
+        self.wake()
         _LOGGER.debug("stop event set() in connection")
         threading.Thread.join(self, timeout)
 
 
-class ElmoClient:
+# nome precedente
+ConnectionThread = ConnectionSupervisor
+
+
+class ElmoClient(QueuedElmoBase):
     def __init__(
         self,
         host,
@@ -191,8 +281,17 @@ class ElmoClient:
         num_uscite=32,
         user="",
         password="",
+        poll_scheduler=None,
+        dispatcher=None,
+        metrics=True,
+        trace=None,
+        state_path=None,
+        backoff=None,
     ):
         """ Initialize ElmoClient object """
+        QueuedElmoBase.__init__(
+            self, num_ingressi, num_uscite, poll_scheduler, dispatcher, metrics, trace, state_path, backoff
+        )
         self.host = host
         self.port = port
         self._user = user
@@ -202,186 +301,38 @@ class ElmoClient:
         self.polling_enabled = False
 
         self._client = None
-        self._prev_status = None
         self.connected = False
-        self.logged_in = False
 
         self.restart_lock = threading.Lock()
         self.restart_connection = False
         self.connection_thread = None
+        self.poll_thread = None
 
-        self.tx_queue = queue.Queue()
-
-        self.join_lock = threading.Lock()
-        self._status = {
-            "ingresso": {},
-            "uscita": {},
-            "settore": {},
-            "uscita_dedicata": {},
-            "memoria_uscita_dedicata": {},
-            "anomalia": {},
-            "settore_inseribile": {},
-        }
+        self.tx_queue = CommandQueue()
 
     def start(self):
         """Start the Elmo client instance."""
-        if self.connection_thread and self.connection_thread.is_alive() and not self.restart_connection:
+        if self.connection_thread and self.connection_thread.is_alive():
             _LOGGER.error("start() called while already running")
-        else:
-            _LOGGER.debug("connection thread start requested")
-
-            # Clean up any existing threads before starting new ones
-            if self.connection_thread and self.connection_thread.is_alive():
-                _LOGGER.debug("stopping existing connection thread before restart")
-                self.connection_thread.join()
-
-            # Also make sure poll_thread is stopped if it exists and is running
-            if hasattr(self, 'poll_thread') and self.poll_thread and self.poll_thread.is_alive():
-                _LOGGER.debug("stopping existing poll thread before restart")
-                self.poll_thread.join()
-
-            # Clear the queue to prevent processing old commands
-            while not self.tx_queue.empty():
-                self.tx_queue.get()
-
-            # Create and start new threads
-            self.connection_thread = ConnectionThread(self)
-            self.poll_thread = PollThread(self)
-            self.connection_thread.start()
-            self.connected = True
-            self.restart_connection = False
+            return
+        _LOGGER.debug("connection thread start requested")
+        # Clear the queue to prevent processing old commands
+        self.tx_queue.clear()
+        self.restart_connection = False
+        self.connection_thread = ConnectionSupervisor(self)
+        self.connection_thread.start()
 
     def stop(self):
-        """Stop the Elmo client instance."""
+        """Stop the Elmo client instance; the poll thread stops with it."""
         if not self.connection_thread or not self.connection_thread.is_alive():
             _LOGGER.debug("stop() called but connection thread is not running")
         else:
             _LOGGER.debug("connection thread stop requested")
             self.connection_thread.join()
-
-        # Also stop the poll thread if it exists and is running
-        if hasattr(self, 'poll_thread') and self.poll_thread and self.poll_thread.is_alive():
-            _LOGGER.debug("poll thread stop requested")
-            self.poll_thread.join()
+        # nessuno invierà più i comandi in coda
+        self.tx_queue.clear()
 
         # Reset connection state
         self.connected = False
         self.restart_connection = False
-
-    def accesso_sistema(self):
-        cmd = cmd_accesso_sistema(self._user, self._password)
-        cmd = rq_cmd(cmd)
-        cmd = parse_to_send(cmd)
-        self.tx_queue.put(("accesso_sistema", cmd))
-
-    def inserisci_settore(self, num_settore):
-        cmd = cmd_inserisci_settore(num_settore)
-        cmd = rq_cmd(cmd)
-        cmd = parse_to_send(cmd)
-        self.tx_queue.put(("ins_settore", cmd))
-
-    def disinserisci_settore(self, num_settore):
-        cmd = cmd_disinserisci_settore(num_settore)
-        cmd = rq_cmd(cmd)
-        cmd = parse_to_send(cmd)
-        self.tx_queue.put(("disins_settore", cmd))
-
-    def richiedi_lettura_settori_inseribili(self):
-        cmd = cmd_lettura_settori_inseribili()
-        cmd = rq_cmd(cmd)
-        cmd = parse_to_send(cmd)
-        self.tx_queue.put(("lettura_inseribili", cmd))
-
-    def richiedi_lettura_stato_ingressi(self):
-        cmd = cmd_lettura_stato_ingressi()
-        cmd = rq_cmd(cmd)
-        cmd = parse_to_send(cmd)
-        self.tx_queue.put(("lettura_ingressi", cmd))
-
-    def get(self, sigtype, pos):
-        """Get the current value of a pos."""
-        if sigtype not in SIGTYPES:
-            raise ValueError(f"get(): '{sigtype}' is not a valid signal sigtype")
-
-        with self.join_lock:
-            try:
-                value = self._status[sigtype][pos][0]
-            except KeyError:
-                value = 0
-        return value
-
-    def subscribe(self, sigtype, pos, callback):
-        """Subscribe to join change events by specifying callback functions."""
-        if sigtype not in SIGTYPES:
-            raise ValueError(f"subscribe(): '{sigtype}' is not a valid signal sigtype")
-
-        with self.join_lock:
-            if pos not in self._status[sigtype]:
-                self._status[sigtype][pos] = [
-                    0,
-                ]
-            self._status[sigtype][pos].append(callback)
-
-    def update_signals(self, sigtype, data):
-        for i in range(len(data)):
-            try:
-                pos = i + 1
-                value = int(data[i])
-                # updates the value only if changed
-                if self._status[sigtype][pos][0] != value:
-                    self._status[sigtype][pos][0] = value
-                    for callback in self._status[sigtype][pos][1:]:
-                        callback(sigtype[0], pos, value)
-                    _LOGGER.debug(f"  : {sigtype} {pos} = {value}")
-            except KeyError:
-                self._status[sigtype][pos] = [
-                    value,
-                ]
-
-    def parse_update(self, data):
-        """ parse incoming status update only when different from the previous status """
-        if data == self._prev_status:
-            return
-
-        # print('to be parsed: %r' % binascii.hexlify(data))
-        decode = recive(data)
-        # print(f"TX: <{str(binascii.hexlify(decode), 'ascii')}>")
-        # riduco stringa scartando Lmsg + Flag +Ind(msb) + Ind(lsb)
-        (
-            self._ingressi,
-            self._memoria_ingressi,
-            self._uscite,
-            self._settori,
-            self._settori_max_sicurezza,
-            self._anomalia,
-            self._uscita_dedicata,
-            self._memoria_uscita_dedicata,
-        ) = read_stato_allineamento_ridotto(decode[4:])
-        self.update_signals("ingresso", self._ingressi)
-        self.update_signals("uscita", self._uscite)
-        self.update_signals("settore", self._settori)
-        self.update_signals("anomalia", self._anomalia)
-        self.update_signals("uscita_dedicata", self._uscita_dedicata)
-        self.update_signals("memoria_uscita_dedicata", self._memoria_uscita_dedicata)
-        self._prev_status = data
-        # aggiorna lo stato degli inseribili visto che è cambiato qualcosa
-        self.richiedi_lettura_settori_inseribili()
-
-    def parse_settori_inseribili(self, data):
-        decode = recive(data)
-        self._settori_inseribili = read_settori_inseribili(decode[4:])
-        self.update_signals("settore_inseribile", self._settori_inseribili)
-
-    def parse_stato_ingressi(self, data):
-        decode = recive(data)
-        self._ingressi = read_stato_ingressi(decode[4:])
-        self.update_signals("ingresso", self._ingressi)
-
-    def parse_accesso_sistema(self, data):
-        decode = recive(data)
-        response = decode[4]
-        if (response == 0x06):
-            self.logged_in = True
-        else:
-            self.logged_in = False
-            _LOGGER.debug("wrong authentication")
+        self.save_state()
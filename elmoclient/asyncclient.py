@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from .base import ElmoBase, set_socket_options
+from .protocol import UnsolicitedFrame
+from .events import stream_events_async
+from .config import load_config_async
+from .elmoprocessor import (
+    cmd_accesso_sistema,
+    cmd_leggi_nuovi_eventi,
+    cmd_lettura_memoria,
+    cmd_leggi_stringa,
+    build_frame,
+    frame_inserisci_settore,
+    frame_disinserisci_settore,
+    FrameError,
+    CMD_SETTORI_INSERIBILI,
+    CMD_STATO_INGRESSI,
+    CMD_STATUSINFO,
+    CMD_ALLINEAMENTO_RIDOTTO,
+    MAX_EVENT_BATCH,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsyncElmoClient(ElmoBase):
+    """Elmo client running on an asyncio event loop.
+
+    The connection and the polling run in a single task per panel, so any
+    number of panels can share one event loop without extra threads. The
+    command and read methods are coroutines that return once the control
+    unit has answered and return a CommandResult; requests on the same
+    connection are serialized.
+    """
+
+    def __init__(
+        self,
+        host,
+        port=10001,
+        timeout=2,
+        num_ingressi=32,
+        num_uscite=32,
+        user="",
+        password="",
+        poll_scheduler=None,
+        dispatcher=None,
+        metrics=True,
+        trace=None,
+        state_path=None,
+        backoff=None,
+    ):
+        """ Initialize AsyncElmoClient object """
+        ElmoBase.__init__(
+            self, num_ingressi, num_uscite, poll_scheduler, dispatcher, metrics, trace, state_path, backoff
+        )
+        self.host = host
+        self.port = port
+        self._user = user
+        self._password = password
+        self.timeout = timeout
+        self.polling_enabled = False
+        self.connected = False
+
+        self._reader = None
+        self._writer = None
+        self._task = None
+        self._lock = None
+        self._connected_event = None
+        self._lost_event = None
+        self._lettura_inseribili = False
+        self._lettura_ingressi = False
+
+    async def start(self):
+        """Start the connection and polling task."""
+        if self._task and not self._task.done():
+            _LOGGER.error("start() called while already running")
+            return
+        self._loop_primitives()
+        self._lost_event = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the connection and polling task."""
+        if not self._task or self._task.done():
+            _LOGGER.debug("stop() called but the client is not running")
+        else:
+            # wait_for() può assorbire una cancellazione che arriva insieme
+            # al suo timeout: si ripete finché il task non è terminato
+            while not self._task.done():
+                self._task.cancel()
+                await asyncio.wait([self._task], timeout=0.1)
+        self._disconnect()
+        self.save_state()
+
+    async def wait_connected(self, timeout=None):
+        """Wait until the connection to the control unit is established."""
+        self._loop_primitives()
+        await asyncio.wait_for(self._connected_event.wait(), timeout)
+
+    def _loop_primitives(self):
+        # creati dentro il loop alla prima occasione: prima di Python 3.10
+        # Lock ed Event si legano al loop corrente quando sono creati
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._connected_event = asyncio.Event()
+
+    async def accesso_sistema(self):
+        cmd = build_frame(cmd_accesso_sistema(self._user, self._password))
+        return await self._request("accesso_sistema", cmd)
+
+    async def inserisci_settore(self, num_settore):
+        cmd = frame_inserisci_settore(num_settore)
+        return await self._request("ins_settore", cmd)
+
+    async def disinserisci_settore(self, num_settore):
+        cmd = frame_disinserisci_settore(num_settore)
+        return await self._request("disins_settore", cmd)
+
+    async def lettura_settori_inseribili(self):
+        return await self._request("lettura_inseribili", CMD_SETTORI_INSERIBILI)
+
+    async def lettura_stato_ingressi(self):
+        return await self._request("lettura_ingressi", CMD_STATO_INGRESSI)
+
+    async def allineamento_ridotto(self):
+        return await self._request("allineamento_ridotto", CMD_ALLINEAMENTO_RIDOTTO)
+
+    async def leggi_nuovi_eventi(self, count=MAX_EVENT_BATCH):
+        """Read up to `count` events from event_cursor on; see eventi()."""
+        cmd = build_frame(cmd_leggi_nuovi_eventi(self.event_cursor or 0, count))
+        return await self._request("leggi_eventi", cmd)
+
+    def eventi(self, cursor_path=None, follow=False, interval=1.0):
+        """Async iterator over the new events of the log, see elmoclient.events."""
+        return stream_events_async(self, cursor_path, follow, interval)
+
+    async def leggi_statusinfo(self):
+        return await self._request("statusinfo", CMD_STATUSINFO)
+
+    async def leggi_memoria(self, address, length):
+        return await self._request("lettura_memoria", build_frame(cmd_lettura_memoria(address, length)))
+
+    async def leggi_stringa(self, classe, elemento):
+        return await self._request("leggi_stringa", build_frame(cmd_leggi_stringa(classe, elemento)))
+
+    async def leggi_configurazione(self, cache_dir=None, refresh=False):
+        """Return the PanelConfig (element counts and names), see elmoclient.config."""
+        return await load_config_async(self, cache_dir, refresh)
+
+    def richiedi_lettura_settori_inseribili(self):
+        # eseguita dal task di polling dopo l'aggiornamento in corso
+        self._lettura_inseribili = True
+
+    def richiedi_lettura_stato_ingressi(self):
+        self._lettura_ingressi = True
+
+    async def _request(self, command, tx):
+        """Send a command frame, parse its reply and return a CommandResult.
+
+        Raises TimeoutError when the control unit does not answer within
+        `timeout` seconds, ConnectionError when not connected and
+        FrameError for an invalid reply.
+        """
+        if not self.connected:
+            raise ConnectionError(f"not connected to {self.host}:{self.port}")
+        self._loop_primitives()
+        async with self._lock:
+            if not self.connected:
+                raise ConnectionError(f"not connected to {self.host}:{self.port}")
+            tx = self.send_request(command, tx)
+            metrics = self._metrics
+            try:
+                self._writer.write(tx)
+                metrics.sent(len(tx))
+                await self._writer.drain()
+                event = await asyncio.wait_for(self._recv_reply(), self.timeout)
+            except asyncio.TimeoutError:
+                _LOGGER.debug(f"Socket timeout while receiving data for {command}")
+                metrics.timeout()
+                self._connection_lost()
+                raise TimeoutError(f"no reply to {command}") from None
+            except OSError:
+                self._connection_lost()
+                raise
+            except BaseException:
+                # richiesta annullata: la risposta arriverebbe al posto di
+                # quella della richiesta successiva, si riapre la connessione
+                self.protocol.timeout()
+                self._connection_lost()
+                raise
+            return self.handle_event(event)
+
+    async def _recv_reply(self):
+        reply = None
+        while reply is None:
+            data = await self._reader.read(4096)
+            if not data:
+                raise ConnectionResetError("connection closed by the control unit")
+            for event in self.data_received(data):
+                if type(event) is UnsolicitedFrame:
+                    self.handle_event(event)
+                else:
+                    reply = event
+        return reply
+
+    async def _run(self):
+        warning_posted = False
+        self.backoff.reset()
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout
+                )
+            except (OSError, asyncio.TimeoutError):
+                if warning_posted is False:
+                    _LOGGER.debug(
+                        f"attempting to connect to {self.host}:{self.port}, "
+                        "no success yet"
+                    )
+                    warning_posted = True
+                await asyncio.sleep(self.backoff.next_delay())
+                continue
+
+            warning_posted = False
+            self.backoff.reset()
+            _LOGGER.debug(f"connected to {self.host}:{self.port}")
+            sock = self._writer.get_extra_info("socket")
+            if sock is not None:
+                set_socket_options(sock)
+            self.protocol.reset()
+            self._lost_event.clear()
+            self.connected = True
+            self._metrics.connection_restored()
+            try:
+                if self.logged_in:
+                    # la sessione non sopravvive alla connessione
+                    _LOGGER.debug("replaying login")
+                    try:
+                        await self.accesso_sistema()
+                    except FrameError:
+                        pass
+                self._connected_event.set()
+                await self._poll()
+            except (OSError, TimeoutError):
+                pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _LOGGER.exception(f"unexpected error on {self.host}:{self.port}")
+            finally:
+                self._disconnect()
+            _LOGGER.debug(f"lost connection to {self.host}:{self.port}")
+
+    async def _poll(self):
+        while True:
+            # niente wait_for() sull'evento: la perdita della connessione
+            # viene vista al giro successivo
+            delay = self.poll_scheduler.next_delay()
+            deadline = time.monotonic() + delay
+            await asyncio.sleep(delay)
+            if self._lost_event.is_set():
+                return
+            try:
+                if self.polling_enabled:
+                    self._metrics.poll_started(deadline)
+                    await self.allineamento_ridotto()
+                if self._lettura_inseribili:
+                    self._lettura_inseribili = False
+                    await self.lettura_settori_inseribili()
+                if self._lettura_ingressi:
+                    self._lettura_ingressi = False
+                    await self.lettura_stato_ingressi()
+            except FrameError:
+                # già contato in frames_rejected, il frame successivo è valido
+                continue
+
+    def _connection_lost(self):
+        if self.connected:
+            self._metrics.connection_lost()
+        self.connected = False
+        if self._lost_event is not None:
+            self._lost_event.set()
+
+    def _disconnect(self):
+        self.connected = False
+        if self._connected_event is not None:
+            self._connected_event.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None
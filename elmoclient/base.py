@@ -0,0 +1,663 @@
+import logging
+import socket
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from types import MappingProxyType
+from .scheduler import PollScheduler, Backoff
+from .metrics import Metrics, NullMetrics
+from .status import StatusStore, Snapshot
+from .events import Event, stream_events
+from .config import load_config
+from . import statefile
+from .trace import TX, RX
+from .protocol import (
+    ElmoProtocol,
+    StatusFrame,
+    InseribiliFrame,
+    IngressiFrame,
+    LoginResult,
+    EventLogFrame,
+    InvalidFrame,
+    UnsolicitedFrame,
+    reply_event,
+)
+from .elmoprocessor import (
+    ACK,
+    cmd_accesso_sistema,
+    cmd_leggi_nuovi_eventi,
+    cmd_lettura_memoria,
+    cmd_leggi_stringa,
+    build_frame,
+    frame_inserisci_settore,
+    frame_disinserisci_settore,
+    CMD_SETTORI_INSERIBILI,
+    CMD_STATO_INGRESSI,
+    CMD_STATUSINFO,
+    MAX_EVENT_BATCH,
+    recive,
+    FrameError,
+    bitmask,
+    bitmask_invertita,
+    allineamento_ridotto_blocks,
+    read_settori_inseribili,
+    read_stato_ingressi,
+    read_nuovi_eventi,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# secondi minimi tra due salvataggi del file di stato
+STATE_SAVE_INTERVAL = 1.0
+
+# secondi di inattività prima delle sonde keepalive, intervallo e numero
+KEEPALIVE = (10, 5, 3)
+
+
+def set_socket_options(sock):
+    """Disable Nagle and enable TCP keepalive on a client socket.
+
+    The frames are small requests waiting for a reply, so they must not
+    be delayed; keepalive finds a dead link while the polls are idle.
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    idle, interval, count = KEEPALIVE
+    # opzioni disponibili solo su alcune piattaforme
+    for name, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+SIGTYPES = [
+    "ingresso",
+    "uscita",
+    "settore",
+    "uscita_dedicata",
+    "memoria_uscita_dedicata",
+    "anomalia",
+    "settore_inseribile",
+]
+
+
+# Esito di un comando: codice di risposta della centrale (ACK, NAK, ENQ, BEL),
+# tempo di andata e ritorno in secondi e dati della risposta (Stringacmd)
+CommandResult = namedtuple("CommandResult", ["code", "rtt", "data"])
+CommandResult.__new__.__defaults__ = (None,)
+
+# Cambiamenti di un frame decodificato, per subscribe_changes(): timestamp
+# (time.time()) e tupla di Change con il nome completo del sigtype
+Change = namedtuple("Change", ["sigtype", "pos", "old", "new"])
+ChangeSet = namedtuple("ChangeSet", ["timestamp", "changes"])
+
+# per controllare i sigtype senza scorrere la lista
+_SIGTYPE_SET = frozenset(SIGTYPES)
+
+# risposte che portano lo stato della centrale: dopo la prima lo stato
+# ripristinato dal file non è più stale
+_STATUS_REPLIES = (StatusFrame, InseribiliFrame, IngressiFrame)
+
+# Blocchi di ALLINEAMENTORIDOTTO, nell'ordine di notifica: indice in
+# allineamento_ridotto_blocks(), attributo, sigtype (None: non pubblicato)
+# e decodifica
+_ALLINEAMENTO_SIGNALS = (
+    (0, "_ingressi", "ingresso", bitmask),
+    (2, "_uscite", "uscita", bitmask),
+    (5, "_settori", "settore", bitmask),
+    (7, "_anomalia", "anomalia", bitmask_invertita),
+    (3, "_uscita_dedicata", "uscita_dedicata", bitmask_invertita),
+    (4, "_memoria_uscita_dedicata", "memoria_uscita_dedicata", bitmask_invertita),
+    (1, "_memoria_ingressi", None, bitmask),
+    (6, "_settori_max_sicurezza", None, bitmask),
+)
+
+
+class ElmoBase:
+    """Panel status and response parsing shared by the Elmo clients.
+
+    Subclasses own the transport: they get the bytes of a request from
+    send_request(), feed the bytes they read to data_received() and pass
+    the events it returns to handle_event(), see elmoclient.protocol.
+    The parse_* methods apply single frames, e.g. from a trace.
+    """
+
+    def __init__(
+        self,
+        num_ingressi=32,
+        num_uscite=32,
+        poll_scheduler=None,
+        dispatcher=None,
+        metrics=True,
+        trace=None,
+        state_path=None,
+        backoff=None,
+    ):
+        """ Initialize the panel status """
+        self.poll_scheduler = poll_scheduler or PollScheduler()
+        # attese tra i tentativi di riconnessione
+        self.backoff = backoff or Backoff()
+        # None: callback eseguite subito dal thread di I/O
+        self.dispatcher = dispatcher
+        # True: metriche di default, False: nessuna, oppure un oggetto Metrics
+        if metrics is True:
+            metrics = Metrics()
+        elif not metrics:
+            metrics = NullMetrics()
+        self._metrics = metrics
+        # WireTrace opzionale dei frame trasmessi e ricevuti
+        self.trace = trace
+        self._prev_status = None
+        # dati dell'ultimo frame di stato decodificato, per i frame uguali
+        self._status_data = None
+        # blocchi dell'ultimo ALLINEAMENTORIDOTTO: si decodificano solo quelli cambiati
+        self._prev_blocks = [None] * len(_ALLINEAMENTO_SIGNALS)
+        self.blocks_decoded = 0
+        self.blocks_skipped = 0
+        self.frames_rejected = 0
+        self.logged_in = False
+
+        self.join_lock = threading.Lock()
+        self._status = StatusStore({"ingresso": num_ingressi, "uscita": num_uscite})
+        self._snapshot = None
+        self._unpublished = False
+        # False finché lo stato viene dal file e non dalla centrale
+        self._live = True
+        self._publish_snapshot()
+        # file per il riavvio a caldo, salvato al più ogni state_interval secondi
+        self.state_path = state_path
+        self.state_interval = STATE_SAVE_INTERVAL
+        self._state_dirty = False
+        self._state_saved = 0.0
+        if state_path is not None:
+            self._restore_state()
+        self._change_subscribers = []
+        # stato della connessione, condiviso dai client
+        self.protocol = ElmoProtocol()
+        # aggiornamento dello stato per tipo di risposta
+        self._updates = {
+            InseribiliFrame: self._update_settori_inseribili,
+            IngressiFrame: self._update_stato_ingressi,
+            LoginResult: self._update_accesso_sistema,
+            EventLogFrame: self._update_eventi,
+        }
+        # indice del prossimo evento da leggere dal registro, None: dal più vecchio
+        self.event_cursor = None
+        self._eventi = deque()
+
+    def richiedi_lettura_settori_inseribili(self):
+        """Queue a LETTURAINSERIBILI read; a client without transport does nothing."""
+
+    def richiedi_lettura_stato_ingressi(self):
+        """Queue a STATOINGRESSI read; a client without transport does nothing."""
+
+    def get(self, sigtype, pos):
+        """Get the current value of a pos."""
+        # le maschere dello snapshot hanno una chiave per ogni sigtype valido
+        try:
+            mask = self._masks[sigtype]
+        except KeyError:
+            raise ValueError(f"get(): '{sigtype}' is not a valid signal sigtype") from None
+        return (mask >> (pos - 1)) & 1 if pos > 0 else 0
+
+    def get_many(self, sigtype, positions):
+        """Get the values of `positions`, all from the same frame."""
+        if sigtype not in _SIGTYPE_SET:
+            raise ValueError(f"get_many(): '{sigtype}' is not a valid signal sigtype")
+        return self._snapshot.get_many(sigtype, positions)
+
+    def get_all(self, sigtype):
+        """Get {pos: value} for every position of a sigtype."""
+        if sigtype not in _SIGTYPE_SET:
+            raise ValueError(f"get_all(): '{sigtype}' is not a valid signal sigtype")
+        return self._snapshot.get_all(sigtype)
+
+    def snapshot(self):
+        """Return the immutable Snapshot of the last decoded frame."""
+        return self._snapshot
+
+    def metrics(self):
+        """Return the counters and histograms of the client as a dict.
+
+        The keys are described in elmoclient.metrics; with metrics disabled
+        only frames_rejected and the blocks_decoded/blocks_skipped counts of
+        the status blocks are there.
+        """
+        values = self._metrics.as_dict()
+        values["frames_rejected"] = self.frames_rejected
+        values["blocks_decoded"] = self.blocks_decoded
+        values["blocks_skipped"] = self.blocks_skipped
+        return values
+
+    @property
+    def stale(self):
+        """True while the status is the one restored from state_path."""
+        return self._snapshot.stale
+
+    @property
+    def version(self):
+        """Grows by one for every frame that changes the status."""
+        return self._snapshot.version
+
+    def subscribe(self, sigtype, pos, callback):
+        """Subscribe to join change events by specifying callback functions."""
+        if sigtype not in _SIGTYPE_SET:
+            raise ValueError(f"subscribe(): '{sigtype}' is not a valid signal sigtype")
+
+        self._status.subscribe(sigtype, pos, callback)
+
+    def subscribe_changes(self, callback, sigtypes=None):
+        """Call callback(changeset) once per decoded frame that changes something.
+
+        The ChangeSet lists every changed position of the frame, restricted
+        to `sigtypes` when given.
+        """
+        if sigtypes is not None:
+            for sigtype in sigtypes:
+                if sigtype not in _SIGTYPE_SET:
+                    raise ValueError(f"subscribe_changes(): '{sigtype}' is not a valid signal sigtype")
+            sigtypes = frozenset(sigtypes)
+        with self.join_lock:
+            self._change_subscribers.append((callback, sigtypes))
+
+    def update_signals(self, sigtype, data, changes=None):
+        """Update a sigtype from its bitmask and notify the changed positions.
+
+        `data` is an int where bit (pos - 1) holds the value of position pos
+        (see elmoprocessor.bitmask); a "0"/"1" string with position 1 first
+        is accepted too. Only the bits that differ from the previous mask
+        are visited, and only when someone listens to them: with no
+        callback on `sigtype` and no change-set subscriber just the new
+        snapshot is published. The changes are appended to the `changes`
+        list, or published right away (snapshot, callbacks, change set)
+        when it is None.
+        """
+        if isinstance(data, str):
+            data = int(data[::-1], 2) if data else 0
+        store = self._status
+        changed = store.masks[sigtype] ^ data
+        if not changed:
+            return
+        store.masks[sigtype] = data
+        if data.bit_length() > store.size(sigtype):
+            store.resize(sigtype, data.bit_length())
+        # lo snapshot va pubblicato anche se nessuno riceve le modifiche
+        self._unpublished = True
+        batch = [] if changes is None else changes
+        if store.callbacks[sigtype] or self._change_subscribers or _LOGGER.isEnabledFor(logging.DEBUG):
+            while changed:
+                bit = changed & -changed
+                changed ^= bit
+                pos = bit.bit_length()
+                value = 1 if data & bit else 0
+                batch.append(Change(sigtype, pos, value ^ 1, value))
+        if changes is None:
+            self._publish(batch)
+
+    def _publish(self, changes):
+        """Publish the snapshot of a frame, then notify its changes."""
+        if not self._unpublished:
+            return
+        # prima lo snapshot: le callback che chiamano get() vedono il frame nuovo
+        self._publish_snapshot()
+        metrics = self._metrics
+        start = time.perf_counter() if metrics.enabled else None
+        subscribed = self._status.callbacks
+        dispatcher = self.dispatcher
+        debug = _LOGGER.isEnabledFor(logging.DEBUG)
+        for sigtype, pos, _, value in changes:
+            callbacks = subscribed[sigtype].get(pos)
+            if callbacks is None:
+                continue
+            for callback in callbacks:
+                if dispatcher is None:
+                    # una callback che fallisce non ferma le altre né il thread di I/O
+                    try:
+                        callback(sigtype[0], pos, value)
+                    except Exception:
+                        _LOGGER.exception(f"callback {getattr(callback, '__qualname__', callback)} failed")
+                else:
+                    dispatcher.dispatch(callback, sigtype, pos, value)
+            if debug:
+                _LOGGER.debug("  : %s %s = %s", sigtype, pos, value)
+        self._publish_changes(changes)
+        if start is not None:
+            metrics.observe_callbacks(time.perf_counter() - start)
+        if self.state_path is not None:
+            self._state_dirty = True
+
+    def _publish_snapshot(self, timestamp=None):
+        # un solo assegnamento: i lettori vedono il frame precedente o questo
+        store = self._status
+        self._unpublished = False
+        masks = dict(store.masks)
+        # le maschere dello snapshot anche senza il proxy, per get()
+        self._masks = masks
+        self._snapshot = Snapshot(
+            self._snapshot.version + 1 if self._snapshot else 0,
+            timestamp or time.time(),
+            MappingProxyType(masks),
+            MappingProxyType({sigtype: store.size(sigtype) for sigtype in SIGTYPES}),
+            not self._live,
+        )
+
+    def save_state(self):
+        """Write the status and the last frame to state_path, see elmoclient.statefile."""
+        if self.state_path is None:
+            return
+        snapshot = self._snapshot
+        try:
+            statefile.save_state(self.state_path, snapshot.timestamp, self._prev_status, snapshot.masks, SIGTYPES)
+        except OSError as err:
+            _LOGGER.warning("state not saved to %s: %s", self.state_path, err)
+        self._state_dirty = False
+        self._state_saved = time.monotonic()
+
+    def _restore_state(self):
+        """Load the status saved in state_path and publish it as stale, without callbacks."""
+        try:
+            saved = statefile.load_state(self.state_path, SIGTYPES)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as err:
+            _LOGGER.warning("state not restored from %s: %s", self.state_path, err)
+            return
+        if saved.frame is not None:
+            try:
+                payload = recive(saved.frame)[4:]
+                self._resize_blocks(payload)
+            except FrameError:
+                pass
+            else:
+                self._prev_status = saved.frame
+                self._prev_blocks = allineamento_ridotto_blocks(payload)
+        store = self._status
+        for sigtype, mask in saved.masks.items():
+            store.masks[sigtype] = mask
+            if mask.bit_length() > store.size(sigtype):
+                store.resize(sigtype, mask.bit_length())
+        # una maschera letta dopo il frame (STATOINGRESSI) non corrisponde al
+        # suo blocco: il prossimo frame deve decodificarlo di nuovo
+        for index, _attr, sigtype, decode_block in _ALLINEAMENTO_SIGNALS:
+            block = self._prev_blocks[index]
+            if sigtype is None or block is None:
+                continue
+            if decode_block(block) != saved.masks.get(sigtype, 0):
+                self._prev_blocks[index] = None
+                self._prev_status = None
+        self._live = False
+        self._publish_snapshot(saved.saved_at)
+
+    def _publish_changes(self, changes):
+        if not self._change_subscribers:
+            return
+        changeset = ChangeSet(time.time(), tuple(changes))
+        for callback, sigtypes in self._change_subscribers:
+            if sigtypes is None:
+                selected = changeset
+            else:
+                selected = tuple(change for change in changeset.changes if change.sigtype in sigtypes)
+                if not selected:
+                    continue
+                selected = ChangeSet(changeset.timestamp, selected)
+            if self.dispatcher is None:
+                try:
+                    callback(selected)
+                except Exception:
+                    _LOGGER.exception(f"callback {getattr(callback, '__qualname__', callback)} failed")
+            else:
+                self.dispatcher.submit(callback, callback, selected)
+
+    def _timed_parse(self, parse, *args):
+        """Run parse(*args) recording its time, without the callbacks, in the metrics.
+
+        Afterwards a restored status stops being stale if a valid frame
+        arrived, and the state file is saved when due.
+        """
+        metrics = self._metrics
+        if metrics.enabled:
+            callbacks = metrics.callback_time.sum
+            start = time.perf_counter()
+            try:
+                result = parse(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.observe_parse(elapsed - (metrics.callback_time.sum - callbacks))
+        else:
+            result = parse(*args)
+        if self._live and self._snapshot.stale:
+            # primo frame dalla centrale dopo il ripristino
+            self._publish_snapshot()
+        if self._state_dirty and time.monotonic() - self._state_saved >= self.state_interval:
+            self.save_state()
+        return result
+
+    def parse_update(self, data):
+        """ parse incoming status update only when different from the previous status """
+        self._parse_frame("allineamento_ridotto", data)
+
+    def parse_settori_inseribili(self, data):
+        self._parse_frame("lettura_inseribili", data)
+
+    def parse_stato_ingressi(self, data):
+        self._parse_frame("lettura_ingressi", data)
+
+    def parse_accesso_sistema(self, data):
+        self._parse_frame("accesso_sistema", data)
+
+    def _parse_frame(self, command, data):
+        try:
+            self.command_result(command, data, 0.0)
+        except FrameError:
+            pass
+
+    def parse_reply(self, command, data):
+        """Parse the reply to `command` and return its response code.
+
+        Raises FrameError, after counting it in frames_rejected, when the
+        reply is not a valid frame.
+        """
+        return self.command_result(command, data, 0.0).code
+
+    def command_result(self, command, data, rtt):
+        """Parse the reply to `command` like parse_reply() and return its CommandResult."""
+        return self._timed_parse(self._apply_frame, command, data, rtt)
+
+    def _apply_frame(self, command, data, rtt):
+        return self._apply(reply_event(command, data, rtt, self._prev_status))
+
+    def send_request(self, command, tx=None):
+        """Start the request `command` on the protocol and return the bytes to send."""
+        tx = self.protocol.send(command, tx)
+        if command != "allineamento_ridotto":
+            self.poll_scheduler.on_command()
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("TX:%s <%s>", command, tx.hex())
+        if self.trace is not None:
+            self.trace.record(TX, tx)
+        return tx
+
+    def data_received(self, data):
+        """Feed bytes read from the connection to the protocol; return its events."""
+        self._metrics.received(len(data))
+        return self.protocol.receive_data(data)
+
+    def handle_event(self, event):
+        """Apply an event of the protocol to the status.
+
+        Returns the CommandResult of a reply, or None for an unsolicited
+        frame. Raises FrameError, after counting it in frames_rejected,
+        for an InvalidFrame.
+        """
+        if self.trace is not None:
+            self.trace.record(RX, event.frame)
+        if type(event) is UnsolicitedFrame:
+            if _LOGGER.isEnabledFor(logging.DEBUG):
+                _LOGGER.debug("RX:unsolicited <%s>", event.frame.hex())
+            return None
+        self._metrics.observe_rtt(event.command, event.rtt)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("RX:%s <%s>", event.command, event.frame.hex())
+        return self._timed_parse(self._apply, event)
+
+    def _apply(self, event):
+        kind = type(event)
+        if kind is InvalidFrame:
+            self.frames_rejected += 1
+            _LOGGER.debug("frame rejected: %s", event.error)
+            raise FrameError(f"invalid reply to {event.command}")
+        self._metrics.frame_received()
+        if kind in _STATUS_REPLIES:
+            self._live = True
+        if kind is StatusFrame:
+            if event.decode is None:
+                # frame uguale al precedente: nessuna nuova decodifica, nemmeno per i dati
+                self.poll_scheduler.on_unchanged()
+                if self._status_data is not None:
+                    return CommandResult(ACK, event.rtt, self._status_data)
+                return CommandResult(event.code, event.rtt, event.data)
+            self._status_data = event.data
+            if event.frame == self._prev_status:
+                self.poll_scheduler.on_unchanged()
+            else:
+                self._update_allineamento(event.frame, event.decode)
+            return CommandResult(event.code, event.rtt, self._status_data)
+        update = self._updates.get(kind)
+        if update is not None:
+            update(event.decode)
+        return CommandResult(event.code, event.rtt, event.data)
+
+    def _update_allineamento(self, data, decode):
+        # riduco stringa scartando Lmsg + Flag +Ind(msb) + Ind(lsb)
+        payload = decode[4:]
+        self._resize_blocks(payload)
+        blocks = allineamento_ridotto_blocks(payload)
+        prev = self._prev_blocks
+        changes = []
+        for index, attr, sigtype, decode_block in _ALLINEAMENTO_SIGNALS:
+            block = blocks[index]
+            if block == prev[index]:
+                # stessi byte del frame precedente: niente da decodificare
+                self.blocks_skipped += 1
+                continue
+            self.blocks_decoded += 1
+            prev[index] = block
+            mask = decode_block(block)
+            setattr(self, attr, mask)
+            if sigtype is not None:
+                self.update_signals(sigtype, mask, changes)
+        self._publish(changes)
+        self._prev_status = data
+        self.poll_scheduler.on_change()
+        # aggiorna lo stato degli inseribili visto che è cambiato qualcosa
+        self.richiedi_lettura_settori_inseribili()
+
+    def _resize_blocks(self, data):
+        # i primi byte riportano la lunghezza in byte di ogni blocco
+        sizes = (
+            ("ingresso", data[0]),
+            ("uscita", data[2]),
+            ("uscita_dedicata", data[3]),
+            ("memoria_uscita_dedicata", data[4]),
+            ("settore", data[5]),
+        )
+        for sigtype, count in sizes:
+            if count * 8 > self._status.size(sigtype):
+                self._status.resize(sigtype, count * 8)
+
+    def _update_settori_inseribili(self, decode):
+        self._settori_inseribili = read_settori_inseribili(decode[4:], as_mask=True)
+        self.update_signals("settore_inseribile", self._settori_inseribili)
+
+    def _update_stato_ingressi(self, decode):
+        self._ingressi = read_stato_ingressi(decode[4:], as_mask=True)
+        self.update_signals("ingresso", self._ingressi)
+        # il prossimo ALLINEAMENTORIDOTTO va decodificato anche se uguale al
+        # precedente, e il suo blocco ingressi confrontato con questi
+        self._prev_blocks[0] = None
+        self._prev_status = None
+        self.protocol.last_status = None
+
+    def _update_eventi(self, decode):
+        if len(decode) == 5:
+            # solo il codice di risposta, nessun evento
+            return
+        cursor, eventi = read_nuovi_eventi(decode[4:])
+        self._eventi.extend(Event(*evento) for evento in eventi)
+        self.event_cursor = cursor
+
+    def _update_accesso_sistema(self, decode):
+        response = decode[4]
+        if (response == 0x06):
+            self.logged_in = True
+        else:
+            self.logged_in = False
+            _LOGGER.debug("wrong authentication")
+
+
+class QueuedElmoBase(ElmoBase):
+    """ElmoBase whose commands go through `tx_queue` and return a Future.
+
+    The Future resolves with the CommandResult of the reply. Subclasses
+    create `tx_queue` and the connection settings, send the queued frames
+    from their I/O thread and override _put() to wake it up.
+    """
+
+    def _put(self, command, tx, key=None, read=False):
+        """Queue a command frame; the returned Future resolves with its CommandResult."""
+        future = Future()
+        self.tx_queue.put(command, tx, future, key, read)
+        return future
+
+    def accesso_sistema(self):
+        cmd = build_frame(cmd_accesso_sistema(self._user, self._password))
+        return self._put("accesso_sistema", cmd)
+
+    def _replay_login(self):
+        """Queue the login before any other command on a new connection."""
+        future = Future()
+        cmd = build_frame(cmd_accesso_sistema(self._user, self._password))
+        self.tx_queue.put("accesso_sistema", cmd, future, first=True)
+        return future
+
+    def inserisci_settore(self, num_settore):
+        cmd = frame_inserisci_settore(num_settore)
+        return self._put("ins_settore", cmd, key=("settore", num_settore))
+
+    def disinserisci_settore(self, num_settore):
+        cmd = frame_disinserisci_settore(num_settore)
+        return self._put("disins_settore", cmd, key=("settore", num_settore))
+
+    def richiedi_lettura_settori_inseribili(self):
+        return self._put("lettura_inseribili", CMD_SETTORI_INSERIBILI, read=True)
+
+    def richiedi_lettura_stato_ingressi(self):
+        return self._put("lettura_ingressi", CMD_STATO_INGRESSI, read=True)
+
+    def leggi_nuovi_eventi(self, count=MAX_EVENT_BATCH):
+        """Read up to `count` events from event_cursor on; see eventi()."""
+        cmd = build_frame(cmd_leggi_nuovi_eventi(self.event_cursor or 0, count))
+        return self._put("leggi_eventi", cmd, read=True)
+
+    def eventi(self, cursor_path=None, follow=False, interval=1.0, timeout=None):
+        """Iterate over the new events of the log, see elmoclient.events."""
+        return stream_events(self, cursor_path, follow, interval, timeout)
+
+    def leggi_statusinfo(self):
+        return self._put("statusinfo", CMD_STATUSINFO, read=True)
+
+    def leggi_memoria(self, address, length):
+        cmd = build_frame(cmd_lettura_memoria(address, length))
+        return self._put("lettura_memoria", cmd, key=("memoria", address, length), read=True)
+
+    def leggi_stringa(self, classe, elemento):
+        cmd = build_frame(cmd_leggi_stringa(classe, elemento))
+        return self._put("leggi_stringa", cmd, key=("stringa", classe, elemento), read=True)
+
+    def leggi_configurazione(self, cache_dir=None, refresh=False, timeout=None):
+        """Return the PanelConfig (element counts and names), see elmoclient.config.
+
+        Blocks until the control unit has answered: do not call it from a
+        callback running on the I/O thread.
+        """
+        return load_config(self, cache_dir, refresh, timeout)
@@ -0,0 +1,115 @@
+import threading
+from collections import deque
+
+
+def _chain(source, target):
+    """Complete `target` with the outcome of `source`."""
+
+    def copy(future):
+        if target.done():
+            return
+        if future.cancelled():
+            target.cancel()
+        elif future.exception() is not None:
+            target.set_exception(future.exception())
+        else:
+            target.set_result(future.result())
+
+    source.add_done_callback(copy)
+
+
+class CommandQueue:
+    """Commands waiting to be sent to the control unit.
+
+    Commands are served before reads. An entry queued with a key is
+    coalesced with the pending entry of the same key:
+
+    - the same frame again (a repeated read, or the same command on the
+      same sector) is dropped and its future completes with the result
+      of the pending one;
+    - a different frame (arm then disarm of the same sector) replaces the
+      pending one, which is cancelled: the last command wins.
+
+    `depth` is the number of queued entries and `dropped` counts the
+    entries removed by coalescing. Items are (command, tx, future) tuples.
+    An entry queued with first=True goes before the others of its lane.
+    """
+
+    def __init__(self):
+        """ Initialize CommandQueue object """
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._commands = deque()
+        self._reads = deque()
+        self._keys = {}
+        self._woken = False
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._commands) + len(self._reads)
+
+    @property
+    def depth(self):
+        return len(self)
+
+    def put(self, command, tx, future, key=None, read=False, first=False):
+        """Queue a command frame; reads use the command name as default key."""
+        if read and key is None:
+            key = command
+        superseded = None
+        with self._lock:
+            lane = self._reads if read else self._commands
+            pending = self._keys.get(key) if key is not None else None
+            if pending is not None and not pending[2].cancelled():
+                self.dropped += 1
+                if pending[1] == tx:
+                    _chain(pending[2], future)
+                    return
+                lane.remove(pending)
+                superseded = pending[2]
+            entry = (command, tx, future, key)
+            if first:
+                lane.appendleft(entry)
+            else:
+                lane.append(entry)
+            if key is not None:
+                self._keys[key] = entry
+            self._not_empty.notify()
+        # fuori dal lock: cancel() esegue le callback del future
+        if superseded is not None:
+            superseded.cancel()
+
+    def get(self, timeout=None):
+        """Return the next (command, tx, future), or None after `timeout` or wake()."""
+        with self._lock:
+            self._not_empty.wait_for(lambda: self._commands or self._reads or self._woken, timeout)
+            if self._woken:
+                self._woken = False
+                return None
+            if self._commands:
+                entry = self._commands.popleft()
+            elif self._reads:
+                entry = self._reads.popleft()
+            else:
+                return None
+            command, tx, future, key = entry
+            if key is not None and self._keys.get(key) is entry:
+                del self._keys[key]
+            return command, tx, future
+
+    def wake(self):
+        """Make a blocked get() return None."""
+        with self._lock:
+            self._woken = True
+            self._not_empty.notify_all()
+
+    def clear(self):
+        """Drop every queued entry and cancel its future."""
+        with self._lock:
+            entries = list(self._commands) + list(self._reads)
+            self._commands.clear()
+            self._reads.clear()
+            self._keys.clear()
+            self._woken = False
+        for entry in entries:
+            entry[2].cancel()
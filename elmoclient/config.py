@@ -0,0 +1,155 @@
+"""Configuration of the control unit: element counts and names.
+
+leggi_configurazione() on a client reads STATUSINFO, then the configuration
+memory in chunks of up to MAX_MEMORY_CHUNK bytes to find the elements in
+use, then the names of those elements only. The memory chunks and the
+names are queued all at once, so they go out back to back instead of
+waiting for the polls in between.
+
+With `cache_dir` the configuration is saved as JSON, keyed by the serial
+number and firmware of the panel: the next load reads only STATUSINFO.
+Pass refresh=True after changing the configuration on the panel.
+
+The reply layouts are described in elmoprocessor, next to read_statusinfo.
+"""
+import json
+import os
+from collections import namedtuple
+from .elmoprocessor import (
+    ACK,
+    INGRESSO,
+    USCITA,
+    GRUPPO,
+    MAX_MEMORY_CHUNK,
+    read_statusinfo,
+    read_memoria,
+    read_stringa,
+)
+
+# serial e firmware identificano la centrale, num_* sono gli elementi che
+# gestisce, config_* l'area di memoria della configurazione
+PanelInfo = namedtuple(
+    "PanelInfo",
+    ["serial", "firmware", "num_ingressi", "num_uscite", "num_settori", "config_address", "config_length"],
+)
+
+# names: {sigtype: {pos: nome}} per gli elementi in uso
+PanelConfig = namedtuple("PanelConfig", ["info", "names"])
+
+# classe elemento di LEGGISTRINGHE per sigtype
+ELEMENT_CLASSES = {"ingresso": INGRESSO, "uscita": USCITA, "settore": GRUPPO}
+
+
+def memory_chunks(info, chunk=MAX_MEMORY_CHUNK):
+    """Return the (address, length) reads that cover the configuration area."""
+    end = info.config_address + info.config_length
+    return [
+        (address, min(chunk, end - address))
+        for address in range(info.config_address, end, chunk)
+    ]
+
+
+def elements_in_use(info, memory):
+    """Return [(sigtype, pos)] of the elements flagged in use in the configuration area."""
+    elements = []
+    offset = 0
+    for sigtype, count in (
+        ("ingresso", info.num_ingressi),
+        ("uscita", info.num_uscite),
+        ("settore", info.num_settori),
+    ):
+        for pos in range(1, count + 1):
+            if offset < len(memory) and memory[offset] & 0x01:
+                elements.append((sigtype, pos))
+            offset += 1
+    return elements
+
+
+def _check(result, what):
+    if result.code != ACK or len(result.data) <= 1:
+        raise ValueError(f"{what} refused by the control unit (code {result.code:#04x})")
+    return result.data
+
+
+def _cache_path(cache_dir, info):
+    firmware = ".".join(str(part) for part in info.firmware)
+    return os.path.join(cache_dir, f"panel-{info.serial:08x}-fw{firmware}.json")
+
+
+def load_cached(cache_dir, info):
+    """Return the cached PanelConfig of the panel described by `info`, or None."""
+    try:
+        with open(_cache_path(cache_dir, info)) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if PanelInfo(cached["info"][0], tuple(cached["info"][1]), *cached["info"][2:]) != info:
+        return None
+    names = {
+        sigtype: {int(pos): name for pos, name in elements.items()}
+        for sigtype, elements in cached["names"].items()
+    }
+    return PanelConfig(info, names)
+
+
+def save_cached(cache_dir, config):
+    """Save `config` in `cache_dir`; the file is replaced atomically."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, config.info)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"info": list(config.info), "names": config.names}, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _build(info, names):
+    config = PanelConfig(info, {sigtype: {} for sigtype in ELEMENT_CLASSES})
+    for (sigtype, pos), name in names:
+        if name is not None:
+            config.names[sigtype][pos] = name
+    return config
+
+
+def load_config(client, cache_dir=None, refresh=False, timeout=None):
+    """Read the PanelConfig with an ElmoClient or HubPanel, see the module docstring."""
+    info = PanelInfo(*read_statusinfo(_check(client.leggi_statusinfo().result(timeout), "STATUSINFO")))
+    if cache_dir is not None and not refresh:
+        cached = load_cached(cache_dir, info)
+        if cached is not None:
+            return cached
+
+    futures = [client.leggi_memoria(address, length) for address, length in memory_chunks(info)]
+    memory = b"".join(read_memoria(_check(future.result(timeout), "LETTURAMEMORIA")) for future in futures)
+    elements = elements_in_use(info, memory)
+    futures = [client.leggi_stringa(ELEMENT_CLASSES[sigtype], pos) for sigtype, pos in elements]
+    names = []
+    for element, future in zip(elements, futures):
+        result = future.result(timeout)
+        names.append((element, read_stringa(result.data) if result.code == ACK else None))
+
+    config = _build(info, names)
+    if cache_dir is not None:
+        save_cached(cache_dir, config)
+    return config
+
+
+async def load_config_async(client, cache_dir=None, refresh=False):
+    """load_config() for AsyncElmoClient."""
+    info = PanelInfo(*read_statusinfo(_check(await client.leggi_statusinfo(), "STATUSINFO")))
+    if cache_dir is not None and not refresh:
+        cached = load_cached(cache_dir, info)
+        if cached is not None:
+            return cached
+
+    memory = b""
+    for address, length in memory_chunks(info):
+        memory += read_memoria(_check(await client.leggi_memoria(address, length), "LETTURAMEMORIA"))
+    names = []
+    for sigtype, pos in elements_in_use(info, memory):
+        result = await client.leggi_stringa(ELEMENT_CLASSES[sigtype], pos)
+        names.append(((sigtype, pos), read_stringa(result.data) if result.code == ACK else None))
+
+    config = _build(info, names)
+    if cache_dir is not None:
+        save_cached(cache_dir, config)
+    return config
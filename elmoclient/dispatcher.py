@@ -0,0 +1,133 @@
+import logging
+import queue
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class CallbackDispatcher:
+    """Run the subscriber callbacks on worker threads instead of the I/O thread.
+
+    Every (sigtype, pos) is bound to one worker, so its callbacks run in the
+    order of the changes; different positions run in parallel. Each worker
+    has a queue of at most `maxsize` callbacks; when it is full `overflow`
+    decides what happens:
+
+    - "block": the I/O thread waits for room (nothing is lost);
+    - "drop_oldest": the oldest queued callback is discarded;
+    - "drop_newest": the new callback is discarded.
+
+    `lag_last` and `lag_max` hold the seconds between a change and the start
+    of its callback; a lag above `lag_warning` is logged with the callback
+    name, to find slow subscribers. A dispatcher can be shared by several
+    clients; the workers start with the first callback.
+    """
+
+    def __init__(self, workers=4, maxsize=1000, overflow="block", lag_warning=1.0):
+        """ Initialize CallbackDispatcher object """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"CallbackDispatcher(): '{overflow}' is not a valid overflow policy")
+        self.workers = workers
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.lag_warning = lag_warning
+        self.dispatched = 0
+        self.dropped = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self._queues = [queue.Queue(maxsize) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Callbacks queued and not started yet."""
+        return sum(lane.qsize() for lane in self._queues)
+
+    def stats(self):
+        return {
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "pending": self.pending,
+            "lag_last": self.lag_last,
+            "lag_max": self.lag_max,
+        }
+
+    def dispatch(self, callback, sigtype, pos, value):
+        """Queue callback(sigtype[0], pos, value) on the worker of (sigtype, pos)."""
+        self.submit((sigtype, pos), callback, sigtype[0], pos, value)
+
+    def submit(self, key, callback, *args):
+        """Queue callback(*args) after the callbacks already queued for `key`."""
+        if not self._threads:
+            self.start()
+        lane = self._queues[hash(key) % self.workers]
+        item = (time.monotonic(), callback, args)
+        if self.overflow == "block":
+            lane.put(item)
+            return
+        while True:
+            try:
+                lane.put_nowait(item)
+                return
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                if self.overflow == "drop_newest":
+                    return
+            try:
+                lane.get_nowait()
+                lane.task_done()
+            except queue.Empty:
+                pass
+
+    def start(self):
+        """Start the worker threads."""
+        with self._lock:
+            if self._threads:
+                return
+            for i, lane in enumerate(self._queues):
+                thread = threading.Thread(
+                    target=self._run, args=(lane,), name=f"Callbacks-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Run the queued callbacks and stop the worker threads."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for lane in self._queues[: len(threads)]:
+            lane.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def join(self):
+        """Wait until every queued callback has run."""
+        for lane in self._queues:
+            lane.join()
+
+    def _run(self, lane):
+        while True:
+            item = lane.get()
+            if item is None:
+                lane.task_done()
+                return
+            queued, callback, args = item
+            lag = time.monotonic() - queued
+            self.lag_last = lag
+            if lag > self.lag_max:
+                self.lag_max = lag
+            if lag > self.lag_warning:
+                _LOGGER.warning(f"callback {getattr(callback, '__qualname__', callback)} started {lag:.3f}s late")
+            try:
+                callback(*args)
+            except Exception:
+                _LOGGER.exception(f"callback {getattr(callback, '__qualname__', callback)} failed")
+            finally:
+                with self._lock:
+                    self.dispatched += 1
+                lane.task_done()
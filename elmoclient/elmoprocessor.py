@@ -1,4 +1,6 @@
 import binascii
+from collections import deque
+from functools import lru_cache
 from typing import ByteString
 
 STX = 0x02  # Inizio ricezione
@@ -54,6 +56,17 @@ CONTROLLOREMOTO = 0x2D
 CMD_SETTORI_INSERIBILI = b'\x02\x01\x08\x00\x00^\x00g\x03'
 CMD_ALLINEAMENTO_RIDOTTO = b'\x02\x01\x08\x00\x00?\x00H\x03'
 
+# STX + Lmsg + Flag + Ind(msb) + Ind(lsb) + crc(2) + ETX
+MIN_FRAME_SIZE = 8
+# Lmsg è un byte: nel caso peggiore ogni byte del messaggio viene raddoppiato
+MAX_FRAME_SIZE = 2 + 2 * (4 + 0xFF + 2)
+# secondo byte ammesso dopo un DLE
+DLE_ESCAPES = (STX + 0x80, ETX + 0x80, DLE + 0x80)
+
+
+class FrameError(ValueError):
+    """A received frame failed the length or checksum verification."""
+
 
 def byte_stuffing(to_convert):
     stuffed = bytearray()
@@ -87,6 +100,39 @@ def crc2(to_crc):
     return crc
 
 
+# Implementazioni veloci, equivalenti byte per byte a byte_stuffing,
+# byte_unstuffing e crc2 che restano come riferimento. Lavorano su
+# qualunque buffer (bytes, bytearray, memoryview) e nel caso comune, senza
+# byte da proteggere, non fanno altro che una copia.
+def byte_stuffing_fast(to_convert):
+    stuffed = bytes(to_convert)
+    if DLE in stuffed or STX in stuffed or ETX in stuffed:
+        # DLE per primo, altrimenti verrebbero raddoppiati i DLE già inseriti
+        stuffed = (
+            stuffed.replace(b"\x10", b"\x10\x90")
+            .replace(b"\x02", b"\x10\x82")
+            .replace(b"\x03", b"\x10\x83")
+        )
+    return stuffed
+
+
+def byte_unstuffing_fast(to_convert):
+    """Unstuff a DLE-escaped buffer; raise FrameError on an invalid escape."""
+    segments = bytes(to_convert).split(b"\x10")
+    unstuffed = bytearray(segments[0])
+    for segment in segments[1:]:
+        # dopo un DLE ci può essere solo STX, ETX o DLE + 0x80
+        if not segment or segment[0] not in DLE_ESCAPES:
+            raise FrameError("invalid DLE escape")
+        unstuffed.append(segment[0] - 0x80)
+        unstuffed += segment[1:]
+    return unstuffed
+
+
+def crc2_fast(to_crc):
+    return sum(to_crc) & 0xFFFF
+
+
 def segmento32(comando, classe, elemento):
     segmento = bytearray()
     segmento += comando.to_bytes(1, "big")
@@ -114,36 +160,51 @@ def parse_to_send(to_send):
     if lmsg == len(to_send) - 4:
         flag = to_send[1]
         ind = (to_send[2] << 8) + to_send[3]
-        checksum = crc2(to_send)
+        checksum = crc2_fast(to_send)
         to_send += checksum.to_bytes(2, "big")
-        to_send = byte_stuffing(to_send)
-        to_send = b"\x02" + to_send + b"\x03"
+        to_send = b"\x02" + byte_stuffing_fast(to_send) + b"\x03"
 
     return to_send
 
 
 def recive(to_read):
-    data_length = to_read[1]
-    response = to_read[5]
-    # scarta inizio e fine
-    to_read = to_read[1 : len(to_read) - 1]
-
-    to_read = byte_unstuffing(to_read)
-    length = len(to_read)
-    crc = (to_read[length - 2] << 8) + to_read[length - 1]
-    # toglie crc
-    to_read = to_read[0 : length - 2]
-    # todo verifica ncrc = crc2(to_read)
-    # print(ncrc, crc)
-
-    # in crestron restituisce il comando che è stato inviato
-    # probabilmente perchè non c'è il multi treading
+    """Strip STX/ETX, unstuff and verify a received frame.
+
+    Returns Lmsg + Flag + Ind(msb) + Ind(lsb) + Stringacmd without the
+    checksum. Raises FrameError when the frame is too short, the checksum
+    does not match or Lmsg disagrees with the length of the data.
+    """
+    if len(to_read) < MIN_FRAME_SIZE:
+        raise FrameError(f"frame too short ({len(to_read)} bytes)")
+    if DLE in to_read:
+        to_read = byte_unstuffing_fast(memoryview(to_read)[1:-1])
+        crc = (to_read[-2] << 8) + to_read[-1]
+        # toglie crc
+        del to_read[-2:]
+    else:
+        # caso comune senza byte stuffing: una sola copia del frame
+        crc = (to_read[-3] << 8) + to_read[-2]
+        to_read = to_read[1:-3]
+
+    if crc2_fast(to_read) != crc:
+        raise FrameError("checksum mismatch")
     # FORMATO Lmsg + Flag +Ind(msb) + Ind(lsb) + Stringacmd
-    # a questo punto dovrebbe data_length = len(to_read) + 4
-
+    if to_read[0] != len(to_read) - 4:
+        raise FrameError("message length mismatch")
     return to_read
 
 
+def response_code(decode):
+    """Return the response code of a decoded reply.
+
+    Command replies carry a single ACK, NAK, ENQ or BEL byte; any longer
+    reply carries the requested data and counts as ACK.
+    """
+    if len(decode) == 5:
+        return decode[4]
+    return ACK
+
+
 def encrypt_password(password):
     pwd = password.encode('utf-8')
     pwd_len = len(password)
@@ -193,88 +254,324 @@ def cmd_lettura_stato_ingressi():
     return cmd
 
 
-def read_stato_allineamento_ridotto(data):
-    offset = 9
-    num_bytes_ingressi = data[0]
-    num_bytes_memoria_ingressi = data[1]
-    num_bytes_uscite = data[2]
-    num_bytes_uscite_dedicate = data[3]
-    num_bytes_memoria_uscite_dedicate = data[4]
-    num_bytes_settori = data[5]
-    num_bytes_settori_max_sicurezza = data[7]
-
-    blocco_start = offset
-    stato_ingressi = data[blocco_start : blocco_start + num_bytes_ingressi]
-    ingressi = "".join(format(byte, "08b") for byte in stato_ingressi)
-
-    blocco_start += num_bytes_ingressi
-    stato_memoria_ingressi = data[
-        blocco_start : blocco_start + num_bytes_memoria_ingressi
-    ]
-    memoria_ingressi = "".join(format(byte, "08b") for byte in stato_memoria_ingressi)
-
-    blocco_start += num_bytes_memoria_ingressi
-    stato_uscite = data[blocco_start : blocco_start + num_bytes_uscite]
-    uscite = "".join(format(byte, "08b") for byte in stato_uscite)
+# LEGGINUOVIEVENTI. La documentazione a disposizione non descrive il
+# formato dei record: quello qui sotto è ipotetico, da verificare su una
+# centrale reale, e tutto il resto del client passa da queste due funzioni.
+# Richiesta: comando + cursore (4 byte) + numero massimo di eventi (1 byte),
+# la centrale risponde con gli eventi di indice >= cursore, o dal più vecchio
+# che conserva se il cursore è più vecchio.
+# Risposta: numero eventi (1 byte) + cursore successivo (4 byte) + un record
+# di EVENT_RECORD_SIZE byte per evento: indice (4), ora unix (4), codice (1),
+# classe elemento (1), numero elemento (2); tutto big endian.
+EVENT_RECORD_SIZE = 12
+# Lmsg è un byte: al massimo 20 record dopo i 5 byte di intestazione
+MAX_EVENT_BATCH = (0xFF - 5) // EVENT_RECORD_SIZE
 
-    # uscite dedicate e memorie dovrebbero essere un solo byte
-    # le posizioni sono quelle dei bit e non bit(pos)
-    # viene invertita ciascuna conversione
-    blocco_start += num_bytes_uscite
-    stato_uscite_dedicate = data[
-        blocco_start : blocco_start + num_bytes_uscite_dedicate
-    ]
-    uscite_dedicate = "".join(
-        format(byte, "08b")[::-1] for byte in stato_uscite_dedicate
-    )
 
-    blocco_start += num_bytes_uscite_dedicate
-    stato_memoria_uscite_dedicate = data[
-        blocco_start : blocco_start + num_bytes_memoria_uscite_dedicate
-    ]
-    memoria_uscite_dedicate = "".join(
-        format(byte, "08b")[::-1] for byte in stato_memoria_uscite_dedicate
-    )
+def cmd_leggi_nuovi_eventi(cursor, count=MAX_EVENT_BATCH):
+    cmd = bytearray()
+    cmd += LEGGINUOVIEVENTI.to_bytes(1, "big")
+    cmd += cursor.to_bytes(4, "big")
+    cmd += count.to_bytes(1, "big")
+    return cmd
+
 
-    blocco_start += num_bytes_memoria_uscite_dedicate
-    stato_settori = data[blocco_start : blocco_start + num_bytes_settori]
-    settori = "".join(format(byte, "08b") for byte in stato_settori)
+def read_nuovi_eventi(data):
+    """Return (next cursor, [(index, timestamp, code, classe, elemento), ...])."""
+    count = data[0]
+    cursor = int.from_bytes(data[1:5], "big")
+    eventi = []
+    for start in range(5, 5 + count * EVENT_RECORD_SIZE, EVENT_RECORD_SIZE):
+        record = data[start : start + EVENT_RECORD_SIZE]
+        if len(record) < EVENT_RECORD_SIZE:
+            raise FrameError("truncated event record")
+        eventi.append(
+            (
+                int.from_bytes(record[0:4], "big"),
+                int.from_bytes(record[4:8], "big"),
+                record[8],
+                record[9],
+                int.from_bytes(record[10:12], "big"),
+            )
+        )
+    return cursor, eventi
+
+
+# Configurazione della centrale. Anche qui il formato delle risposte non è
+# documentato: quello che segue è ipotetico, da verificare su una centrale
+# reale, ed è confinato nelle funzioni read_* qui sotto.
+# STATUSINFO: numero di serie (4), firmware (3: major, minor, build), numero
+# di ingressi (2), uscite (2) e settori (1), indirizzo (4) e lunghezza (2)
+# dell'area di configurazione.
+# LETTURAMEMORIA: richiesta indirizzo (4) + lunghezza (1), risposta
+# lunghezza (1) + dati. L'area di configurazione ha un byte per ingresso,
+# poi per uscita, poi per settore: il bit 0 indica l'elemento in uso.
+# LEGGISTRINGHE: la centrale risponde col nome dell'elemento su
+# STRING_SIZE caratteri completati da spazi, o con NAK se non esiste.
+STATUSINFO_SIZE = 18
+# Lmsg è un byte e il primo byte della risposta è la lunghezza
+MAX_MEMORY_CHUNK = 0xFF - 1
+STRING_SIZE = 16
+
+
+def cmd_statusinfo():
+    return STATUSINFO.to_bytes(1, "big")
+
+
+def cmd_lettura_memoria(address, length):
+    cmd = bytearray()
+    cmd += LETTURAMEMORIA.to_bytes(1, "big")
+    cmd += address.to_bytes(4, "big")
+    cmd += length.to_bytes(1, "big")
+    return cmd
+
+
+def cmd_leggi_stringa(classe, elemento):
+    cmd = bytearray()
+    cmd += LEGGISTRINGHE.to_bytes(1, "big")
+    cmd += classe.to_bytes(1, "big")
+    cmd += elemento.to_bytes(2, "big")
+    return cmd
 
-    blocco_start += num_bytes_settori
-    stato_settori_max_sicurezza = data[
-        blocco_start : blocco_start + num_bytes_settori_max_sicurezza
-    ]
-    settori_max_sicurezza = "".join(
-        format(byte, "08b") for byte in stato_settori_max_sicurezza
+
+def read_statusinfo(data):
+    """Return (serial, firmware, ingressi, uscite, settori, config address, config length)."""
+    if len(data) < STATUSINFO_SIZE:
+        raise FrameError("truncated STATUSINFO reply")
+    return (
+        int.from_bytes(data[0:4], "big"),
+        tuple(data[4:7]),
+        int.from_bytes(data[7:9], "big"),
+        int.from_bytes(data[9:11], "big"),
+        data[11],
+        int.from_bytes(data[12:16], "big"),
+        int.from_bytes(data[16:18], "big"),
     )
 
+
+def read_memoria(data):
+    length = data[0]
+    if len(data) < 1 + length:
+        raise FrameError("truncated LETTURAMEMORIA reply")
+    return bytes(data[1 : 1 + length])
+
+
+def read_stringa(data):
+    return bytes(data).decode("latin-1").rstrip(" \0")
+
+
+def build_frame(cmd):
+    """Return the complete frame, from STX to ETX, that sends `cmd`."""
+    return bytes(parse_to_send(rq_cmd(cmd)))
+
+
+# Frame dei comandi fissi, calcolati una volta sola
+CMD_STATO_INGRESSI = build_frame(cmd_lettura_stato_ingressi())
+CMD_STATUSINFO = build_frame(cmd_statusinfo())
+
+
+@lru_cache(maxsize=64)
+def frame_inserisci_settore(settore):
+    """Return the cached frame that arms `settore`."""
+    return build_frame(cmd_inserisci_settore(settore))
+
+
+@lru_cache(maxsize=64)
+def frame_disinserisci_settore(settore):
+    """Return the cached frame that disarms `settore`."""
+    return build_frame(cmd_disinserisci_settore(settore))
+
+
+# Conversione dei blocchi di stato.
+#
+# In modalità stringa ogni posizione diventa un carattere "0"/"1", in
+# modalità maschera (as_mask=True) il blocco diventa un int in cui il bit
+# (pos - 1) vale 1 se la posizione pos è attiva, qualunque sia il blocco.
+# Sul filo ingressi, uscite, settori e inseribili hanno la posizione 1 nel
+# bit più significativo del primo byte (MSB first), mentre uscite dedicate,
+# memorie uscite dedicate e anomalie hanno la posizione 1 nel bit meno
+# significativo (LSB first), per questo le loro stringhe vengono invertite.
+_BIT_REVERSE = bytes(int(format(byte, "08b")[::-1], 2) for byte in range(256))
+
+
+def bit_string(block):
+    return "".join(format(byte, "08b") for byte in block)
+
+
+def bit_string_invertita(block):
+    return "".join(format(byte, "08b")[::-1] for byte in block)
+
+
+def bitmask(block):
+    """Decode a MSB first block into an int with position pos at bit pos - 1."""
+    return int.from_bytes(block.translate(_BIT_REVERSE), "little")
+
+
+def bitmask_invertita(block):
+    """Decode a LSB first block into an int with position pos at bit pos - 1."""
+    return int.from_bytes(block, "little")
+
+
+# indice del byte con la lunghezza di ogni blocco di ALLINEAMENTORIDOTTO,
+# nell'ordine del frame; l'anomalia è sempre un byte
+_ALLINEAMENTO_LENGTHS = (0, 1, 2, 3, 4, 5, 7, None)
+
+
+def allineamento_ridotto_blocks(data):
+    """Split an ALLINEAMENTORIDOTTO payload into its raw blocks.
+
+    Returns, in frame order: ingressi, memoria ingressi, uscite, uscite
+    dedicate, memoria uscite dedicate, settori, settori max sicurezza and
+    anomalia.
+    """
+    blocks = []
+    start = 9
+    for index in _ALLINEAMENTO_LENGTHS:
+        end = start + (data[index] if index is not None else 1)
+        blocks.append(data[start:end])
+        start = end
+    return blocks
+
+
+def read_stato_allineamento_ridotto(data, as_mask=False):
+    if as_mask:
+        bits, bits_invertiti = bitmask, bitmask_invertita
+    else:
+        bits, bits_invertiti = bit_string, bit_string_invertita
+    (
+        stato_ingressi,
+        stato_memoria_ingressi,
+        stato_uscite,
+        stato_uscite_dedicate,
+        stato_memoria_uscite_dedicate,
+        stato_settori,
+        stato_settori_max_sicurezza,
+        stato_anomalia,
+    ) = allineamento_ridotto_blocks(data)
+    # uscite dedicate e memorie dovrebbero essere un solo byte
     # le posizioni sono quelle dei bit e non bit(pos)
-    anomalia = format(data[blocco_start + num_bytes_settori_max_sicurezza], "08b")[::-1]
+    # viene invertita ciascuna conversione
     return (
-        ingressi,
-        memoria_ingressi,
-        uscite,
-        settori,
-        settori_max_sicurezza,
-        anomalia,
-        uscite_dedicate,
-        memoria_uscite_dedicate,
+        bits(stato_ingressi),
+        bits(stato_memoria_ingressi),
+        bits(stato_uscite),
+        bits(stato_settori),
+        bits(stato_settori_max_sicurezza),
+        bits_invertiti(stato_anomalia),
+        bits_invertiti(stato_uscite_dedicate),
+        bits_invertiti(stato_memoria_uscite_dedicate),
     )
 
 
-def read_settori_inseribili(data):
+def read_settori_inseribili(data, as_mask=False):
     num_bytes_settori_inseribili = data[0]
 
     stato_settori_inseribili = data[2 : 2 + num_bytes_settori_inseribili]
-    settori_inseribili = "".join(
-        format(byte, "08b") for byte in stato_settori_inseribili
-    )
-    return settori_inseribili
+    if as_mask:
+        return bitmask(stato_settori_inseribili)
+    return bit_string(stato_settori_inseribili)
 
 
-def read_stato_ingressi(data):
+def read_stato_ingressi(data, as_mask=False):
     num_bytes_ingressi = data[0]
 
     stato_ingressi = data[2 : 2 + num_bytes_ingressi]
-    ingressi = "".join(format(byte, "08b") for byte in stato_ingressi)
-    return ingressi
+    if as_mask:
+        return bitmask(stato_ingressi)
+    return bit_string(stato_ingressi)
+
+
+class FrameReader:
+    """Reassemble STX/ETX frames from an arbitrary stream of byte chunks.
+
+    Chunks are appended to a single reusable buffer with feed(); complete
+    frames are then taken from the front of the buffer, either one at a
+    time with next_frame() or by iterating over the reader. Garbage before
+    a STX, truncated frames and frames with an invalid DLE sequence are
+    dropped and counted in `discarded`.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.discarded = 0
+        self._buffer = bytearray()
+        self._pos = 0
+        self._frames = deque()
+
+    def __len__(self):
+        """Number of complete frames waiting to be read."""
+        return len(self._frames)
+
+    def __iter__(self):
+        while self._frames:
+            yield self._frames.popleft()
+
+    def feed(self, data):
+        """Add a chunk of received bytes and extract the complete frames."""
+        self._buffer += data
+        self._scan()
+        return len(self._frames)
+
+    def next_frame(self):
+        """Return the next complete frame, or None if none is available."""
+        if self._frames:
+            return self._frames.popleft()
+        return None
+
+    def reset(self):
+        """Drop any buffered data, e.g. after a reconnection."""
+        del self._buffer[:]
+        self._pos = 0
+        self._frames.clear()
+
+    def _scan(self):
+        buf = self._buffer
+        pos = self._pos
+        end = len(buf)
+        while pos < end:
+            start = buf.find(STX, pos)
+            if start < 0:
+                # nessun inizio frame: tutto il resto è spazzatura
+                self.discarded += 1
+                pos = end
+                break
+            if start > pos:
+                self.discarded += 1
+            stop = buf.find(ETX, start + 1)
+            restart = buf.find(STX, start + 1, end if stop < 0 else stop)
+            if restart >= 0:
+                # un nuovo STX prima della fine: il frame precedente è troncato
+                self.discarded += 1
+                pos = restart
+                continue
+            if stop < 0:
+                if end - start > self.max_frame_size:
+                    self.discarded += 1
+                    pos = end
+                else:
+                    pos = start
+                break
+            if self._is_valid(buf, start, stop):
+                self._frames.append(bytes(buf[start : stop + 1]))
+            else:
+                self.discarded += 1
+            pos = stop + 1
+
+        if pos >= end:
+            # caso comune: il buffer è stato consumato completamente
+            del buf[:]
+            pos = 0
+        elif pos > len(buf) // 2:
+            del buf[:pos]
+            pos = 0
+        self._pos = pos
+
+    def _is_valid(self, buf, start, stop):
+        if stop + 1 - start < MIN_FRAME_SIZE or stop + 1 - start > self.max_frame_size:
+            return False
+        escape = buf.find(DLE, start + 1, stop)
+        while escape >= 0:
+            if escape + 1 >= stop or buf[escape + 1] not in DLE_ESCAPES:
+                return False
+            escape = buf.find(DLE, escape + 2, stop)
+        return True
@@ -0,0 +1,100 @@
+"""Incremental reading of the event log of the control unit.
+
+The clients read the log with LEGGINUOVIEVENTI in batches, starting from
+a cursor: the index of the next event to read. The cursor is kept in
+`client.event_cursor` and, with `cursor_path`, saved to a file after every
+batch, so after a restart only the events logged in the meantime are read.
+An event is delivered at least once: the cursor of a batch is saved when
+the consumer asks for the event after it, so a crash in the middle of a
+batch delivers that batch again.
+
+The record layout is described in elmoprocessor.read_nuovi_eventi.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import namedtuple
+from .elmoprocessor import ACK, MAX_EVENT_BATCH
+
+_LOGGER = logging.getLogger(__name__)
+
+# index: posizione nel registro, timestamp: ora unix della centrale,
+# code: codice dell'evento, classe/elemento: l'elemento che l'ha generato
+# (elmoprocessor.INGRESSO, GRUPPO, USCITA...)
+Event = namedtuple("Event", ["index", "timestamp", "code", "classe", "elemento"])
+
+
+def load_cursor(path):
+    """Return the cursor saved in `path`, None if there is none."""
+    try:
+        with open(path) as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def save_cursor(path, cursor):
+    """Save `cursor` to `path`; the file is replaced atomically."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(cursor))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _take_batch(client, cursor):
+    """Return the events decoded by the last reply, warning about a gap in the log."""
+    eventi = list(client._eventi)
+    client._eventi.clear()
+    if eventi and cursor is not None and eventi[0].index > cursor:
+        _LOGGER.warning(
+            f"{eventi[0].index - cursor} events lost: the control unit keeps "
+            f"its log from event {eventi[0].index}"
+        )
+    return eventi
+
+
+def stream_events(client, cursor_path=None, follow=False, interval=1.0, timeout=None, batch=MAX_EVENT_BATCH):
+    """Yield the new events of an ElmoClient or HubPanel, oldest first.
+
+    Stops when the log is read up to the end, or with `follow` keeps
+    waiting `interval` seconds between reads for the next events.
+    """
+    if cursor_path is not None and client.event_cursor is None:
+        client.event_cursor = load_cursor(cursor_path)
+    while True:
+        cursor = client.event_cursor
+        result = client.leggi_nuovi_eventi(batch).result(timeout)
+        if result.code != ACK:
+            raise RuntimeError(f"event log read refused by the control unit (code {result.code:#04x})")
+        eventi = _take_batch(client, cursor)
+        for event in eventi:
+            yield event
+        if cursor_path is not None and client.event_cursor != cursor:
+            save_cursor(cursor_path, client.event_cursor)
+        if len(eventi) < batch:
+            if not follow:
+                return
+            time.sleep(interval)
+
+
+async def stream_events_async(client, cursor_path=None, follow=False, interval=1.0, batch=MAX_EVENT_BATCH):
+    """Async iterator version of stream_events() for AsyncElmoClient."""
+    if cursor_path is not None and client.event_cursor is None:
+        client.event_cursor = load_cursor(cursor_path)
+    while True:
+        cursor = client.event_cursor
+        result = await client.leggi_nuovi_eventi(batch)
+        if result.code != ACK:
+            raise RuntimeError(f"event log read refused by the control unit (code {result.code:#04x})")
+        eventi = _take_batch(client, cursor)
+        for event in eventi:
+            yield event
+        if cursor_path is not None and client.event_cursor != cursor:
+            save_cursor(cursor_path, client.event_cursor)
+        if len(eventi) < batch:
+            if not follow:
+                return
+            await asyncio.sleep(interval)
@@ -0,0 +1,405 @@
+import errno
+import logging
+import math
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from .base import QueuedElmoBase, set_socket_options
+from .commandqueue import CommandQueue
+from .protocol import UnsolicitedFrame
+from .elmoprocessor import FrameError, CMD_ALLINEAMENTO_RIDOTTO
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) schedule and cancel, one bucket per tick.
+
+    Timers are rounded up to the next tick, which is plenty for poll
+    intervals and response timeouts of a few hundred milliseconds.
+    """
+
+    def __init__(self, tick=0.01, slots=512):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._origin = time.monotonic()
+        self._current = 0
+
+    def __len__(self):
+        return sum(1 for slot in self._slots for timer in slot if timer[1] is not None)
+
+    def schedule(self, delay, callback):
+        """Call `callback` after `delay` seconds; return a handle for cancel()."""
+        now = int((time.monotonic() - self._origin) / self.tick)
+        expire = max(now, self._current) + max(1, math.ceil(delay / self.tick))
+        timer = [expire, callback]
+        self._slots[expire % len(self._slots)].append(timer)
+        return timer
+
+    @staticmethod
+    def cancel(timer):
+        if timer is not None:
+            timer[1] = None
+
+    def timeout(self):
+        """Seconds until the next tick holding a timer is due, None if empty."""
+        slots = len(self._slots)
+        for ahead in range(1, slots + 1):
+            if self._slots[(self._current + ahead) % slots]:
+                due = self._origin + (self._current + ahead) * self.tick
+                return max(0.0, due - time.monotonic())
+        return None
+
+    def advance(self):
+        """Return the callbacks of the timers expired since the last call."""
+        now = int((time.monotonic() - self._origin) / self.tick)
+        expired = []
+        while self._current < now:
+            self._current += 1
+            slot = self._slots[self._current % len(self._slots)]
+            if not slot:
+                continue
+            pending = []
+            for timer in slot:
+                if timer[1] is None:
+                    continue
+                if timer[0] <= self._current:
+                    expired.append(timer[1])
+                else:
+                    pending.append(timer)
+            slot[:] = pending
+        return expired
+
+
+class HubPanel(QueuedElmoBase):
+    """A control unit driven by an ElmoHub.
+
+    It has the same subscribe/get API and command methods as ElmoClient;
+    commands are queued and sent by the hub thread, and return a Future
+    that resolves with their CommandResult.
+    """
+
+    def __init__(
+        self,
+        hub,
+        host,
+        port=10001,
+        timeout=2,
+        num_ingressi=32,
+        num_uscite=32,
+        user="",
+        password="",
+        poll_scheduler=None,
+        dispatcher=None,
+        metrics=True,
+        trace=None,
+        state_path=None,
+        backoff=None,
+    ):
+        """ Initialize HubPanel object """
+        QueuedElmoBase.__init__(
+            self, num_ingressi, num_uscite, poll_scheduler, dispatcher, metrics, trace, state_path, backoff
+        )
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self._user = user
+        self._password = password
+        self.timeout = timeout
+        self.polling_enabled = False
+        self.connected = False
+
+        self.socket = None
+        self.tx_queue = CommandQueue()
+        self._out = b""
+        self._events = 0
+        # future del comando in attesa di risposta, None per i poll
+        self._future = None
+        self._poll_due = False
+        self._timer = None
+        self._poll_deadline = None
+        self._reply_timer = None
+        self._removed = False
+        self._warning_posted = False
+
+    def _put(self, command, tx, key=None, read=False):
+        future = QueuedElmoBase._put(self, command, tx, key, read)
+        self.hub._wake(self)
+        return future
+
+    # I metodi seguenti sono eseguiti solo dal thread dell'hub
+
+    def _connect(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setblocking(False)
+        err = self.socket.connect_ex((self.host, self.port))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self._connection_failed()
+            return
+        self.hub._selector.register(self.socket, selectors.EVENT_WRITE, self)
+        self._set_timer(self.timeout, self._connection_failed)
+
+    def _connection_failed(self):
+        if self._warning_posted is False:
+            _LOGGER.debug(f"attempting to connect to {self.host}:{self.port}, no success yet")
+            self._warning_posted = True
+        self._close()
+        self._set_timer(self.backoff.next_delay(), self._connect)
+
+    def _connection_lost(self, error=None):
+        _LOGGER.debug(f"lost connection to {self.host}:{self.port}")
+        self._metrics.connection_lost()
+        self._close(error)
+        self._set_timer(self.backoff.next_delay(), self._connect)
+
+    def _connected(self):
+        err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self._connection_failed()
+            return
+        _LOGGER.debug(f"connected to {self.host}:{self.port}")
+        self._warning_posted = False
+        self.backoff.reset()
+        set_socket_options(self.socket)
+        self.connected = True
+        self.protocol.reset()
+        self._metrics.connection_restored()
+        if self.logged_in:
+            # la sessione non sopravvive alla connessione
+            _LOGGER.debug("replaying login")
+            self._replay_login()
+        self._events = selectors.EVENT_READ
+        self.hub._selector.modify(self.socket, self._events, self)
+        self._schedule_poll()
+        self._kick()
+
+    def _close(self, error=None):
+        self.connected = False
+        command = self.protocol.timeout()
+        if command is not None and self._future is not None:
+            self._future.set_exception(error or ConnectionError(f"connection lost during {command}"))
+        self._future = None
+        self._out = b""
+        self._poll_due = False
+        TimerWheel.cancel(self._timer)
+        TimerWheel.cancel(self._reply_timer)
+        self._timer = None
+        self._reply_timer = None
+        if self.socket is not None:
+            try:
+                self.hub._selector.unregister(self.socket)
+            except (KeyError, ValueError):
+                pass
+            self.socket.close()
+            self.socket = None
+
+    def _shutdown(self):
+        """Close the connection and cancel the queued commands."""
+        self._close()
+        self.tx_queue.clear()
+
+    def _set_timer(self, delay, callback):
+        TimerWheel.cancel(self._timer)
+        self._timer = self.hub._wheel.schedule(delay, callback)
+
+    def _schedule_poll(self):
+        delay = self.poll_scheduler.next_delay()
+        self._poll_deadline = time.monotonic() + delay
+        self._set_timer(delay, self._poll)
+
+    def _poll(self):
+        self._timer = None
+        if self.polling_enabled:
+            self._metrics.poll_started(self._poll_deadline)
+            self._poll_due = True
+            self._kick()
+        else:
+            self._schedule_poll()
+
+    def _kick(self):
+        """Send the next queued command, or the due poll, if the line is free."""
+        if not self.connected or self.protocol.pending is not None:
+            return
+        item = self.tx_queue.get(0)
+        while item is not None and not item[2].set_running_or_notify_cancel():
+            item = self.tx_queue.get(0)
+        if item is not None:
+            command, tx, future = item
+        else:
+            if not self._poll_due:
+                return
+            self._poll_due = False
+            command, tx, future = "allineamento_ridotto", CMD_ALLINEAMENTO_RIDOTTO, None
+        self._future = future
+        self._out = self.send_request(command, tx)
+        self._send()
+        if self.protocol.pending is not None:
+            self._reply_timer = self.hub._wheel.schedule(self.timeout, self._response_timeout)
+
+    def _send(self):
+        try:
+            sent = self.socket.send(self._out)
+        except BlockingIOError:
+            sent = 0
+        except OSError as err:
+            self._connection_lost(err)
+            return
+        self._metrics.sent(sent)
+        self._out = self._out[sent:]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if self._out else 0)
+        if events != self._events:
+            self._events = events
+            self.hub._selector.modify(self.socket, events, self)
+
+    def _response_timeout(self):
+        self._reply_timer = None
+        command = self.protocol.pending
+        _LOGGER.debug(f"Socket timeout while receiving data for {command}")
+        self._metrics.timeout()
+        self._connection_lost(TimeoutError(f"no reply to {command}"))
+
+    def _handle_io(self, mask):
+        if not self.connected:
+            self._connected()
+            return
+        if mask & selectors.EVENT_WRITE and self._out:
+            self._send()
+            if self.socket is None:
+                return
+        if mask & selectors.EVENT_READ:
+            try:
+                data = self.socket.recv(4096)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+            if not data:
+                self._connection_lost()
+                return
+            for event in self.data_received(data):
+                self._handle_event(event)
+                if self.socket is None:
+                    return
+
+    def _handle_event(self, event):
+        if type(event) is UnsolicitedFrame:
+            self.handle_event(event)
+            return
+        future, self._future = self._future, None
+        TimerWheel.cancel(self._reply_timer)
+        self._reply_timer = None
+        try:
+            result = self.handle_event(event)
+        except FrameError as err:
+            if future is not None:
+                future.set_exception(err)
+        else:
+            if future is not None:
+                future.set_result(result)
+        if event.command == "allineamento_ridotto":
+            self._schedule_poll()
+        self._kick()
+
+
+class ElmoHub:
+    """Drive many control units from a single thread.
+
+    All the panel sockets are multiplexed with `selectors` and the polls,
+    response timeouts and reconnections of every panel are scheduled on
+    one TimerWheel, so the thread count does not grow with the panels.
+    """
+
+    def __init__(self, tick=0.01):
+        """ Initialize ElmoHub object """
+        self.panels = []
+        self._selector = selectors.DefaultSelector()
+        self._wheel = TimerWheel(tick)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._kicked = deque()
+        self._waker_r, self._waker_w = socket.socketpair()
+        self._waker_r.setblocking(False)
+        self._waker_w.setblocking(False)
+        self._selector.register(self._waker_r, selectors.EVENT_READ, None)
+
+    def add_panel(self, host, port=10001, **kwargs):
+        """Add a control unit; it is connected as soon as the hub runs."""
+        panel = HubPanel(self, host, port, **kwargs)
+        self.panels.append(panel)
+        self._wake(panel)
+        return panel
+
+    def remove_panel(self, panel):
+        """Disconnect a control unit and stop driving it."""
+        self.panels.remove(panel)
+        panel._removed = True
+        self._wake(panel)
+
+    def start(self):
+        """Start the hub thread."""
+        if self._thread and self._thread.is_alive():
+            _LOGGER.error("start() called while already running")
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ElmoHub")
+        self._thread.start()
+
+    def stop(self):
+        """Stop the hub thread and close every connection."""
+        if not self._thread or not self._thread.is_alive():
+            _LOGGER.debug("stop() called but the hub is not running")
+            return
+        self._stop_event.set()
+        self._wake(None)
+        self._thread.join()
+
+    def _wake(self, panel):
+        self._kicked.append(panel)
+        try:
+            self._waker_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _guarded(self, panel, method, *args):
+        """Run a method of `panel`; an error drops its connection, not the hub."""
+        try:
+            method(*args)
+        except Exception as err:
+            _LOGGER.exception(f"error on {panel.host}:{panel.port}")
+            if not panel._removed:
+                panel._connection_lost(err)
+
+    def _run(self):
+        _LOGGER.debug("hub thread start")
+        for panel in self.panels:
+            if panel.socket is None:
+                self._guarded(panel, panel._connect)
+        while not self._stop_event.is_set():
+            for key, mask in self._selector.select(self._wheel.timeout()):
+                if key.data is None:
+                    try:
+                        while self._waker_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._guarded(key.data, key.data._handle_io, mask)
+            while self._kicked:
+                panel = self._kicked.popleft()
+                if panel is None:
+                    continue
+                if panel._removed:
+                    panel._shutdown()
+                elif panel.socket is None and panel._timer is None:
+                    self._guarded(panel, panel._connect)
+                else:
+                    self._guarded(panel, panel._kick)
+            for callback in self._wheel.advance():
+                # i timer sono tutti metodi di un pannello
+                self._guarded(callback.__self__, callback)
+        for panel in self.panels:
+            panel._shutdown()
+            panel.save_state()
+        _LOGGER.debug("hub thread stop")
@@ -0,0 +1,250 @@
+"""Counters and histograms of a client, and their Prometheus text format.
+
+Every client records into a Metrics object and returns its values from
+metrics(). Pass metrics=False to the client to use NullMetrics instead,
+whose methods do nothing: the hot paths then skip the timing too.
+"""
+import bisect
+import math
+import time
+
+# limiti superiori dei bucket, in secondi
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# il ripristino di una connessione dura da decimi di secondo a minuti
+RECOVERY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Histogram:
+    """Count of the observed values per bucket, plus their count and sum."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # l'ultimo contatore è il bucket +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        """{"count", "sum", "buckets": {upper bound: cumulative count}}"""
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Metrics:
+    """Metrics of one client connection.
+
+    Updated only by the I/O thread (or task) of the client, so the
+    counters take no lock.
+    """
+
+    enabled = True
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """ Initialize Metrics object """
+        self.buckets = tuple(buckets)
+        self.rtt = {}
+        self.poll_jitter = Histogram(self.buckets)
+        self.parse_time = Histogram(self.buckets)
+        self.callback_time = Histogram(self.buckets)
+        self.recovery_time = Histogram(RECOVERY_BUCKETS)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.last_frame = None
+        self._lost_at = None
+
+    def observe_rtt(self, command, seconds):
+        """Round-trip time of a request, polls included."""
+        histogram = self.rtt.get(command)
+        if histogram is None:
+            histogram = self.rtt[command] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def poll_started(self, deadline):
+        """A poll is sent; `deadline` is the time.monotonic() it was due."""
+        self.poll_jitter.observe(max(0.0, time.monotonic() - deadline))
+
+    def observe_parse(self, seconds):
+        self.parse_time.observe(seconds)
+
+    def observe_callbacks(self, seconds):
+        self.callback_time.observe(seconds)
+
+    def sent(self, count):
+        self.bytes_out += count
+
+    def received(self, count):
+        self.bytes_in += count
+
+    def timeout(self):
+        self.timeouts += 1
+
+    def connection_lost(self):
+        self.reconnects += 1
+        if self._lost_at is None:
+            self._lost_at = time.monotonic()
+
+    def connection_restored(self):
+        """A connection is open again: record the time since it was lost."""
+        if self._lost_at is not None:
+            self.recovery_time.observe(time.monotonic() - self._lost_at)
+            self._lost_at = None
+
+    def frame_received(self):
+        self.last_frame = time.monotonic()
+
+    def since_last_frame(self):
+        """Seconds since the last valid frame, None before the first one."""
+        if self.last_frame is None:
+            return None
+        return time.monotonic() - self.last_frame
+
+    def as_dict(self):
+        return {
+            "rtt": {command: histogram.as_dict() for command, histogram in self.rtt.items()},
+            "poll_jitter": self.poll_jitter.as_dict(),
+            "parse_time": self.parse_time.as_dict(),
+            "callback_time": self.callback_time.as_dict(),
+            "recovery_time": self.recovery_time.as_dict(),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "timeouts": self.timeouts,
+            "reconnects": self.reconnects,
+            "since_last_frame": self.since_last_frame(),
+        }
+
+
+class NullMetrics:
+    """Metrics that records nothing."""
+
+    enabled = False
+
+    def observe_rtt(self, command, seconds):
+        pass
+
+    def poll_started(self, deadline):
+        pass
+
+    def observe_parse(self, seconds):
+        pass
+
+    def observe_callbacks(self, seconds):
+        pass
+
+    def sent(self, count):
+        pass
+
+    def received(self, count):
+        pass
+
+    def timeout(self):
+        pass
+
+    def connection_lost(self):
+        pass
+
+    def connection_restored(self):
+        pass
+
+    def frame_received(self):
+        pass
+
+    def since_last_frame(self):
+        return None
+
+    def as_dict(self):
+        return {}
+
+
+# nome, tipo, help e chiave nel dizionario di metrics()
+_HISTOGRAMS = (
+    ("elmo_poll_jitter_seconds", "Delay of the polls after their scheduled time.", "poll_jitter"),
+    ("elmo_parse_seconds", "Time to decode a frame and update the status.", "parse_time"),
+    ("elmo_callback_dispatch_seconds", "Time to run or queue the callbacks of a frame.", "callback_time"),
+    ("elmo_recovery_seconds", "Time from a lost connection to the next one.", "recovery_time"),
+)
+_COUNTERS = (
+    ("elmo_bytes_received_total", "Bytes received from the control unit.", "bytes_in"),
+    ("elmo_bytes_sent_total", "Bytes sent to the control unit.", "bytes_out"),
+    ("elmo_timeouts_total", "Requests left without a reply.", "timeouts"),
+    ("elmo_reconnects_total", "Connections lost and reopened.", "reconnects"),
+    ("elmo_frames_rejected_total", "Invalid frames received.", "frames_rejected"),
+    ("elmo_status_blocks_decoded_total", "Status blocks decoded because their bytes changed.", "blocks_decoded"),
+    ("elmo_status_blocks_skipped_total", "Status blocks skipped because their bytes did not change.", "blocks_skipped"),
+)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in labels.values()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    for bound, count in histogram["buckets"].items():
+        bucket_labels = dict(labels, le=_format_bound(bound))
+        lines.append(f"{name}_bucket{_labels(bucket_labels)} {count}")
+    lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']}")
+    lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    return lines
+
+
+def prometheus_text(panels):
+    """Format the metrics of many clients in the Prometheus text format.
+
+    `panels` is an iterable of (labels, metrics) pairs, where labels is a
+    dict such as {"panel": "192.168.1.100"} and metrics is the dict
+    returned by a client's metrics().
+    """
+    panels = [(labels or {}, metrics) for labels, metrics in panels if metrics]
+    lines = []
+
+    name = "elmo_command_rtt_seconds"
+    lines.append(f"# HELP {name} Round-trip time of the requests to the control unit.")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, metrics in panels:
+        for command, histogram in metrics.get("rtt", {}).items():
+            lines.extend(_histogram_lines(name, dict(labels, command=command), histogram))
+
+    for name, help_text, key in _HISTOGRAMS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, metrics in panels:
+            if key in metrics:
+                lines.extend(_histogram_lines(name, labels, metrics[key]))
+
+    for name, help_text, key in _COUNTERS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, metrics in panels:
+            if key in metrics:
+                lines.append(f"{name}{_labels(labels)} {metrics[key]}")
+
+    name = "elmo_last_frame_age_seconds"
+    lines.append(f"# HELP {name} Seconds since the last valid frame.")
+    lines.append(f"# TYPE {name} gauge")
+    for labels, metrics in panels:
+        if metrics.get("since_last_frame") is not None:
+            lines.append(f"{name}{_labels(labels)} {metrics['since_last_frame']}")
+    return "\n".join(lines) + "\n"
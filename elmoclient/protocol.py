@@ -0,0 +1,206 @@
+"""Sans-I/O core of the Elmo protocol: requests and bytes in, events out.
+
+ElmoProtocol does no I/O and keeps no timers. A client hands it a request
+with send(), which returns the bytes to write, and every chunk read from
+the connection with receive_data(), which returns one event per complete
+frame: the reply to the pending request, typed after the request, an
+InvalidFrame, or an UnsolicitedFrame when no request is pending. The
+control unit answers one request at a time, so send() refuses a new
+request until the reply arrives or the client gives up with timeout().
+
+    protocol = ElmoProtocol()
+    sock.sendall(protocol.send("allineamento_ridotto"))
+    for event in protocol.receive_data(sock.recv(4096)):
+        if isinstance(event, StatusFrame):
+            ...
+
+ElmoBase.handle_event() applies the events to the panel status; the
+threaded client, the asyncio client and the hub differ only in how they
+move the bytes. Without sockets the protocol can be benchmarked or fuzzed
+on its own.
+"""
+import time
+from collections import namedtuple
+from .elmoprocessor import (
+    ACK,
+    FrameError,
+    FrameReader,
+    recive,
+    response_code,
+    CMD_ALLINEAMENTO_RIDOTTO,
+    CMD_SETTORI_INSERIBILI,
+    CMD_STATO_INGRESSI,
+    CMD_STATUSINFO,
+)
+
+# frame delle richieste senza parametri
+_REQUEST_FRAMES = {
+    "allineamento_ridotto": CMD_ALLINEAMENTO_RIDOTTO,
+    "lettura_inseribili": CMD_SETTORI_INSERIBILI,
+    "lettura_ingressi": CMD_STATO_INGRESSI,
+    "statusinfo": CMD_STATUSINFO,
+}
+
+
+class Reply(namedtuple("Reply", ["command", "frame", "decode", "rtt"])):
+    """Valid reply to the request `command`.
+
+    `frame` is the frame as received, `decode` the destuffed message from
+    Lmsg to the payload and `rtt` the seconds since the request was sent.
+    """
+
+    __slots__ = ()
+
+    @property
+    def code(self):
+        """ACK, NAK, ENQ or BEL; replies carrying data count as ACK."""
+        return response_code(self.decode)
+
+    @property
+    def data(self):
+        """The payload, response code included."""
+        return bytes(self.decode[4:])
+
+
+class StatusFrame(Reply):
+    """Reply to ALLINEAMENTORIDOTTO.
+
+    `decode` is None when the frame is the same as the previous status
+    frame, which is then not decoded again.
+    """
+
+    __slots__ = ()
+
+    @property
+    def code(self):
+        return ACK if self.decode is None else response_code(self.decode)
+
+    @property
+    def data(self):
+        return bytes((recive(self.frame) if self.decode is None else self.decode)[4:])
+
+
+class InseribiliFrame(Reply):
+    """Reply to LETTURAINSERIBILI."""
+
+    __slots__ = ()
+
+
+class IngressiFrame(Reply):
+    """Reply to STATOINGRESSI."""
+
+    __slots__ = ()
+
+
+class LoginResult(Reply):
+    """Reply to ACCESSO_AL_SISTEMA."""
+
+    __slots__ = ()
+
+    @property
+    def accepted(self):
+        return self.code == ACK
+
+
+class EventLogFrame(Reply):
+    """Reply to LEGGINUOVIEVENTI."""
+
+    __slots__ = ()
+
+
+class CommandReply(Reply):
+    """ACK/NAK of a command, or the data of any other request."""
+
+    __slots__ = ()
+
+
+# frame della risposta a `command` non valido: error è la FrameError
+InvalidFrame = namedtuple("InvalidFrame", ["command", "frame", "error", "rtt"])
+
+# frame arrivato senza una richiesta in attesa
+UnsolicitedFrame = namedtuple("UnsolicitedFrame", ["frame"])
+
+_REPLY_TYPES = {
+    "allineamento_ridotto": StatusFrame,
+    "lettura_inseribili": InseribiliFrame,
+    "lettura_ingressi": IngressiFrame,
+    "accesso_sistema": LoginResult,
+    "leggi_eventi": EventLogFrame,
+}
+
+
+def reply_event(command, frame, rtt, last_status=None):
+    """Return the event for `frame` received as the reply to `command`.
+
+    A status frame equal to `last_status` is not decoded again.
+    """
+    kind = _REPLY_TYPES.get(command, CommandReply)
+    if kind is StatusFrame and frame == last_status:
+        return StatusFrame(command, frame, None, rtt)
+    try:
+        decode = recive(frame)
+    except FrameError as err:
+        return InvalidFrame(command, frame, err, rtt)
+    return kind(command, frame, decode, rtt)
+
+
+class ElmoProtocol:
+    """Request/reply state of one connection to a control unit.
+
+    `clock` gives the times for the round-trip of the replies; reset()
+    after a reconnection drops the partial frames and the pending request.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """ Initialize ElmoProtocol object """
+        self.clock = clock
+        self.framer = FrameReader()
+        # ultimo frame di stato valido, per non decodificare di nuovo quelli uguali
+        self.last_status = None
+        self._pending = None
+        self._sent_at = 0.0
+
+    @property
+    def pending(self):
+        """Name of the request waiting for its reply, or None."""
+        return self._pending
+
+    def send(self, command, tx=None):
+        """Start the request `command` and return the bytes to send.
+
+        `tx` is the request frame; the requests without parameters
+        (allineamento_ridotto, lettura_inseribili, lettura_ingressi,
+        statusinfo) have a default one. Raises RuntimeError while another
+        request is pending.
+        """
+        if self._pending is not None:
+            raise RuntimeError(f"{command} sent while waiting for the reply to {self._pending}")
+        if tx is None:
+            tx = _REQUEST_FRAMES[command]
+        self._pending = command
+        self._sent_at = self.clock()
+        return tx
+
+    def receive_data(self, data):
+        """Feed received bytes; return the events of the frames they complete."""
+        self.framer.feed(data)
+        return [self._frame_received(frame) for frame in self.framer]
+
+    def _frame_received(self, frame):
+        command = self._pending
+        if command is None:
+            return UnsolicitedFrame(frame)
+        self._pending = None
+        event = reply_event(command, frame, self.clock() - self._sent_at, self.last_status)
+        if type(event) is StatusFrame and event.decode is not None:
+            self.last_status = frame
+        return event
+
+    def timeout(self):
+        """Give up the pending request and return its name, or None."""
+        command, self._pending = self._pending, None
+        return command
+
+    def reset(self):
+        self.framer.reset()
+        self._pending = None
@@ -0,0 +1,177 @@
+"""Replay a WireTrace through the status parsers, offline.
+
+Every RX frame of the trace is paired with the TX request before it and
+fed to the matching parse method (parse_update, parse_settori_inseribili,
+parse_stato_ingressi, parse_accesso_sistema) of a client with its
+subscribers attached, as fast as possible or with the original timing.
+The report gives frames/s, changes/s and the decode latency; the final
+status can be saved as a reference and compared with a later replay, to
+check that a parser change does not change any decoded value:
+
+    python -m elmoclient.replay panel.trace --save-reference before.json
+    python -m elmoclient.replay panel.trace --reference before.json
+"""
+import argparse
+import json
+import sys
+import time
+from collections import namedtuple
+from . import elmoprocessor as proc
+from .base import ElmoBase, SIGTYPES
+from .trace import WireTrace, TX
+
+# frames: risposte decodificate, skipped: RX senza richiesta o con comando
+# senza parser, rejected: frame non validi, latenze in secondi per frame
+ReplayReport = namedtuple(
+    "ReplayReport",
+    [
+        "frames",
+        "skipped",
+        "rejected",
+        "changes",
+        "elapsed",
+        "frames_per_sec",
+        "changes_per_sec",
+        "latency_p50",
+        "latency_p99",
+        "latency_max",
+    ],
+)
+
+_PARSERS = {
+    proc.ALLINEAMENTORIDOTTO: "parse_update",
+    proc.LETTURAINSERIBILI: "parse_settori_inseribili",
+    proc.STATOINGRESSI: "parse_stato_ingressi",
+    proc.ACCESSO_AL_SISTEMA: "parse_accesso_sistema",
+}
+
+
+class ReplayClient(ElmoBase):
+    """ElmoBase with no transport: the reads it asks for are already in the trace."""
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(q / 100 * (len(values) - 1)))]
+
+
+def replay(trace, client, speed=None):
+    """Feed the RX frames of `trace` to `client` and return a ReplayReport.
+
+    With `speed` None the frames are parsed back to back; otherwise the
+    original gaps between frames are kept, divided by `speed`.
+    """
+    changes = [0]
+
+    def count(changeset):
+        changes[0] += len(changeset.changes)
+
+    client.subscribe_changes(count)
+    rejected = client.frames_rejected
+    latencies = []
+    skipped = 0
+    command = None
+    first = None
+    start = time.perf_counter()
+    for timestamp, direction, data in trace.entries():
+        if direction == TX:
+            try:
+                command = proc.recive(data)[4]
+            except (proc.FrameError, IndexError):
+                command = None
+            continue
+        parser = _PARSERS.get(command)
+        command = None
+        if parser is None:
+            skipped += 1
+            continue
+        if speed is not None:
+            if first is None:
+                first = timestamp
+            delay = start + (timestamp - first) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        received = time.perf_counter()
+        getattr(client, parser)(data)
+        latencies.append(time.perf_counter() - received)
+    elapsed = time.perf_counter() - start
+    client._change_subscribers.remove((count, None))
+
+    return ReplayReport(
+        frames=len(latencies),
+        skipped=skipped,
+        rejected=client.frames_rejected - rejected,
+        changes=changes[0],
+        elapsed=elapsed,
+        frames_per_sec=len(latencies) / elapsed if elapsed else 0.0,
+        changes_per_sec=changes[0] / elapsed if elapsed else 0.0,
+        latency_p50=_percentile(latencies, 50),
+        latency_p99=_percentile(latencies, 99),
+        latency_max=max(latencies, default=0.0),
+    )
+
+
+def state_of(client):
+    """Return the status of `client` as {sigtype: bitmask}, for compare_state()."""
+    return {sigtype: client.snapshot().masks[sigtype] for sigtype in SIGTYPES}
+
+
+def compare_state(client, reference):
+    """Return [(sigtype, expected, actual)] for every bitmask that differs."""
+    state = state_of(client)
+    return [
+        (sigtype, reference.get(sigtype, 0), state[sigtype])
+        for sigtype in SIGTYPES
+        if reference.get(sigtype, 0) != state[sigtype]
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a wire trace through the status parsers.")
+    parser.add_argument("path", help="file written by WireTrace.dump()")
+    parser.add_argument("--realtime", action="store_true", help="keep the original timing")
+    parser.add_argument("--speed", type=float, default=1.0, help="timing speed-up with --realtime")
+    parser.add_argument("--subscribers", type=int, default=0, help="callbacks attached to every sigtype")
+    parser.add_argument("--reference", help="compare the final status with this JSON file")
+    parser.add_argument("--save-reference", help="save the final status to this JSON file")
+    args = parser.parse_args()
+
+    trace = WireTrace.load(args.path)
+    client = ReplayClient()
+
+    def callback(sigtype, pos, value):
+        pass
+
+    for i in range(args.subscribers):
+        for sigtype in SIGTYPES:
+            client.subscribe(sigtype, i % 32 + 1, callback)
+
+    report = replay(trace, client, args.speed if args.realtime else None)
+    print(f"frames       {report.frames} ({report.skipped} skipped, {report.rejected} rejected)")
+    print(f"changes      {report.changes}")
+    print(f"elapsed      {report.elapsed:.3f} s")
+    print(f"frames/s     {report.frames_per_sec:.0f}")
+    print(f"changes/s    {report.changes_per_sec:.0f}")
+    print(
+        f"latency      p50 {report.latency_p50 * 1e6:.1f} us, p99 {report.latency_p99 * 1e6:.1f} us, "
+        f"max {report.latency_max * 1e6:.1f} us"
+    )
+
+    if args.save_reference:
+        with open(args.save_reference, "w") as f:
+            json.dump(state_of(client), f, indent=2)
+    if args.reference:
+        with open(args.reference) as f:
+            reference = json.load(f)
+        mismatches = compare_state(client, reference)
+        for sigtype, expected, actual in mismatches:
+            print(f"MISMATCH {sigtype}: expected {expected:#x}, got {actual:#x}")
+        if mismatches:
+            sys.exit(1)
+        print("final status matches the reference")
+
+
+if __name__ == "__main__":
+    main()
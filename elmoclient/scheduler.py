@@ -0,0 +1,100 @@
+import random
+import time
+
+
+class PollScheduler:
+    """Decide when the next ALLINEAMENTORIDOTTO poll is due.
+
+    The interval starts at `min_interval` and grows by `backoff` after
+    every poll that finds the status unchanged, up to `max_interval`.
+    A change or a command brings it back to `min_interval` for at least
+    `burst` polls. With `max_rate` set, polls are also limited to that
+    many per second on average by a token bucket holding up to
+    `max(1, max_rate)` polls.
+
+    Every client owns its scheduler; pass a subclass to change the policy.
+    With min_interval == max_interval the polls have a fixed interval.
+    """
+
+    def __init__(
+        self,
+        min_interval=0.2,
+        max_interval=1.0,
+        backoff=1.5,
+        burst=5,
+        max_rate=None,
+    ):
+        """ Initialize PollScheduler object """
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("PollScheduler(): need 0 < min_interval <= max_interval")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.burst = burst
+        self.max_rate = max_rate
+        self.interval = min_interval
+        self._burst_left = burst
+        self._tokens = max(1, max_rate) if max_rate else 0
+        self._stamp = time.monotonic()
+
+    def on_change(self):
+        """The last poll found a different status: poll fast for a while."""
+        self.interval = self.min_interval
+        self._burst_left = self.burst
+
+    def on_command(self):
+        """A command was sent: its effect shows up in the next polls."""
+        self.on_change()
+
+    def on_unchanged(self):
+        """The last poll found the same status: slow down."""
+        if self._burst_left > 0:
+            self._burst_left -= 1
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    def next_delay(self):
+        """Return the seconds to wait before the next poll, and reserve it."""
+        delay = self.interval
+        if self.max_rate:
+            now = time.monotonic()
+            start = max(now, self._stamp)
+            capacity = max(1, self.max_rate)
+            tokens = min(capacity, self._tokens + (start + delay - self._stamp) * self.max_rate)
+            if tokens < 1:
+                delay += (1 - tokens) / self.max_rate
+                tokens = 1
+            self._tokens = tokens - 1
+            self._stamp = start + delay
+            delay = self._stamp - now
+        return delay
+
+
+class Backoff:
+    """Delays between the attempts to reconnect to a control unit.
+
+    The first retry comes after `initial` seconds and every failed attempt
+    multiplies the delay by `factor`, up to `maximum`. Each delay is cut by
+    a random fraction up to `jitter`, so that many clients losing the same
+    network do not reconnect all together. reset() after a connection.
+    """
+
+    def __init__(self, initial=0.1, maximum=30.0, factor=2.0, jitter=0.5):
+        """ Initialize Backoff object """
+        if initial <= 0 or maximum < initial or not 0 <= jitter <= 1:
+            raise ValueError("Backoff(): need 0 < initial <= maximum and 0 <= jitter <= 1")
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def reset(self):
+        self.attempts = 0
+
+    def next_delay(self):
+        """Return the seconds to wait before the next attempt."""
+        delay = min(self.initial * self.factor ** self.attempts, self.maximum)
+        if delay < self.maximum:
+            self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
@@ -0,0 +1,429 @@
+"""Simulated Elmo control units for tests and load benchmarks.
+
+A SimulatedPanel is a TCP server on the asyncio event loop that speaks the
+same framing as a real control unit and answers ALLINEAMENTORIDOTTO,
+LETTURAINSERIBILI, STATOINGRESSI, ACCESSO_AL_SISTEMA, CONTROLLOREMOTO,
+LEGGINUOVIEVENTI, STATUSINFO, LETTURAMEMORIA and LEGGISTRINGHE from its own
+state. PanelFarm runs any number of them on one event loop in a background
+thread, for synchronous code. From the command line:
+
+    python -m elmoclient.simulator --panels 100 --change-interval 1
+
+prints the port of every panel, one per line, and serves until killed.
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from . import elmoprocessor as proc
+from .base import SIGTYPES
+
+
+def panel_frame(payload):
+    """Build a frame as sent by the control unit."""
+    msg = bytearray([len(payload), proc.FLAG_ELMO, 0x00, 0x01])
+    msg += payload
+    return bytes(proc.parse_to_send(msg))
+
+
+def encode_block(mask, num_bytes):
+    """Inverse of elmoprocessor.bitmask: position 1 in the MSB of the first byte."""
+    return mask.to_bytes(num_bytes, "little").translate(proc._BIT_REVERSE)
+
+
+def encode_block_invertito(mask, num_bytes):
+    """Inverse of elmoprocessor.bitmask_invertita: position 1 in the LSB."""
+    return mask.to_bytes(num_bytes, "little")
+
+
+def _num_bytes(positions):
+    return max(1, (positions + 7) // 8)
+
+
+# classe elemento degli eventi generati da set() e dei nomi
+_EVENT_CLASSES = {"ingresso": proc.INGRESSO, "uscita": proc.USCITA, "settore": proc.GRUPPO}
+
+# indirizzo dell'area di configurazione riportato da STATUSINFO
+CONFIG_ADDRESS = 0x8000
+
+
+class SimulatedPanel:
+    """A control unit listening on a local TCP port.
+
+    The state is a bitmask per sigtype, as in ElmoBase; change it with
+    set(), with a `script` of (delay, sigtype, pos, value) steps run after
+    start(), or with random input changes every `change_interval` seconds.
+    All the sectors start inseribili. Every change of an ingresso, uscita
+    or settore is logged in `events`, which keeps the last `event_capacity`
+    events for LEGGINUOVIEVENTI. `names` ({sigtype: {pos: name}}) are the
+    ingressi, uscite and settori in use, with the `serial` and `firmware`
+    reported by STATUSINFO.
+
+    Faults for load tests: `latency` delays every reply by a number of
+    seconds, or a random one in a (min, max) range; `fragment` sends the
+    replies in chunks of that many bytes; `drop_rate` is the probability
+    of not answering a request, and `mute` drops every request. When
+    `reply_code` is set, CONTROLLOREMOTO gets it instead of ACK. The
+    command byte of every request is appended to `received`.
+    """
+
+    def __init__(
+        self,
+        num_ingressi=32,
+        num_uscite=32,
+        num_settori=32,
+        user=None,
+        password=None,
+        latency=0,
+        fragment=0,
+        drop_rate=0,
+        change_interval=None,
+        script=None,
+        seed=None,
+        event_capacity=1000,
+        names=None,
+        serial=0x00C0FFEE,
+        firmware=(1, 0, 0),
+        host="127.0.0.1",
+        port=0,
+    ):
+        """ Initialize SimulatedPanel object """
+        self.num_ingressi = num_ingressi
+        self.num_uscite = num_uscite
+        self.num_settori = num_settori
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.fragment = fragment
+        self.drop_rate = drop_rate
+        self.change_interval = change_interval
+        self.script = script or []
+        self.host = host
+        self.port = port
+        self.mute = False
+        self.reply_code = None
+        self.received = []
+        self.masks = dict.fromkeys(SIGTYPES, 0)
+        self.masks["settore_inseribile"] = (1 << num_settori) - 1
+        self.events = deque(maxlen=event_capacity)
+        self._next_event = 0
+        # copia: i test cambiano i nomi di un pannello senza toccare quelli degli altri
+        self.names = {sigtype: dict(names) for sigtype, names in (names or {}).items()}
+        self.serial = serial
+        self.firmware = firmware
+        self._random = random.Random(seed)
+        self._server = None
+        self._tasks = []
+        self._writers = set()
+
+    def set(self, sigtype, pos, value):
+        """Set position `pos` of `sigtype`; the clients see it at their next poll."""
+        bit = 1 << (pos - 1)
+        old = self.masks[sigtype]
+        if value:
+            self.masks[sigtype] |= bit
+        else:
+            self.masks[sigtype] &= ~bit
+        if sigtype in _EVENT_CLASSES and self.masks[sigtype] != old:
+            code = proc.INSERIMENTO if value else proc.DISINSERIMENTO
+            self.log_event(code, _EVENT_CLASSES[sigtype], pos)
+
+    def log_event(self, code, classe, elemento, timestamp=None):
+        """Append an event to the log."""
+        if timestamp is None:
+            timestamp = int(time.time())
+        self.events.append((self._next_event, timestamp, code, classe, elemento))
+        self._next_event += 1
+
+    def disconnect(self):
+        """Close the connections of the clients, which may connect again.
+
+        Call it from the event loop of the panel.
+        """
+        for writer in list(self._writers):
+            writer.close()
+
+    async def start(self):
+        """Start listening; `port` holds the port in use afterwards."""
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.script:
+            self._tasks.append(asyncio.ensure_future(self._run_script()))
+        if self.change_interval:
+            self._tasks.append(asyncio.ensure_future(self._random_changes()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    # risposte
+
+    def status_frame(self):
+        """ALLINEAMENTORIDOTTO reply for the current state."""
+        masks = self.masks
+        ingressi = _num_bytes(self.num_ingressi)
+        uscite = _num_bytes(self.num_uscite)
+        settori = _num_bytes(self.num_settori)
+        payload = bytearray([ingressi, ingressi, uscite, 1, 1, settori, 0, settori, 1])
+        payload += encode_block(masks["ingresso"], ingressi)
+        payload += bytes(ingressi)  # memoria ingressi
+        payload += encode_block(masks["uscita"], uscite)
+        payload += encode_block_invertito(masks["uscita_dedicata"], 1)
+        payload += encode_block_invertito(masks["memoria_uscita_dedicata"], 1)
+        payload += encode_block(masks["settore"], settori)
+        payload += bytes(settori)  # settori in massima sicurezza
+        payload += encode_block_invertito(masks["anomalia"], 1)
+        return panel_frame(payload)
+
+    def inseribili_frame(self):
+        settori = _num_bytes(self.num_settori)
+        payload = bytearray([settori, 0]) + encode_block(self.masks["settore_inseribile"], settori)
+        return panel_frame(payload)
+
+    def ingressi_frame(self):
+        ingressi = _num_bytes(self.num_ingressi)
+        payload = bytearray([ingressi, ingressi]) + encode_block(self.masks["ingresso"], ingressi)
+        payload += bytes(ingressi)
+        return panel_frame(payload)
+
+    def eventi_frame(self, cursor, count):
+        """LEGGINUOVIEVENTI reply, in the layout of elmoprocessor.read_nuovi_eventi."""
+        count = min(count, proc.MAX_EVENT_BATCH)
+        oldest = self._next_event - len(self.events)
+        start = max(cursor, oldest) - oldest
+        batch = list(self.events)[start : start + count]
+        next_cursor = batch[-1][0] + 1 if batch else max(cursor, oldest)
+        payload = bytearray([len(batch)]) + next_cursor.to_bytes(4, "big")
+        for index, timestamp, code, classe, elemento in batch:
+            payload += index.to_bytes(4, "big") + timestamp.to_bytes(4, "big")
+            payload += bytes([code, classe]) + elemento.to_bytes(2, "big")
+        return panel_frame(payload)
+
+    def memory(self):
+        """The configuration area: one byte per element, bit 0 set when in use."""
+        memory = bytearray()
+        for sigtype, count in (
+            ("ingresso", self.num_ingressi),
+            ("uscita", self.num_uscite),
+            ("settore", self.num_settori),
+        ):
+            names = self.names.get(sigtype, {})
+            memory += bytes(1 if pos in names else 0 for pos in range(1, count + 1))
+        return memory
+
+    def statusinfo_frame(self):
+        payload = bytearray(self.serial.to_bytes(4, "big")) + bytes(self.firmware)
+        payload += self.num_ingressi.to_bytes(2, "big") + self.num_uscite.to_bytes(2, "big")
+        payload += bytes([self.num_settori]) + CONFIG_ADDRESS.to_bytes(4, "big")
+        payload += (self.num_ingressi + self.num_uscite + self.num_settori).to_bytes(2, "big")
+        return panel_frame(payload)
+
+    def memoria_frame(self, address, length):
+        start = address - CONFIG_ADDRESS
+        data = self.memory()[max(0, start) : max(0, start + length)]
+        return panel_frame(bytes([len(data)]) + data)
+
+    def stringa_frame(self, classe, elemento):
+        for sigtype, element_class in _EVENT_CLASSES.items():
+            if element_class == classe and elemento in self.names.get(sigtype, {}):
+                name = self.names[sigtype][elemento].encode("latin-1")
+                return panel_frame(name[: proc.STRING_SIZE].ljust(proc.STRING_SIZE))
+        return panel_frame(bytes([proc.NAK]))
+
+    def reply(self, decode):
+        """Return the reply frame to a decoded request."""
+        command = decode[4]
+        if command == proc.ALLINEAMENTORIDOTTO:
+            return self.status_frame()
+        if command == proc.LETTURAINSERIBILI:
+            return self.inseribili_frame()
+        if command == proc.STATOINGRESSI:
+            return self.ingressi_frame()
+        if command == proc.ACCESSO_AL_SISTEMA:
+            return panel_frame(bytes([self._login(decode[5:])]))
+        if command == proc.CONTROLLOREMOTO:
+            return panel_frame(bytes([self._controllo_remoto(decode[5:])]))
+        if command == proc.LEGGINUOVIEVENTI:
+            return self.eventi_frame(int.from_bytes(decode[5:9], "big"), decode[9])
+        if command == proc.STATUSINFO:
+            return self.statusinfo_frame()
+        if command == proc.LETTURAMEMORIA:
+            return self.memoria_frame(int.from_bytes(decode[5:9], "big"), decode[9])
+        if command == proc.LEGGISTRINGHE:
+            return self.stringa_frame(decode[5], int.from_bytes(decode[6:8], "big"))
+        return panel_frame(bytes([proc.ENQ]))
+
+    def _login(self, data):
+        if self.user is not None and int.from_bytes(data[:2], "big") != self.user:
+            return proc.BEL
+        if self.password is not None and data[2:] != proc.encrypt_password(self.password):
+            return proc.BEL
+        return proc.ACK
+
+    def _controllo_remoto(self, data):
+        if self.reply_code is not None:
+            return self.reply_code
+        comando, classe = data[0], data[1]
+        elemento = int.from_bytes(data[2:4], "big")
+        if classe != proc.GRUPPO or not 0 < elemento <= self.num_settori:
+            return proc.NAK
+        if comando == proc.INSERIMENTO:
+            self.set("settore", elemento, 1)
+        elif comando == proc.DISINSERIMENTO:
+            self.set("settore", elemento, 0)
+        else:
+            return proc.ENQ
+        return proc.ACK
+
+    # I/O
+
+    async def _serve(self, reader, writer):
+        framer = proc.FrameReader()
+        self._writers.add(writer)
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                framer.feed(data)
+                for frame in framer:
+                    try:
+                        decode = proc.recive(frame)
+                    except proc.FrameError:
+                        continue
+                    self.received.append(decode[4])
+                    if self.mute or self._random.random() < self.drop_rate:
+                        continue
+                    await self._send(writer, self.reply(decode))
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _send(self, writer, frame):
+        latency = self.latency
+        if isinstance(latency, tuple):
+            latency = self._random.uniform(*latency)
+        if latency:
+            await asyncio.sleep(latency)
+        if not self.fragment:
+            writer.write(frame)
+            await writer.drain()
+            return
+        for start in range(0, len(frame), self.fragment):
+            writer.write(frame[start : start + self.fragment])
+            await writer.drain()
+            # lascia partire il pezzo come segmento a sé
+            await asyncio.sleep(0.001)
+
+    async def _run_script(self):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        for delay, sigtype, pos, value in sorted(self.script, key=lambda step: step[0]):
+            await asyncio.sleep(max(0, start + delay - loop.time()))
+            self.set(sigtype, pos, value)
+
+    async def _random_changes(self):
+        while True:
+            await asyncio.sleep(self.change_interval)
+            pos = self._random.randint(1, self.num_ingressi)
+            self.set("ingresso", pos, not self.masks["ingresso"] >> (pos - 1) & 1)
+
+
+class PanelFarm:
+    """Run `count` SimulatedPanels on one event loop in a background thread.
+
+    The keyword arguments are passed to every panel. The panels are in
+    `panels` and their ports in `ports` once start() returns.
+    """
+
+    def __init__(self, count=1, **kwargs):
+        """ Initialize PanelFarm object """
+        self.panels = [SimulatedPanel(**kwargs) for _ in range(count)]
+        self.loop = None
+        self._thread = None
+
+    @property
+    def ports(self):
+        return [panel.port for panel in self.panels]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(started,), name="PanelFarm", daemon=True
+        )
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        future = asyncio.run_coroutine_threadsafe(self._stop_panels(), self.loop)
+        future.result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(asyncio.gather(*(panel.start() for panel in self.panels)))
+        started.set()
+        self.loop.run_forever()
+
+    async def _stop_panels(self):
+        await asyncio.gather(*(panel.stop() for panel in self.panels))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve simulated Elmo control units.")
+    parser.add_argument("--panels", type=int, default=1)
+    parser.add_argument("--ingressi", type=int, default=32)
+    parser.add_argument("--uscite", type=int, default=32)
+    parser.add_argument("--settori", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0, help="seconds before every reply")
+    parser.add_argument("--fragment", type=int, default=0, help="send replies in chunks of this size")
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--change-interval", type=float, default=None)
+    args = parser.parse_args()
+
+    panels = [
+        SimulatedPanel(
+            num_ingressi=args.ingressi,
+            num_uscite=args.uscite,
+            num_settori=args.settori,
+            latency=args.latency,
+            fragment=args.fragment,
+            drop_rate=args.drop_rate,
+            change_interval=args.change_interval,
+        )
+        for _ in range(args.panels)
+    ]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(asyncio.gather(*(panel.start() for panel in panels)))
+    for panel in panels:
+        print(panel.port, flush=True)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
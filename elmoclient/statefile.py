@@ -0,0 +1,79 @@
+"""State file for the warm start of a client.
+
+A client created with state_path restores from this file the status and
+the raw ALLINEAMENTORIDOTTO frame it last decoded, so get() does not read
+zeros before the first poll and only the real differences from the saved
+status fire the callbacks. The file is small and binary, with a table of
+offsets so that a reader can mmap it and pick a single block:
+
+    header:  b"ELMOSTA" + version (1 byte) + saved at (float64 time.time())
+             + number of blocks (1 byte)
+    table:   per block, offset (uint32) + length (uint16)
+    blocks:  the raw frame, then the bitmask of every sigtype in SIGTYPES
+             order, as little-endian bytes
+
+all little-endian. save_state() writes a new file and renames it over the
+old one, so a crash never leaves a half written state.
+"""
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+MAGIC = b"ELMOSTA"
+VERSION = 1
+_HEADER = struct.Struct("<7sBdB")
+_ENTRY = struct.Struct("<IH")
+
+# saved_at: time.time() del salvataggio, frame: ultimo ALLINEAMENTORIDOTTO
+# (o None), masks: {sigtype: bitmask}
+SavedState = namedtuple("SavedState", ["saved_at", "frame", "masks"])
+
+
+def save_state(path, saved_at, frame, masks, sigtypes):
+    """Write `frame` and the `masks` of `sigtypes` to `path`, atomically."""
+    blocks = [bytes(frame or b"")]
+    for sigtype in sigtypes:
+        mask = masks[sigtype]
+        blocks.append(mask.to_bytes((mask.bit_length() + 7) // 8, "little"))
+    offset = _HEADER.size + _ENTRY.size * len(blocks)
+    table = bytearray()
+    for block in blocks:
+        table += _ENTRY.pack(offset, len(block))
+        offset += len(block)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, saved_at, len(blocks)))
+        f.write(table)
+        for block in blocks:
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_state(path, sigtypes):
+    """Read a file written by save_state() into a SavedState.
+
+    Raises OSError when the file cannot be read and ValueError when it is
+    not a valid state file for `sigtypes`.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _HEADER.size:
+            raise ValueError(f"{path}: not an elmoclient state file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, saved_at, count = _HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION or count != len(sigtypes) + 1:
+                raise ValueError(f"{path}: not an elmoclient state file")
+            if _HEADER.size + count * _ENTRY.size > size:
+                raise ValueError(f"{path}: truncated state file")
+            blocks = []
+            for i in range(count):
+                offset, length = _ENTRY.unpack_from(data, _HEADER.size + i * _ENTRY.size)
+                if offset + length > size:
+                    raise ValueError(f"{path}: truncated state file")
+                blocks.append(data[offset : offset + length])
+    masks = {sigtype: int.from_bytes(block, "little") for sigtype, block in zip(sigtypes, blocks[1:])}
+    return SavedState(saved_at, blocks[0] or None, masks)
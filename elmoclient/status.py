@@ -0,0 +1,73 @@
+import threading
+from collections import namedtuple
+
+# Posizioni per sigtype prima che la centrale riporti le dimensioni dei blocchi
+DEFAULT_SIZES = {
+    "ingresso": 32,
+    "uscita": 32,
+    "settore": 32,
+    "uscita_dedicata": 8,
+    "memoria_uscita_dedicata": 8,
+    "anomalia": 8,
+    "settore_inseribile": 32,
+}
+
+
+class StatusStore:
+    """Bitmasks, sizes and subscribers of the panel signals.
+
+    Each sigtype is an int bitmask (bit pos - 1 is position pos) with the
+    number of positions the panel reported for it, which grows when the
+    panel reports larger blocks; reads go through the Snapshot built from
+    them. Callbacks are kept in a separate index holding only the
+    subscribed positions.
+    """
+
+    def __init__(self, sizes=None):
+        """ Initialize StatusStore object """
+        self._sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+        self.masks = dict.fromkeys(self._sizes, 0)
+        self.callbacks = {sigtype: {} for sigtype in self._sizes}
+        self._lock = threading.Lock()
+
+    def size(self, sigtype):
+        return self._sizes[sigtype]
+
+    def resize(self, sigtype, size):
+        """Make room for positions 1..size of `sigtype`; never shrinks."""
+        if size > self._sizes[sigtype]:
+            self._sizes[sigtype] = size
+
+    def subscribe(self, sigtype, pos, callback):
+        with self._lock:
+            callbacks = self.callbacks[sigtype]
+            # copia: update() può iterare sulla lista in un altro thread
+            callbacks[pos] = callbacks.get(pos, []) + [callback]
+
+
+class Snapshot(namedtuple("Snapshot", ["version", "timestamp", "masks", "sizes", "stale"])):
+    """Immutable panel status after a decoded frame.
+
+    `masks` maps each sigtype to its bitmask (bit pos - 1 is position pos)
+    and `sizes` to its number of positions; `version` grows by one for
+    every frame that changes something and `timestamp` is its time.time().
+    `stale` is True for a status restored from a state file until the
+    first frame from the control unit.
+    """
+
+    __slots__ = ()
+
+    def get(self, sigtype, pos):
+        return (self.masks[sigtype] >> (pos - 1)) & 1 if pos > 0 else 0
+
+    def get_many(self, sigtype, positions):
+        mask = self.masks[sigtype]
+        return [(mask >> (pos - 1)) & 1 if pos > 0 else 0 for pos in positions]
+
+    def get_all(self, sigtype):
+        """Return {pos: value} for every position of `sigtype`."""
+        mask = self.masks[sigtype]
+        return {pos: (mask >> (pos - 1)) & 1 for pos in range(1, self.sizes[sigtype] + 1)}
+
+
+Snapshot.__new__.__defaults__ = (False,)
@@ -0,0 +1,109 @@
+"""Ring buffer of the raw frames exchanged with a control unit.
+
+Pass trace=WireTrace() to a client to keep the last `capacity` frames
+sent and received, with their time.monotonic() timestamp. dump() writes
+them to a compact binary file for post-mortem analysis:
+
+    header:  b"ELMOTRC" + version (1 byte) + wall clock offset (float64)
+    record:  timestamp (float64) + direction (1 byte) + length (uint16) + frame
+
+all little-endian; the offset is time.time() - time.monotonic() at dump
+time. To print a dump:
+
+    python -m elmoclient.trace trace.bin
+"""
+import argparse
+import struct
+import time
+from collections import deque, namedtuple
+
+TX = 0
+RX = 1
+
+MAGIC = b"ELMOTRC"
+VERSION = 1
+_HEADER = struct.Struct("<7sBd")
+_RECORD = struct.Struct("<dBH")
+
+# timestamp: time.monotonic() della registrazione, direction: TX o RX
+TraceEntry = namedtuple("TraceEntry", ["timestamp", "direction", "data"])
+
+
+class WireTrace:
+    """The last `capacity` frames sent (TX) and received (RX).
+
+    record() is a single deque append, safe from any thread.
+    """
+
+    def __init__(self, capacity=1024):
+        """ Initialize WireTrace object """
+        self.capacity = capacity
+        self.clock_offset = time.time() - time.monotonic()
+        self._entries = deque(maxlen=capacity)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def record(self, direction, data):
+        self._entries.append(TraceEntry(time.monotonic(), direction, bytes(data)))
+
+    def entries(self):
+        """Return the recorded TraceEntry tuples, oldest first."""
+        return list(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def dump(self, path):
+        """Write the recorded frames to `path` in the binary format above."""
+        entries = self.entries()
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, time.time() - time.monotonic()))
+            for timestamp, direction, data in entries:
+                f.write(_RECORD.pack(timestamp, direction, len(data)))
+                f.write(data)
+
+    @classmethod
+    def load(cls, path):
+        """Read a file written by dump() into a new WireTrace.
+
+        Raises ValueError when the file is not a valid trace.
+        """
+        with open(path, "rb") as f:
+            content = f.read()
+        if len(content) < _HEADER.size:
+            raise ValueError(f"{path}: not an elmoclient wire trace")
+        magic, version, clock_offset = _HEADER.unpack_from(content)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not an elmoclient wire trace")
+        entries = []
+        pos = _HEADER.size
+        while pos < len(content):
+            if pos + _RECORD.size > len(content):
+                raise ValueError(f"{path}: truncated record at byte {pos}")
+            timestamp, direction, length = _RECORD.unpack_from(content, pos)
+            pos += _RECORD.size
+            data = content[pos : pos + length]
+            if len(data) != length:
+                raise ValueError(f"{path}: truncated record at byte {pos}")
+            pos += length
+            entries.append(TraceEntry(timestamp, direction, data))
+        trace = cls(max(1, len(entries)))
+        trace.clock_offset = clock_offset
+        trace._entries.extend(entries)
+        return trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a wire trace written by WireTrace.dump().")
+    parser.add_argument("path")
+    args = parser.parse_args()
+    trace = WireTrace.load(args.path)
+    for timestamp, direction, data in trace.entries():
+        wall = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp + trace.clock_offset))
+        fraction = f"{(timestamp + trace.clock_offset) % 1:.6f}"[1:]
+        print(f"{wall}{fraction} {'TX' if direction == TX else 'RX'} {data.hex()}")
+
+
+if __name__ == "__main__":
+    main()
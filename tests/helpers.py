@@ -0,0 +1,11 @@
+import time
+
+
+def wait_for(condition, timeout=5):
+    """Poll `condition` until it is true; return False after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import unittest
+import elmoclient.elmoprocessor as proc
+from elmoclient import AsyncElmoClient, PollScheduler
+from elmoclient.simulator import SimulatedPanel
+
+
+class TestAsyncElmoClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # il debug mode di asyncio registra uno stack per ogni task
+        asyncio.get_running_loop().set_debug(False)
+        self.panel = SimulatedPanel()
+        await self.panel.start()
+
+    async def asyncTearDown(self):
+        await self.panel.stop()
+
+    async def test_commands(self):
+        elmo = AsyncElmoClient("127.0.0.1", self.panel.port, user=1, password="1234")
+        await elmo.start()
+        await elmo.wait_connected(2)
+        result = await elmo.accesso_sistema()
+        self.assertEqual(result.code, proc.ACK)
+        self.assertGreater(result.rtt, 0)
+        self.assertTrue(elmo.logged_in)
+        self.panel.reply_code = proc.NAK
+        self.assertEqual((await elmo.inserisci_settore(1)).code, proc.NAK)
+        await elmo.disinserisci_settore(1)
+        await elmo.lettura_settori_inseribili()
+        self.assertEqual(elmo.get("settore_inseribile", 1), 1)
+        await elmo.stop()
+        self.assertEqual(
+            self.panel.received,
+            [
+                proc.ACCESSO_AL_SISTEMA,
+                proc.CONTROLLOREMOTO,
+                proc.CONTROLLOREMOTO,
+                proc.LETTURAINSERIBILI,
+            ],
+        )
+
+    async def test_polling(self):
+        elmo = AsyncElmoClient("127.0.0.1", self.panel.port, poll_scheduler=PollScheduler(0.01, 0.01))
+        elmo.polling_enabled = True
+        await elmo.start()
+        for _ in range(200):
+            if elmo.get("settore_inseribile", 1):
+                break
+            await asyncio.sleep(0.01)
+        await elmo.stop()
+        self.assertIn(proc.ALLINEAMENTORIDOTTO, self.panel.received)
+        self.assertEqual(elmo.get("anomalia", 1), 0)
+        self.assertEqual(elmo.get("settore_inseribile", 1), 1)
+
+    async def test_many_panels_without_threads(self):
+        threads = threading.active_count()
+        clients = [AsyncElmoClient("127.0.0.1", self.panel.port) for _ in range(200)]
+        for elmo in clients:
+            await elmo.start()
+        await asyncio.gather(*(elmo.wait_connected(5) for elmo in clients))
+        await asyncio.gather(*(elmo.lettura_settori_inseribili() for elmo in clients))
+        self.assertEqual(threading.active_count(), threads)
+        for elmo in clients:
+            self.assertEqual(elmo.get("settore_inseribile", 8), 1)
+            await elmo.stop()
+
+    async def test_timeout(self):
+        self.panel.mute = True
+        elmo = AsyncElmoClient("127.0.0.1", self.panel.port, timeout=0.1)
+        await elmo.start()
+        await elmo.wait_connected(2)
+        with self.assertRaises(TimeoutError):
+            await elmo.inserisci_settore(1)
+        await elmo.stop()
+
+    async def test_cancelled_command(self):
+        elmo = AsyncElmoClient("127.0.0.1", self.panel.port, timeout=5, poll_scheduler=PollScheduler(0.01, 0.01))
+        await elmo.start()
+        await elmo.wait_connected(2)
+        self.panel.mute = True
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(elmo.inserisci_settore(1), 0.1)
+        self.panel.mute = False
+        elmo.polling_enabled = True
+        for _ in range(100):
+            if proc.ALLINEAMENTORIDOTTO in self.panel.received:
+                break
+            await asyncio.sleep(0.05)
+        self.assertIn(proc.ALLINEAMENTORIDOTTO, self.panel.received)
+        self.assertEqual((await elmo.inserisci_settore(1)).code, proc.ACK)
+        await elmo.stop()
+
+    async def test_reconnect_replays_login(self):
+        elmo = AsyncElmoClient("127.0.0.1", self.panel.port, user=1, password="1234")
+        elmo.polling_enabled = True
+        await elmo.start()
+        await elmo.wait_connected(2)
+        await elmo.accesso_sistema()
+        self.panel.disconnect()
+        for _ in range(100):
+            if self.panel.received.count(proc.ACCESSO_AL_SISTEMA) == 2 and elmo.connected:
+                break
+            await asyncio.sleep(0.05)
+        await elmo.wait_connected(2)
+        self.assertEqual(self.panel.received.count(proc.ACCESSO_AL_SISTEMA), 2)
+        self.assertEqual(elmo.metrics()["recovery_time"]["count"], 1)
+        await elmo.stop()
+
+    async def test_not_connected(self):
+        elmo = AsyncElmoClient("127.0.0.1", self.panel.port)
+        with self.assertRaises(ConnectionError):
+            await elmo.inserisci_settore(1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await elmo.wait_connected(timeout=0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
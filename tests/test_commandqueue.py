@@ -0,0 +1,62 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from elmoclient.commandqueue import CommandQueue
+
+
+class TestCommandQueue(unittest.TestCase):
+    def test_repeated_read_is_coalesced(self):
+        queue = CommandQueue()
+        first, second = Future(), Future()
+        queue.put("lettura_inseribili", b"read", first, read=True)
+        queue.put("lettura_inseribili", b"read", second, read=True)
+        self.assertEqual(queue.depth, 1)
+        self.assertEqual(queue.dropped, 1)
+        command, tx, future = queue.get(0)
+        self.assertIs(future, first)
+        future.set_result("done")
+        self.assertEqual(second.result(0), "done")
+        self.assertIsNone(queue.get(0))
+
+    def test_read_after_send_is_queued(self):
+        queue = CommandQueue()
+        queue.put("lettura_inseribili", b"read", Future(), read=True)
+        queue.get(0)
+        queue.put("lettura_inseribili", b"read", Future(), read=True)
+        self.assertEqual(queue.depth, 1)
+        self.assertEqual(queue.dropped, 0)
+
+    def test_last_command_on_sector_wins(self):
+        queue = CommandQueue()
+        arm, disarm, other = Future(), Future(), Future()
+        queue.put("ins_settore", b"arm1", arm, key=("settore", 1))
+        queue.put("ins_settore", b"arm2", other, key=("settore", 2))
+        queue.put("disins_settore", b"disarm1", disarm, key=("settore", 1))
+        self.assertTrue(arm.cancelled())
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual([queue.get(0)[1], queue.get(0)[1]], [b"arm2", b"disarm1"])
+
+    def test_commands_before_reads(self):
+        queue = CommandQueue()
+        queue.put("lettura_ingressi", b"read", Future(), read=True)
+        queue.put("accesso_sistema", b"login", Future())
+        queue.put("accesso_sistema", b"login", Future())
+        self.assertEqual(queue.depth, 3)
+        self.assertEqual([queue.get(0)[1] for _ in range(3)], [b"login", b"login", b"read"])
+
+    def test_wake_and_clear(self):
+        queue = CommandQueue()
+        threading.Timer(0.05, queue.wake).start()
+        start = time.monotonic()
+        self.assertIsNone(queue.get(5))
+        self.assertLess(time.monotonic() - start, 1)
+        future = Future()
+        queue.put("lettura_ingressi", b"read", future, read=True)
+        queue.clear()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(queue.depth, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+import elmoclient.elmoprocessor as proc
+from elmoclient import AsyncElmoClient, CommandResult, ElmoClient, PanelInfo
+from elmoclient.config import memory_chunks, elements_in_use
+from elmoclient.simulator import SimulatedPanel, PanelFarm
+
+NAMES = {
+    "ingresso": {1: "Porta ingresso", 2: "Finestra cucina", 299: "Garage"},
+    "uscita": {3: "Sirena"},
+    "settore": {1: "Giorno", 2: "Notte"},
+}
+
+
+class TestConfigRecords(unittest.TestCase):
+    def test_statusinfo(self):
+        panel = SimulatedPanel(num_ingressi=300, serial=0x01020304, firmware=(4, 1, 7))
+        decode = proc.recive(panel.statusinfo_frame())
+        info = PanelInfo(*proc.read_statusinfo(decode[4:]))
+        self.assertEqual(info, PanelInfo(0x01020304, (4, 1, 7), 300, 32, 32, 0x8000, 364))
+        with self.assertRaises(proc.FrameError):
+            proc.read_statusinfo(decode[4:-1])
+
+    def test_memory_layout(self):
+        info = PanelInfo(1, (1, 0, 0), 300, 32, 32, 0x8000, 364)
+        self.assertEqual(memory_chunks(info), [(0x8000, 254), (0x8000 + 254, 110)])
+        memory = SimulatedPanel(num_ingressi=300, names=NAMES).memory()
+        self.assertEqual(
+            elements_in_use(info, memory),
+            [("ingresso", 1), ("ingresso", 2), ("ingresso", 299), ("uscita", 3), ("settore", 1), ("settore", 2)],
+        )
+
+    def test_command_result_data(self):
+        self.assertIsNone(CommandResult(proc.ACK, 0.1).data)
+
+
+class TestConfigLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.farm = PanelFarm(1, num_ingressi=300, names=NAMES)
+        self.farm.start()
+        self.panel = self.farm.panels[0]
+
+    def tearDown(self):
+        self.farm.stop()
+        self.tmp.cleanup()
+
+    def load(self, **kwargs):
+        elmo = ElmoClient("127.0.0.1", self.farm.ports[0])
+        elmo.start()
+        try:
+            return elmo.leggi_configurazione(cache_dir=self.tmp.name, timeout=2, **kwargs)
+        finally:
+            elmo.stop()
+
+    def test_load_and_cache(self):
+        config = self.load()
+        self.assertEqual(config.info.num_ingressi, 300)
+        self.assertEqual(config.names, NAMES)
+        self.assertEqual(self.panel.received.count(proc.LETTURAMEMORIA), 2)
+        # solo i nomi degli elementi in uso
+        self.assertEqual(self.panel.received.count(proc.LEGGISTRINGHE), 6)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 1)
+
+        del self.panel.received[:]
+        self.assertEqual(self.load(), config)
+        self.assertEqual(self.panel.received, [proc.STATUSINFO])
+
+        # un nuovo firmware invalida la cache
+        self.panel.firmware = (1, 1, 0)
+        self.panel.names["uscita"][4] = "Luce"
+        config = self.load()
+        self.assertEqual(config.names["uscita"], {3: "Sirena", 4: "Luce"})
+        self.assertEqual(len(os.listdir(self.tmp.name)), 2)
+
+        self.panel.names["uscita"][5] = "Cancello"
+        self.assertNotIn(5, self.load().names["uscita"])
+        self.assertIn(5, self.load(refresh=True).names["uscita"])
+
+
+class TestAsyncConfigLoader(unittest.IsolatedAsyncioTestCase):
+    async def test_load(self):
+        panel = SimulatedPanel(names=NAMES)
+        await panel.start()
+        elmo = AsyncElmoClient("127.0.0.1", panel.port)
+        await elmo.start()
+        await elmo.wait_connected(2)
+        config = await elmo.leggi_configurazione()
+        self.assertEqual(config.info.num_ingressi, 32)
+        self.assertEqual(config.names["ingresso"], {1: "Porta ingresso", 2: "Finestra cucina"})
+        self.assertEqual(config.names["settore"], NAMES["settore"])
+        await elmo.stop()
+        await panel.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import threading
+import time
+import unittest
+from elmoclient import ElmoClient
+from elmoclient.dispatcher import CallbackDispatcher
+
+
+class TestCallbackDispatcher(unittest.TestCase):
+    def test_slow_callback_does_not_block_updates(self):
+        dispatcher = CallbackDispatcher(workers=2)
+        elmo = ElmoClient("192.168.1.4", dispatcher=dispatcher)
+        calls = []
+
+        def slow(*args):
+            time.sleep(0.05)
+            calls.append(args)
+
+        elmo.subscribe("ingresso", 1, slow)
+        elmo.update_signals("ingresso", 0)
+        start = time.monotonic()
+        for value in (1, 0, 1, 0):
+            elmo.update_signals("ingresso", value)
+        self.assertLess(time.monotonic() - start, 0.05)
+        dispatcher.join()
+        dispatcher.stop()
+        # stesso ordine dei cambiamenti
+        self.assertEqual(calls, [("i", 1, 1), ("i", 1, 0), ("i", 1, 1), ("i", 1, 0)])
+        self.assertEqual(dispatcher.dispatched, 4)
+        self.assertGreater(dispatcher.lag_max, 0.1)
+
+    def test_order_per_position(self):
+        dispatcher = CallbackDispatcher(workers=4)
+        seen = {}
+        lock = threading.Lock()
+
+        def record(sigtype, pos, value):
+            with lock:
+                seen.setdefault(pos, []).append(value)
+
+        for i in range(100):
+            for pos in range(1, 9):
+                dispatcher.dispatch(record, "uscita", pos, i)
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(seen, {pos: list(range(100)) for pos in range(1, 9)})
+
+    def test_overflow_policies(self):
+        for overflow, expected in (("drop_newest", [0, 1]), ("drop_oldest", [0, 3])):
+            dispatcher = CallbackDispatcher(workers=1, maxsize=1, overflow=overflow)
+            release = threading.Event()
+            calls = []
+
+            def callback(sigtype, pos, value):
+                release.wait(5)
+                calls.append(value)
+
+            dispatcher.dispatch(callback, "settore", 1, 0)
+            # il worker è occupato col primo, la coda ne contiene uno solo
+            while dispatcher.pending:
+                time.sleep(0.001)
+            for value in (1, 2, 3):
+                dispatcher.dispatch(callback, "settore", 1, value)
+            release.set()
+            dispatcher.join()
+            dispatcher.stop()
+            self.assertEqual(calls, expected, overflow)
+            self.assertEqual(dispatcher.dropped, 2, overflow)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            CallbackDispatcher(overflow="drop_all")
+
+
+if __name__ == "__main__":
+    unittest.main()
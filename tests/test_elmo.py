@@ -1,6 +1,10 @@
+import socket
 import unittest
 import time
-from elmoclient import ElmoClient
+import elmoclient.elmoprocessor as proc
+from elmoclient import ElmoClient, PollScheduler, Change, Backoff
+from elmoclient.simulator import PanelFarm
+from helpers import wait_for
 
 allrid_portachiusa = bytes.fromhex(
     "02442800011090109010900101040004010000000000000000000000000000000000010000001082000000000000000000000000000000000000000000000000000000108300000000000000000000ae03"
@@ -30,67 +34,17 @@ accesso_sistema_resp_ok = bytes.fromhex("020128000106003003")
 accesso_sistema_resp_ko = bytes.fromhex("020128000107003103")
 
 
-class TestPerformance(unittest.TestCase):
-    def test_performance_allineamento_ridotto(self):
-        elmo = ElmoClient("192.168.1.4")
-        start = time.time()
-        elmo.parse_update(allrid_portachiusa)
-        end = time.time()
-        print(end - start)
-        start = time.time()
-        elmo.parse_update(allrid_portaaperta)
-        end = time.time()
-        print(end - start)
-        start = time.time()
-        elmo.parse_update(allrid_tuttoaperto)
-        end = time.time()
-        print(end - start)
-        start = time.time()
-        elmo.parse_update(allrid_portachiusa)
-        end = time.time()
-        print(end - start)
-
-    def test_performance_lettura_settori_inseribili(self):
-        elmo = ElmoClient("192.168.1.4")
-        print("settori inseribili")
-        start = time.time()
-        elmo.parse_settori_inseribili(lettura_settori_inseribili_tutti)
-        end = time.time()
-        print(end - start)
-        start = time.time()
-        elmo.parse_settori_inseribili(lettura_settori_inseribili_tutti)
-        end = time.time()
-        print(end - start)
-
-    def test_performance_lettura_stato_ingressi(self):
-        elmo = ElmoClient("192.168.1.4")
-        print("stato ingressi ")
-        start = time.time()
-        elmo.parse_stato_ingressi(lettura_stato_ingressi)
-        end = time.time()
-        print(f"setup {end - start}")
-        start = time.time()
-        elmo.parse_stato_ingressi(lettura_stato_ingressi_porta_aperta)
-        end = time.time()
-        print(end - start)
-        start = time.time()
-        elmo.parse_stato_ingressi(lettura_stato_ingressi)
-        end = time.time()
-        print(end - start)
-        start = time.time()
-
-
 class TestParsers(unittest.TestCase):
     def test_lettura_stato_ingressi(self):
         # questo controlla anche che la lettura sia ordinata
         elmo = ElmoClient("192.168.1.4")
         elmo.parse_stato_ingressi(lettura_stato_ingressi)
-        self.assertEqual(elmo._status["ingresso"][19][0], 0)
-        self.assertEqual(elmo._status["ingresso"][29][0], 1)
+        self.assertEqual(elmo.get("ingresso", 19), 0)
+        self.assertEqual(elmo.get("ingresso", 29), 1)
         elmo.parse_stato_ingressi(lettura_stato_ingressi_porta_aperta)
         # e camera anna
-        self.assertEqual(elmo._status["ingresso"][19][0], 1)
-        self.assertEqual(elmo._status["ingresso"][29][0], 1)
+        self.assertEqual(elmo.get("ingresso", 19), 1)
+        self.assertEqual(elmo.get("ingresso", 29), 1)
 
     def test_accesso_sistema(self):
         # questo controlla anche che la lettura sia ordinata
@@ -106,36 +60,211 @@ class TestParsers(unittest.TestCase):
         # la stringa viene invertita
         elmo = ElmoClient("192.168.1.4")
         elmo.parse_update(allrid_settori_inseriti)
-        self.assertEqual(elmo._status["memoria_uscita_dedicata"][1][0], 1)
-        self.assertEqual(elmo._status["memoria_uscita_dedicata"][2][0], 1)
+        self.assertEqual(elmo.get("memoria_uscita_dedicata", 1), 1)
+        self.assertEqual(elmo.get("memoria_uscita_dedicata", 2), 1)
 
     def test_lettura_settori_inseribili(self):
         elmo = ElmoClient("192.168.1.4")
         elmo.parse_settori_inseribili(lettura_settori_inseribili_tutti)
-        self.assertEqual(elmo._status["settore_inseribile"][1][0], 1)
-        self.assertEqual(elmo._status["settore_inseribile"][8][0], 1)
+        self.assertEqual(elmo.get("settore_inseribile", 1), 1)
+        self.assertEqual(elmo.get("settore_inseribile", 8), 1)
         elmo.parse_settori_inseribili(lettura_settori_inseribili_no_primo)
-        self.assertEqual(elmo._status["settore_inseribile"][1][0], 0)
+        self.assertEqual(elmo.get("settore_inseribile", 1), 0)
 
     def test_allineamento_ridotto_ingressi(self):
         # questo controlla anche che la lettura sia ordinata
         elmo = ElmoClient("192.168.1.4")
         elmo.parse_update(allrid_portachiusa)
-        self.assertEqual(elmo._status["ingresso"][19][0], 0)
-        self.assertEqual(elmo._status["ingresso"][23][0], 0)
+        self.assertEqual(elmo.get("ingresso", 19), 0)
+        self.assertEqual(elmo.get("ingresso", 23), 0)
         elmo.parse_update(allrid_portaaperta)
-        self.assertEqual(elmo._status["ingresso"][19][0], 1)
-        self.assertEqual(elmo._status["ingresso"][23][0], 1)
+        self.assertEqual(elmo.get("ingresso", 19), 1)
+        self.assertEqual(elmo.get("ingresso", 23), 1)
 
     def test_allineamento_ridotto_uscite_settori(self):
         elmo = ElmoClient("192.168.1.4")
         elmo.parse_update(allrid_portachiusa)
-        self.assertEqual(elmo._status["uscita"][4][0], 0)
-        self.assertEqual(elmo._status["settore"][1][0], 0)
+        self.assertEqual(elmo.get("uscita", 4), 0)
+        self.assertEqual(elmo.get("settore", 1), 0)
+        elmo.parse_update(allrid_settore1_uscita4_inseriti)
+        self.assertEqual(elmo.get("uscita", 4), 1)
+        self.assertEqual(elmo.get("settore", 1), 1)
+
+    def test_callbacks_only_for_changed_positions(self):
+        elmo = ElmoClient("192.168.1.4")
+        calls = []
+        elmo.subscribe("ingresso", 19, lambda *args: calls.append(args))
+        elmo.subscribe("ingresso", 20, lambda *args: calls.append(args))
+        elmo.parse_update(allrid_portachiusa)
+        self.assertEqual(calls, [])
+        elmo.parse_update(allrid_portaaperta)
+        self.assertEqual(calls, [("i", 19, 1)])
+        elmo.parse_update(allrid_portachiusa)
+        self.assertEqual(calls, [("i", 19, 1), ("i", 19, 0)])
+
+    def test_only_changed_blocks_decoded(self):
+        elmo = ElmoClient("192.168.1.4")
+        elmo.parse_update(allrid_portachiusa)
+        self.assertEqual((elmo.blocks_decoded, elmo.blocks_skipped), (8, 0))
+        # cambia solo il blocco degli ingressi
+        elmo.parse_update(allrid_portaaperta)
+        self.assertEqual((elmo.blocks_decoded, elmo.blocks_skipped), (9, 7))
+        self.assertEqual(elmo.get("ingresso", 19), 1)
+        self.assertEqual(elmo.metrics()["blocks_skipped"], 7)
+
+    def test_stato_ingressi_invalidates_block(self):
+        elmo = ElmoClient("192.168.1.4")
+        elmo.parse_update(allrid_portachiusa)
+        elmo.parse_stato_ingressi(lettura_stato_ingressi)
+        self.assertEqual(elmo.get("ingresso", 29), 1)
+        # gli ingressi del frame sono uguali ai precedenti ma vanno decodificati
+        elmo.parse_update(allrid_settore1_uscita4_inseriti)
+        self.assertEqual(elmo.get("ingresso", 29), 0)
+        self.assertEqual(elmo.get("settore", 1), 1)
+        # anche un frame identico al precedente
+        elmo.parse_stato_ingressi(lettura_stato_ingressi)
+        self.assertEqual(elmo.get("ingresso", 29), 1)
+        elmo.parse_update(allrid_settore1_uscita4_inseriti)
+        self.assertEqual(elmo.get("ingresso", 29), 0)
+
+    def test_change_set_per_frame(self):
+        elmo = ElmoClient("192.168.1.4")
+        elmo.parse_update(allrid_portachiusa)
+        changesets = []
+        elmo.subscribe_changes(changesets.append)
+        sectors = []
+        elmo.subscribe_changes(sectors.append, sigtypes=["settore"])
         elmo.parse_update(allrid_settore1_uscita4_inseriti)
-        self.assertEqual(elmo._status["uscita"][4][0], 1)
-        self.assertEqual(elmo._status["settore"][1][0], 1)
+        self.assertEqual(len(changesets), 1)
+        self.assertIn(Change("settore", 1, 0, 1), changesets[0].changes)
+        self.assertIn(Change("uscita", 4, 0, 1), changesets[0].changes)
+        self.assertEqual(len(sectors), 1)
+        self.assertTrue(all(change.sigtype == "settore" for change in sectors[0].changes))
+        self.assertGreater(sectors[0].timestamp, 0)
+        # nessun change set se il frame non cambia niente
+        elmo.parse_update(allrid_settore1_uscita4_inseriti)
+        elmo.parse_stato_ingressi(lettura_stato_ingressi)
+        self.assertEqual(len(sectors), 1)
+        self.assertEqual(changesets[-1].changes[0].sigtype, "ingresso")
+
+    def test_bad_checksum_rejected(self):
+        elmo = ElmoClient("192.168.1.4")
+        elmo.parse_update(allrid_tuttoaperto)
+        self.assertEqual(elmo.frames_rejected, 1)
+        self.assertEqual(elmo.get("ingresso", 1), 0)
+        elmo.parse_update(bytes.fromhex("0201280010050106003003"))
+        self.assertEqual(elmo.frames_rejected, 2)
+
+    def test_update_signals_string(self):
+        elmo = ElmoClient("192.168.1.4")
+        elmo.update_signals("uscita", "0001")
+        self.assertEqual(elmo.get("uscita", 4), 1)
+        self.assertEqual(elmo.get("uscita", 1), 0)
+
+
+class TestCommandResults(unittest.TestCase):
+    def setUp(self):
+        self.farm = PanelFarm()
+        self.farm.start()
+        self.panel = self.farm.panels[0]
+
+    def tearDown(self):
+        self.elmo.stop()
+        self.farm.stop()
+
+    def test_command_result(self):
+        self.elmo = ElmoClient("127.0.0.1", self.panel.port, user=1, password="1234")
+        self.elmo.start()
+        result = self.elmo.accesso_sistema().result(5)
+        self.assertEqual(result.code, proc.ACK)
+        self.assertGreater(result.rtt, 0)
+        self.assertTrue(self.elmo.logged_in)
+        self.panel.reply_code = proc.NAK
+        self.assertEqual(self.elmo.inserisci_settore(1).result(5).code, proc.NAK)
+        self.assertEqual(self.elmo.richiedi_lettura_settori_inseribili().result(5).code, proc.ACK)
+        self.assertEqual(self.elmo.get("settore_inseribile", 1), 1)
+
+    def test_command_sent_without_waiting_for_poll(self):
+        self.elmo = ElmoClient("127.0.0.1", self.panel.port, poll_scheduler=PollScheduler(2, 2))
+        self.elmo.polling_enabled = True
+        self.elmo.start()
+        self.elmo.inserisci_settore(1).result(5)
+        latencies = []
+        for _ in range(20):
+            start = time.monotonic()
+            result = self.elmo.inserisci_settore(1).result(5)
+            # tempo dall'accodamento all'invio
+            latencies.append(time.monotonic() - start - result.rtt)
+        latencies.sort()
+        self.assertLess(latencies[len(latencies) // 2], 0.001)
+        self.assertLess(latencies[-1], 0.05)
+
+    def test_command_timeout(self):
+        self.panel.mute = True
+        self.elmo = ElmoClient("127.0.0.1", self.panel.port, timeout=0.2)
+        self.elmo.start()
+        with self.assertRaises(TimeoutError):
+            self.elmo.disinserisci_settore(1).result(5)
+
+
+class TestConnection(unittest.TestCase):
+    def setUp(self):
+        self.farm = PanelFarm()
+        self.farm.start()
+        self.panel = self.farm.panels[0]
+
+    def tearDown(self):
+        self.farm.stop()
+
+    def test_stop_is_fast(self):
+        elmo = ElmoClient("127.0.0.1", self.panel.port, timeout=5, poll_scheduler=PollScheduler(5, 5))
+        elmo.polling_enabled = True
+        elmo.start()
+        self.assertTrue(wait_for(lambda: elmo.connected))
+        self.assertEqual(elmo.socket.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+        self.assertEqual(elmo.socket.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+        # in attesa di una risposta che non arriva
+        self.panel.mute = True
+        future = elmo.inserisci_settore(1)
+        self.assertTrue(wait_for(lambda: future.running()))
+        start = time.monotonic()
+        elmo.stop()
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertIsNotNone(future.exception(1))
+        self.assertEqual(elmo.metrics()["reconnects"], 0)
+
+    def test_stop_while_reconnecting(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        # nessuno in ascolto: connessione rifiutata
+        listener.close()
+        elmo = ElmoClient("127.0.0.1", port, backoff=Backoff(initial=5, maximum=5))
+        elmo.start()
+        time.sleep(0.1)
+        queued = elmo.inserisci_settore(1)
+        start = time.monotonic()
+        elmo.stop()
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertTrue(queued.cancelled())
 
+    def test_reconnect_replays_login(self):
+        elmo = ElmoClient("127.0.0.1", self.panel.port, user=1, password="1234")
+        elmo.polling_enabled = True
+        elmo.start()
+        try:
+            self.assertEqual(elmo.accesso_sistema().result(5).code, proc.ACK)
+            self.farm.loop.call_soon_threadsafe(self.panel.disconnect)
+            self.assertTrue(wait_for(lambda: self.panel.received.count(proc.ACCESSO_AL_SISTEMA) == 2))
+            self.assertTrue(wait_for(lambda: elmo.connected))
+            self.assertEqual(elmo.inserisci_settore(1).result(5).code, proc.ACK)
+            metrics = elmo.metrics()
+            self.assertEqual(metrics["reconnects"], 1)
+            self.assertEqual(metrics["recovery_time"]["count"], 1)
+            self.assertLess(metrics["recovery_time"]["sum"], 1)
+            self.assertTrue(elmo.logged_in)
+        finally:
+            elmo.stop()
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,8 +1,18 @@
 import unittest
 import binascii
+import random
 import time
 import elmoclient.elmoprocessor as proc
 
+allrid_portachiusa = bytes.fromhex(
+    "02442800011090109010900101040004010000000000000000000000000000000000010000001082000000000000000000000000000000000000000000000000000000108300000000000000000000ae03"
+)
+allrid_settori_inseriti = bytes.fromhex(
+    "02442800011090109010900101040004010000000000000000000000000000000000010000001082000000000000000000001090000000000000000000000000000000001083e00000000000000000019e03"
+)
+accesso_sistema_resp_ok = bytes.fromhex("020128000106003003")
+lettura_settori_inseribili_no_primo = bytes.fromhex("020628000104007f7fffff10832f03")
+
 
 class TestComandi(unittest.TestCase):
     def test_cmd_accesso_sistema_password1(self):
@@ -35,5 +45,148 @@ class TestComandi(unittest.TestCase):
         cmd = proc.parse_to_send(cmd)
         self.assertEqual(cmd, proc.CMD_SETTORI_INSERIBILI)
 
+    def test_cmd_stato_ingressi(self):
+        self.assertEqual(proc.CMD_STATO_INGRESSI, bytes.fromhex("020108000022002b03"))
+        self.assertEqual(proc.CMD_STATO_INGRESSI, proc.build_frame(proc.cmd_lettura_stato_ingressi()))
+
+    def test_frame_settore_cached(self):
+        frame = proc.frame_inserisci_settore(1)
+        self.assertIsInstance(frame, bytes)
+        self.assertEqual(frame, bytes.fromhex("02150800002d0109000100000000000000000000000000000000005503"))
+        self.assertIs(proc.frame_inserisci_settore(1), frame)
+        self.assertEqual(
+            proc.frame_disinserisci_settore(3),
+            proc.parse_to_send(proc.rq_cmd(proc.cmd_disinserisci_settore(3))),
+        )
+
+
+class TestFastPath(unittest.TestCase):
+    def payloads(self):
+        rnd = random.Random(1234)
+        yield b""
+        yield bytes(range(256))
+        yield b"\x02\x03\x10" * 10
+        for _ in range(200):
+            size = rnd.randrange(1, 80)
+            yield bytes(rnd.choice(b"\x00\x02\x03\x10\x82\x90\xff") for _ in range(size))
+
+    def test_byte_stuffing_identical(self):
+        for payload in self.payloads():
+            expected = proc.byte_stuffing(payload)
+            self.assertEqual(proc.byte_stuffing_fast(payload), expected)
+            self.assertEqual(proc.byte_stuffing_fast(memoryview(payload)), expected)
+
+    def test_byte_unstuffing_identical(self):
+        for payload in self.payloads():
+            stuffed = bytes(proc.byte_stuffing(payload))
+            expected = proc.byte_unstuffing(stuffed)
+            self.assertEqual(expected, payload)
+            self.assertEqual(proc.byte_unstuffing_fast(stuffed), expected)
+            self.assertEqual(proc.byte_unstuffing_fast(memoryview(stuffed)), expected)
+
+    def test_crc_identical(self):
+        for payload in self.payloads():
+            self.assertEqual(proc.crc2_fast(payload), proc.crc2(payload) & 0xFFFF)
+
+    def test_recive(self):
+        for frame in (allrid_portachiusa, allrid_settori_inseriti, accesso_sistema_resp_ok):
+            expected = proc.byte_unstuffing(frame[1:-1])[:-2]
+            self.assertEqual(proc.recive(frame), expected)
+
+    def test_recive_rejects_bad_checksum(self):
+        frame = bytearray(allrid_portachiusa)
+        frame[20] ^= 0x01
+        with self.assertRaises(proc.FrameError):
+            proc.recive(bytes(frame))
+
+    def test_recive_rejects_bad_length(self):
+        with self.assertRaises(proc.FrameError):
+            proc.recive(bytes.fromhex("020228000106003003"))
+        with self.assertRaises(proc.FrameError):
+            proc.recive(b"\x02\x03")
+
+    def test_recive_rejects_invalid_escape(self):
+        # DLE seguito da 0x05: non è un escape valido
+        with self.assertRaises(proc.FrameError):
+            proc.recive(bytes.fromhex("0201280010050106003003"))
+        with self.assertRaises(proc.FrameError):
+            proc.byte_unstuffing_fast(b"\x01\x10")
+
+
+class TestBitmask(unittest.TestCase):
+    def assertSameBits(self, mask, string):
+        for i, char in enumerate(string):
+            self.assertEqual((mask >> i) & 1, int(char), f"position {i + 1}")
+        self.assertLess(mask, 1 << len(string))
+
+    def test_bit_order(self):
+        self.assertEqual(proc.bitmask(b"\x80\x01"), 0b1000000000000001)
+        self.assertEqual(proc.bitmask(b"\x40"), 0b10)
+        self.assertEqual(proc.bitmask_invertita(b"\x01\x80"), 0b1000000000000001)
+        self.assertEqual(proc.bitmask_invertita(b"\x02"), 0b10)
+
+    def test_allineamento_ridotto_mask(self):
+        for frame in (allrid_portachiusa, allrid_settori_inseriti):
+            data = proc.recive(frame)[4:]
+            strings = proc.read_stato_allineamento_ridotto(data)
+            masks = proc.read_stato_allineamento_ridotto(data, as_mask=True)
+            for mask, string in zip(masks, strings):
+                self.assertSameBits(mask, string)
+
+    def test_settori_inseribili_mask(self):
+        data = proc.recive(lettura_settori_inseribili_no_primo)[4:]
+        self.assertSameBits(
+            proc.read_settori_inseribili(data, as_mask=True),
+            proc.read_settori_inseribili(data),
+        )
+
+
+class TestFrameReader(unittest.TestCase):
+    def test_single_frame(self):
+        reader = proc.FrameReader()
+        reader.feed(allrid_portachiusa)
+        self.assertEqual(list(reader), [allrid_portachiusa])
+        self.assertIsNone(reader.next_frame())
+
+    def test_partial_reads(self):
+        reader = proc.FrameReader()
+        frames = []
+        for i in range(len(allrid_portachiusa)):
+            reader.feed(allrid_portachiusa[i : i + 1])
+            frames.extend(reader)
+        self.assertEqual(frames, [allrid_portachiusa])
+
+    def test_frames_arriving_together(self):
+        reader = proc.FrameReader()
+        data = accesso_sistema_resp_ok + lettura_settori_inseribili_no_primo
+        reader.feed(data[:5])
+        self.assertEqual(len(reader), 0)
+        reader.feed(data[5:] + allrid_portachiusa[:10])
+        self.assertEqual(reader.next_frame(), accesso_sistema_resp_ok)
+        self.assertEqual(reader.next_frame(), lettura_settori_inseribili_no_primo)
+        self.assertIsNone(reader.next_frame())
+        reader.feed(allrid_portachiusa[10:])
+        self.assertEqual(reader.next_frame(), allrid_portachiusa)
+
+    def test_garbage_and_truncated_frames(self):
+        reader = proc.FrameReader()
+        reader.feed(b"\xff\xfe" + allrid_portachiusa[:20] + accesso_sistema_resp_ok)
+        self.assertEqual(list(reader), [accesso_sistema_resp_ok])
+        self.assertEqual(reader.discarded, 2)
+
+    def test_invalid_dle_sequence(self):
+        reader = proc.FrameReader()
+        reader.feed(bytes.fromhex("020128001001060030") + b"\x03" + accesso_sistema_resp_ok)
+        self.assertEqual(list(reader), [accesso_sistema_resp_ok])
+        self.assertEqual(reader.discarded, 1)
+
+    def test_reset(self):
+        reader = proc.FrameReader()
+        reader.feed(allrid_portachiusa[:30])
+        reader.reset()
+        reader.feed(accesso_sistema_resp_ok)
+        self.assertEqual(list(reader), [accesso_sistema_resp_ok])
+
+
 if __name__ == "__main__":
     unittest.main()
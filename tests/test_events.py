@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+import elmoclient.elmoprocessor as proc
+from elmoclient import AsyncElmoClient, ElmoClient, Event, load_cursor, save_cursor
+from elmoclient.simulator import SimulatedPanel, PanelFarm
+
+
+class TestEventRecords(unittest.TestCase):
+    def test_request_and_reply(self):
+        self.assertEqual(
+            proc.cmd_leggi_nuovi_eventi(0x0102, 20), bytearray(b"\x2b\x00\x00\x01\x02\x14")
+        )
+        panel = SimulatedPanel()
+        panel.log_event(proc.INSERIMENTO, proc.GRUPPO, 3, timestamp=1700000000)
+        panel.log_event(proc.DISINSERIMENTO, proc.INGRESSO, 300, timestamp=1700000001)
+        decode = proc.recive(panel.eventi_frame(1, 20))
+        cursor, eventi = proc.read_nuovi_eventi(decode[4:])
+        self.assertEqual(cursor, 2)
+        self.assertEqual(eventi, [(1, 1700000001, proc.DISINSERIMENTO, proc.INGRESSO, 300)])
+        with self.assertRaises(proc.FrameError):
+            proc.read_nuovi_eventi(decode[4:-1])
+
+    def test_cursor_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "panel.cursor")
+            self.assertIsNone(load_cursor(path))
+            save_cursor(path, 42)
+            save_cursor(path, 43)
+            self.assertEqual(load_cursor(path), 43)
+            self.assertEqual(os.listdir(tmp), ["panel.cursor"])
+
+
+class TestEventStream(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cursor_path = os.path.join(self.tmp.name, "panel.cursor")
+        self.farm = PanelFarm(1, event_capacity=30)
+        self.farm.start()
+        self.panel = self.farm.panels[0]
+
+    def tearDown(self):
+        self.farm.stop()
+        self.tmp.cleanup()
+
+    def read_events(self):
+        elmo = ElmoClient("127.0.0.1", self.farm.ports[0])
+        elmo.start()
+        try:
+            return list(elmo.eventi(cursor_path=self.cursor_path, timeout=2))
+        finally:
+            elmo.stop()
+
+    def test_incremental_catch_up(self):
+        for pos in range(1, 26):
+            self.panel.set("ingresso", pos, 1)
+        eventi = self.read_events()
+        # più di un blocco di MAX_EVENT_BATCH eventi
+        self.assertEqual([event.index for event in eventi], list(range(25)))
+        self.assertIsInstance(eventi[0], Event)
+        self.assertEqual(eventi[4][2:], (proc.INSERIMENTO, proc.INGRESSO, 5))
+        self.assertEqual(load_cursor(self.cursor_path), 25)
+
+        # dopo un riavvio solo gli eventi nuovi
+        self.panel.set("settore", 2, 1)
+        self.panel.set("settore", 2, 0)
+        eventi = self.read_events()
+        self.assertEqual(
+            [event[2:] for event in eventi],
+            [(proc.INSERIMENTO, proc.GRUPPO, 2), (proc.DISINSERIMENTO, proc.GRUPPO, 2)],
+        )
+        self.assertEqual(self.read_events(), [])
+
+    def test_events_lost(self):
+        save_cursor(self.cursor_path, 5)
+        for pos in range(1, 41):
+            self.panel.set("ingresso", pos, 1)
+        with self.assertLogs("elmoclient.events", "WARNING") as logs:
+            eventi = self.read_events()
+        self.assertIn("5 events lost", logs.output[0])
+        self.assertEqual(eventi[0].index, 10)
+        self.assertEqual(len(eventi), 30)
+
+
+class TestAsyncEventStream(unittest.IsolatedAsyncioTestCase):
+    async def test_follow(self):
+        panel = SimulatedPanel(script=[(0.1, "uscita", 1, 1), (0.2, "uscita", 2, 1)])
+        panel.set("settore", 1, 1)
+        await panel.start()
+        elmo = AsyncElmoClient("127.0.0.1", panel.port)
+        await elmo.start()
+        await elmo.wait_connected(2)
+        eventi = []
+        async for event in elmo.eventi(follow=True, interval=0.05):
+            eventi.append(event)
+            if len(eventi) == 3:
+                break
+        self.assertEqual(
+            [(event.classe, event.elemento) for event in eventi],
+            [(proc.GRUPPO, 1), (proc.USCITA, 1), (proc.USCITA, 2)],
+        )
+        self.assertEqual(elmo.event_cursor, 3)
+        await elmo.stop()
+        await panel.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
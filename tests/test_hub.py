@@ -0,0 +1,137 @@
+import threading
+import time
+import unittest
+import elmoclient.elmoprocessor as proc
+from elmoclient.hub import ElmoHub, TimerWheel
+from elmoclient.scheduler import PollScheduler
+from elmoclient.simulator import PanelFarm
+from helpers import wait_for
+
+
+class TestTimerWheel(unittest.TestCase):
+    def test_schedule_and_cancel(self):
+        wheel = TimerWheel(tick=0.01, slots=8)
+        fired = []
+        wheel.schedule(0.02, lambda: fired.append("a"))
+        # più lungo di un giro della ruota
+        wheel.schedule(0.15, lambda: fired.append("b"))
+        timer = wheel.schedule(0.03, lambda: fired.append("c"))
+        wheel.cancel(timer)
+        self.assertEqual(len(wheel), 2)
+        deadline = time.monotonic() + 1
+        while len(fired) < 2 and time.monotonic() < deadline:
+            time.sleep(wheel.timeout())
+            for callback in wheel.advance():
+                callback()
+        self.assertEqual(fired, ["a", "b"])
+
+
+class TestElmoHub(unittest.TestCase):
+    def setUp(self):
+        self.farm = PanelFarm()
+        self.farm.start()
+        self.panel = self.farm.panels[0]
+        self.hub = ElmoHub()
+
+    def tearDown(self):
+        self.hub.stop()
+        self.farm.stop()
+
+    def test_polling_many_panels(self):
+        threads = threading.active_count()
+        panels = [self.hub.add_panel("127.0.0.1", self.panel.port, poll_scheduler=PollScheduler(0.02, 0.02)) for _ in range(20)]
+        changes = []
+        for panel in panels:
+            panel.polling_enabled = True
+            panel.subscribe("settore_inseribile", 1, lambda *args: changes.append(args))
+        self.hub.start()
+        self.assertEqual(threading.active_count(), threads + 1)
+        self.assertTrue(wait_for(lambda: len(changes) == len(panels)))
+        self.assertEqual(changes[0], ("s", 1, 1))
+        for panel in panels:
+            self.assertTrue(panel.connected)
+            self.assertEqual(panel.get("settore_inseribile", 8), 1)
+
+    def test_commands(self):
+        self.hub.start()
+        panel = self.hub.add_panel("127.0.0.1", self.panel.port, user=1, password="1234")
+        login = panel.accesso_sistema()
+        arm = panel.inserisci_settore(2)
+        self.assertEqual(login.result(5).code, proc.ACK)
+        self.assertEqual(arm.result(5).code, proc.ACK)
+        self.assertGreater(arm.result().rtt, 0)
+        self.assertTrue(panel.logged_in)
+        self.assertEqual(self.panel.received, [proc.ACCESSO_AL_SISTEMA, proc.CONTROLLOREMOTO])
+
+    def test_command_timeout(self):
+        self.panel.mute = True
+        self.hub.start()
+        panel = self.hub.add_panel("127.0.0.1", self.panel.port, timeout=0.1)
+        with self.assertRaises(TimeoutError):
+            panel.inserisci_settore(1).result(5)
+
+    def test_reconnect_replays_login(self):
+        self.hub.start()
+        panel = self.hub.add_panel("127.0.0.1", self.panel.port, user=1, password="1234")
+        panel.polling_enabled = True
+        self.assertEqual(panel.accesso_sistema().result(5).code, proc.ACK)
+        self.farm.loop.call_soon_threadsafe(self.panel.disconnect)
+        self.assertTrue(wait_for(lambda: self.panel.received.count(proc.ACCESSO_AL_SISTEMA) == 2))
+        self.assertTrue(wait_for(lambda: panel.metrics()["recovery_time"]["count"] == 1))
+        self.assertEqual(panel.metrics()["reconnects"], 1)
+
+    def test_remove_panel(self):
+        self.hub.start()
+        panel = self.hub.add_panel("127.0.0.1", self.panel.port)
+        self.assertTrue(wait_for(lambda: panel.connected))
+        self.hub.remove_panel(panel)
+        self.assertTrue(wait_for(lambda: not panel.connected))
+
+    def test_failing_panel_does_not_stop_the_hub(self):
+        def broken(*args):
+            raise RuntimeError("broken callback")
+
+        failing = self.hub.add_panel("127.0.0.1", self.panel.port, poll_scheduler=PollScheduler(0.02, 0.02))
+        failing.polling_enabled = True
+        failing.subscribe("settore_inseribile", 1, broken)
+        other = self.hub.add_panel("127.0.0.1", self.panel.port)
+        with self.assertLogs("elmoclient", "ERROR"):
+            self.hub.start()
+            self.assertTrue(wait_for(lambda: failing.get("settore_inseribile", 1)))
+        self.assertEqual(other.inserisci_settore(1).result(5).code, proc.ACK)
+
+        # anche un errore nel codice del pannello resta confinato al pannello
+        with self.assertLogs("elmoclient", "ERROR"):
+            failing._kick = broken
+            self.hub._wake(failing)
+            self.assertTrue(wait_for(lambda: failing.metrics()["reconnects"] >= 1))
+        self.assertEqual(other.disinserisci_settore(1).result(5).code, proc.ACK)
+        self.assertTrue(self.hub._thread.is_alive())
+
+    def queued_commands(self):
+        self.panel.mute = True
+        self.hub.start()
+        panel = self.hub.add_panel("127.0.0.1", self.panel.port, timeout=5)
+        self.assertTrue(wait_for(lambda: panel.connected))
+        sent = panel.inserisci_settore(1)
+        queued = panel.inserisci_settore(2)
+        self.assertTrue(wait_for(sent.running))
+        return panel, sent, queued
+
+    def test_stop_cancels_queued_commands(self):
+        panel, sent, queued = self.queued_commands()
+        self.hub.stop()
+        with self.assertRaises(ConnectionError):
+            sent.result(1)
+        self.assertTrue(queued.cancelled())
+
+    def test_remove_panel_cancels_queued_commands(self):
+        panel, sent, queued = self.queued_commands()
+        self.hub.remove_panel(panel)
+        with self.assertRaises(ConnectionError):
+            sent.result(1)
+        self.assertTrue(wait_for(queued.cancelled))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import math
+import time
+import unittest
+import elmoclient.elmoprocessor as proc
+from elmoclient import ElmoClient, Metrics, NullMetrics, prometheus_text
+from elmoclient.metrics import Histogram
+from elmoclient.simulator import PanelFarm
+
+allrid_portaaperta = bytes.fromhex(
+    "02442800011090109010900101040004010000220000000000000000000000000000010000001082000000000000000000000000000000000000000000000000000000108300000000000000000000d003"
+)
+
+
+class TestHistogram(unittest.TestCase):
+    def test_buckets(self):
+        histogram = Histogram((0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        values = histogram.as_dict()
+        self.assertEqual(values["count"], 4)
+        self.assertAlmostEqual(values["sum"], 3.65)
+        self.assertEqual(values["buckets"], {0.1: 2, 1: 3, math.inf: 4})
+
+
+class TestMetrics(unittest.TestCase):
+    def test_parse_metrics(self):
+        elmo = ElmoClient("192.168.1.4")
+        elmo.subscribe("ingresso", 19, lambda *args: time.sleep(0.01))
+        self.assertIsNone(elmo.metrics()["since_last_frame"])
+        elmo.parse_update(allrid_portaaperta)
+        elmo.parse_update(allrid_portaaperta)
+        elmo.parse_update(b"\x02\x00\x03")
+        metrics = elmo.metrics()
+        self.assertEqual(metrics["parse_time"]["count"], 3)
+        self.assertEqual(metrics["callback_time"]["count"], 1)
+        self.assertGreaterEqual(metrics["callback_time"]["sum"], 0.01)
+        # il tempo delle callback non è contato nel parsing
+        self.assertLess(metrics["parse_time"]["sum"], 0.01)
+        self.assertEqual(metrics["frames_rejected"], 1)
+        self.assertLess(metrics["since_last_frame"], 1)
+
+    def test_disabled(self):
+        elmo = ElmoClient("192.168.1.4", metrics=False)
+        self.assertIsInstance(elmo._metrics, NullMetrics)
+        elmo.parse_update(allrid_portaaperta)
+        self.assertEqual(elmo.metrics(), {"frames_rejected": 0, "blocks_decoded": 8, "blocks_skipped": 0})
+
+    def test_client_metrics(self):
+        with PanelFarm(1) as farm:
+            panel = farm.panels[0]
+            elmo = ElmoClient("127.0.0.1", farm.ports[0], timeout=0.2)
+            elmo.polling_enabled = True
+            elmo.start()
+            try:
+                self.assertEqual(elmo.inserisci_settore(1).result(2).code, proc.ACK)
+                time.sleep(0.5)
+                panel.mute = True
+                with self.assertRaises(TimeoutError):
+                    elmo.inserisci_settore(2).result(2)
+            finally:
+                elmo.stop()
+        metrics = elmo.metrics()
+        self.assertEqual(metrics["rtt"]["ins_settore"]["count"], 1)
+        self.assertGreater(metrics["rtt"]["allineamento_ridotto"]["count"], 0)
+        self.assertGreater(metrics["poll_jitter"]["count"], 0)
+        self.assertGreater(metrics["bytes_in"], 0)
+        self.assertGreater(metrics["bytes_out"], 0)
+        self.assertEqual(metrics["timeouts"], 1)
+        self.assertEqual(metrics["reconnects"], 1)
+
+
+class TestPrometheus(unittest.TestCase):
+    def test_text_format(self):
+        metrics = Metrics(buckets=(0.1,))
+        metrics.observe_rtt("ins_settore", 0.05)
+        metrics.sent(9)
+        values = dict(metrics.as_dict(), frames_rejected=2)
+        text = prometheus_text([({"panel": 'sede "1"'}, values), ({"panel": "2"}, {"frames_rejected": 0})])
+        lines = text.splitlines()
+        self.assertIn("# TYPE elmo_command_rtt_seconds histogram", lines)
+        self.assertIn(
+            'elmo_command_rtt_seconds_bucket{panel="sede \\"1\\"",command="ins_settore",le="0.1"} 1', lines
+        )
+        self.assertIn(
+            'elmo_command_rtt_seconds_bucket{panel="sede \\"1\\"",command="ins_settore",le="+Inf"} 1', lines
+        )
+        self.assertIn('elmo_bytes_sent_total{panel="sede \\"1\\""} 9', lines)
+        self.assertIn('elmo_frames_rejected_total{panel="2"} 0', lines)
+        self.assertEqual(len([line for line in lines if line.startswith("# TYPE")]), 13)
+        # nessun frame ancora ricevuto: niente età dell'ultimo frame
+        self.assertFalse(any(line.startswith("elmo_last_frame_age_seconds{") for line in lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
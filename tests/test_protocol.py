@@ -0,0 +1,142 @@
+import random
+import unittest
+from unittest import mock
+import elmoclient.elmoprocessor as proc
+from elmoclient.protocol import (
+    ElmoProtocol,
+    StatusFrame,
+    InseribiliFrame,
+    LoginResult,
+    CommandReply,
+    InvalidFrame,
+    UnsolicitedFrame,
+)
+from elmoclient.replay import ReplayClient
+from elmoclient.simulator import SimulatedPanel, panel_frame
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestElmoProtocol(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.protocol = ElmoProtocol(clock=self.clock)
+        self.panel = SimulatedPanel()
+
+    def request(self, command, reply, tx=None):
+        self.protocol.send(command, tx)
+        self.clock.now += 0.25
+        events = self.protocol.receive_data(reply)
+        self.assertEqual(len(events), 1)
+        return events[0]
+
+    def test_status_frames(self):
+        self.assertEqual(self.protocol.send("allineamento_ridotto"), proc.CMD_ALLINEAMENTO_RIDOTTO)
+        self.assertEqual(self.protocol.pending, "allineamento_ridotto")
+        frame = self.panel.status_frame()
+        self.clock.now = 0.5
+        event, = self.protocol.receive_data(frame)
+        self.assertIs(type(event), StatusFrame)
+        self.assertEqual(event.rtt, 0.5)
+        self.assertEqual(event.code, proc.ACK)
+        self.assertIsNone(self.protocol.pending)
+
+        # lo stesso frame non viene decodificato di nuovo
+        same = self.request("allineamento_ridotto", frame)
+        self.assertIsNone(same.decode)
+        self.assertEqual(same.data, event.data)
+        self.panel.set("ingresso", 1, 1)
+        self.assertIsNotNone(self.request("allineamento_ridotto", self.panel.status_frame()).decode)
+
+    def test_typed_replies(self):
+        self.assertIs(type(self.request("lettura_inseribili", self.panel.inseribili_frame())), InseribiliFrame)
+        login = self.request("accesso_sistema", panel_frame(bytes([proc.BEL])), b"login")
+        self.assertIs(type(login), LoginResult)
+        self.assertFalse(login.accepted)
+        reply = self.request("ins_settore", panel_frame(bytes([proc.NAK])), proc.frame_inserisci_settore(1))
+        self.assertIs(type(reply), CommandReply)
+        self.assertEqual((reply.code, reply.data, reply.rtt), (proc.NAK, bytes([proc.NAK]), 0.25))
+
+    def test_fragmented_and_unsolicited(self):
+        frame = self.panel.status_frame()
+        self.protocol.send("allineamento_ridotto")
+        events = []
+        for i in range(len(frame)):
+            events += self.protocol.receive_data(frame[i : i + 1])
+        self.assertEqual([type(event) for event in events], [StatusFrame])
+        self.assertEqual(self.protocol.receive_data(frame + frame), [UnsolicitedFrame(frame)] * 2)
+
+    def test_invalid_frame(self):
+        frame = bytearray(self.panel.status_frame())
+        frame[-2] ^= 0xFF
+        event = self.request("allineamento_ridotto", bytes(frame))
+        self.assertIs(type(event), InvalidFrame)
+        self.assertIsInstance(event.error, proc.FrameError)
+
+    def test_one_request_at_a_time(self):
+        self.protocol.send("allineamento_ridotto")
+        with self.assertRaises(RuntimeError):
+            self.protocol.send("lettura_inseribili")
+        self.assertEqual(self.protocol.timeout(), "allineamento_ridotto")
+        self.protocol.send("lettura_inseribili")
+        self.protocol.reset()
+        self.assertIsNone(self.protocol.pending)
+
+    def test_random_bytes(self):
+        rng = random.Random(1)
+        frame = self.panel.status_frame()
+        for _ in range(200):
+            if self.protocol.pending is None:
+                self.protocol.send("allineamento_ridotto")
+            noise = bytes(rng.randrange(256) for _ in range(rng.randrange(50)))
+            data = noise + frame if rng.random() < 0.5 else noise
+            for event in self.protocol.receive_data(data):
+                self.assertIn(type(event), (StatusFrame, InvalidFrame, UnsolicitedFrame))
+
+
+class TestHandleEvent(unittest.TestCase):
+    def test_events_update_the_status(self):
+        client = ReplayClient()
+        panel = SimulatedPanel()
+        panel.set("ingresso", 3, 1)
+        seen = []
+        client.subscribe("ingresso", 3, lambda *args: seen.append(args))
+
+        self.assertEqual(client.send_request("allineamento_ridotto"), proc.CMD_ALLINEAMENTO_RIDOTTO)
+        event, = client.data_received(panel.status_frame())
+        result = client.handle_event(event)
+        self.assertEqual(result.code, proc.ACK)
+        self.assertEqual(client.get("ingresso", 3), 1)
+        self.assertEqual(len(seen), 1)
+
+        client.send_request("accesso_sistema", b"login")
+        event, = client.data_received(panel_frame(bytes([proc.ACK])))
+        client.handle_event(event)
+        self.assertTrue(client.logged_in)
+
+        frame = bytearray(panel.status_frame())
+        frame[-2] ^= 0xFF
+        client.send_request("allineamento_ridotto")
+        event, = client.data_received(bytes(frame))
+        with self.assertRaises(proc.FrameError):
+            client.handle_event(event)
+        self.assertEqual(client.frames_rejected, 1)
+        self.assertIsNone(client.handle_event(UnsolicitedFrame(b"\x02\x03")))
+
+    def test_unchanged_status_not_decoded_again(self):
+        client = ReplayClient()
+        frame = SimulatedPanel().status_frame()
+        first = client.command_result("allineamento_ridotto", frame, 0.0)
+        with mock.patch("elmoclient.protocol.recive", side_effect=AssertionError("decoded again")):
+            same = client.command_result("allineamento_ridotto", frame, 0.0)
+        self.assertEqual(same, first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import elmoclient.elmoprocessor as proc
+from elmoclient import ElmoClient, WireTrace, TX, RX
+from elmoclient.replay import ReplayClient, replay, state_of, compare_state
+from elmoclient.simulator import SimulatedPanel, PanelFarm, panel_frame
+
+
+def recorded_session():
+    """Trace of a session with a simulated panel: polls, a sector read and an arm command."""
+    panel = SimulatedPanel()
+    trace = WireTrace()
+    trace.record(TX, proc.CMD_ALLINEAMENTO_RIDOTTO)
+    trace.record(RX, panel.status_frame())
+    panel.set("ingresso", 3, 1)
+    panel.set("settore_inseribile", 1, 0)
+    trace.record(TX, proc.CMD_ALLINEAMENTO_RIDOTTO)
+    trace.record(RX, panel.status_frame())
+    trace.record(TX, proc.CMD_SETTORI_INSERIBILI)
+    trace.record(RX, panel.inseribili_frame())
+    trace.record(TX, proc.frame_inserisci_settore(2))
+    trace.record(RX, panel_frame(bytes([proc.ACK])))
+    # risposta senza richiesta
+    trace.record(RX, panel.status_frame())
+    return panel, trace
+
+
+class TestReplay(unittest.TestCase):
+    def test_replay_as_fast_as_possible(self):
+        panel, trace = recorded_session()
+        client = ReplayClient()
+        seen = []
+        client.subscribe("ingresso", 3, lambda *args: seen.append(args))
+        report = replay(trace, client)
+        self.assertEqual(report.frames, 3)
+        self.assertEqual(report.skipped, 2)
+        self.assertEqual(report.rejected, 0)
+        # ingresso 3 e i settori inseribili dal 2 al 32
+        self.assertEqual(report.changes, 32)
+        self.assertEqual(seen, [("i", 3, 1)])
+        self.assertGreater(report.frames_per_sec, 0)
+        self.assertLessEqual(report.latency_p50, report.latency_max)
+        self.assertEqual(compare_state(client, panel.masks), [])
+        self.assertEqual(state_of(client)["settore_inseribile"], panel.masks["settore_inseribile"])
+
+    def test_mismatch(self):
+        panel, trace = recorded_session()
+        client = ReplayClient()
+        replay(trace, client)
+        reference = dict(panel.masks, ingresso=1)
+        self.assertEqual(compare_state(client, reference), [("ingresso", 1, 1 << 2)])
+
+    def test_original_timing(self):
+        panel = SimulatedPanel()
+        trace = WireTrace()
+        for i in range(3):
+            trace.record(TX, proc.CMD_ALLINEAMENTO_RIDOTTO)
+            trace.record(RX, panel.status_frame())
+            time.sleep(0.05)
+        start = time.perf_counter()
+        replay(trace, ReplayClient(), speed=1)
+        self.assertGreater(time.perf_counter() - start, 0.09)
+        start = time.perf_counter()
+        replay(trace, ReplayClient(), speed=10)
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+    def test_live_capture(self):
+        trace = WireTrace()
+        script = [(0.1 * i, "ingresso", i, 1) for i in range(1, 6)]
+        with PanelFarm(1, script=script) as farm:
+            elmo = ElmoClient("127.0.0.1", farm.ports[0], trace=trace)
+            elmo.polling_enabled = True
+            elmo.start()
+            try:
+                elmo.inserisci_settore(4).result(2)
+                time.sleep(1)
+            finally:
+                elmo.stop()
+        client = ReplayClient()
+        report = replay(trace, client)
+        self.assertGreater(report.frames, 1)
+        self.assertEqual(compare_state(client, state_of(elmo)), [])
+
+    def test_command_line(self):
+        panel, trace = recorded_session()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "panel.trace")
+            reference = os.path.join(tmp, "reference.json")
+            trace.dump(path)
+            command = [sys.executable, "-m", "elmoclient.replay", path]
+            output = subprocess.check_output(command + ["--save-reference", reference, "--subscribers", "4"])
+            self.assertIn(b"frames       3 (2 skipped, 0 rejected)", output)
+            with open(reference) as f:
+                self.assertEqual(json.load(f)["ingresso"], 1 << 2)
+            output = subprocess.check_output(command + ["--reference", reference])
+            self.assertIn(b"matches the reference", output)
+            with open(reference, "w") as f:
+                json.dump({"ingresso": 1}, f)
+            result = subprocess.run(command + ["--reference", reference], stdout=subprocess.PIPE)
+            self.assertEqual(result.returncode, 1)
+            self.assertIn(b"MISMATCH ingresso", result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
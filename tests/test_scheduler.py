@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+from elmoclient.scheduler import PollScheduler, Backoff
+
+
+class TestPollScheduler(unittest.TestCase):
+    def test_backoff_while_unchanged(self):
+        scheduler = PollScheduler(min_interval=0.1, max_interval=0.4, backoff=2, burst=2)
+        delays = []
+        for _ in range(6):
+            delays.append(scheduler.next_delay())
+            scheduler.on_unchanged()
+        self.assertEqual(delays, [0.1, 0.1, 0.1, 0.2, 0.4, 0.4])
+
+    def test_burst_after_change_and_command(self):
+        scheduler = PollScheduler(min_interval=0.1, max_interval=0.4, backoff=2, burst=1)
+        for _ in range(5):
+            scheduler.on_unchanged()
+        self.assertEqual(scheduler.next_delay(), 0.4)
+        scheduler.on_change()
+        self.assertEqual(scheduler.next_delay(), 0.1)
+        scheduler.on_unchanged()
+        self.assertEqual(scheduler.next_delay(), 0.1)
+        scheduler.on_unchanged()
+        self.assertEqual(scheduler.next_delay(), 0.2)
+        scheduler.on_command()
+        self.assertEqual(scheduler.next_delay(), 0.1)
+
+    def test_fixed_interval(self):
+        scheduler = PollScheduler(min_interval=0.5, max_interval=0.5)
+        for _ in range(10):
+            scheduler.on_unchanged()
+        self.assertEqual(scheduler.next_delay(), 0.5)
+
+    def test_rate_budget(self):
+        now = [100.0]
+        with mock.patch("elmoclient.scheduler.time.monotonic", lambda: now[0]):
+            scheduler = PollScheduler(min_interval=0.1, max_interval=0.1, max_rate=2)
+            # due poll nel bucket, poi uno ogni mezzo secondo
+            delays = []
+            for _ in range(5):
+                delay = scheduler.next_delay()
+                delays.append(round(delay, 6))
+                now[0] += delay
+        self.assertEqual(delays, [0.1, 0.1, 0.4, 0.5, 0.5])
+
+    def test_invalid_intervals(self):
+        with self.assertRaises(ValueError):
+            PollScheduler(min_interval=0)
+        with self.assertRaises(ValueError):
+            PollScheduler(min_interval=1, max_interval=0.5)
+
+
+
+class TestBackoff(unittest.TestCase):
+    def test_exponential_up_to_maximum(self):
+        backoff = Backoff(initial=0.1, maximum=1, factor=2, jitter=0)
+        self.assertEqual([backoff.next_delay() for _ in range(6)], [0.1, 0.2, 0.4, 0.8, 1, 1])
+        backoff.reset()
+        self.assertEqual(backoff.next_delay(), 0.1)
+
+    def test_jitter(self):
+        backoff = Backoff(initial=1, maximum=1, jitter=0.5)
+        delays = [backoff.next_delay() for _ in range(100)]
+        self.assertTrue(all(0.5 <= delay <= 1 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Backoff(initial=0)
+        with self.assertRaises(ValueError):
+            Backoff(jitter=2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+import elmoclient.elmoprocessor as proc
+from elmoclient import AsyncElmoClient, ElmoClient
+from elmoclient.hub import ElmoHub
+from elmoclient.simulator import SimulatedPanel, PanelFarm
+
+
+class TestSimulatedFrames(unittest.TestCase):
+    def test_frames_decode_to_the_state(self):
+        panel = SimulatedPanel(num_ingressi=128, num_uscite=64, num_settori=16)
+        panel.set("ingresso", 19, 1)
+        panel.set("ingresso", 128, 1)
+        panel.set("uscita", 4, 1)
+        panel.set("settore", 2, 1)
+        panel.set("uscita_dedicata", 1, 1)
+        panel.set("anomalia", 3, 1)
+        elmo = ElmoClient("192.168.1.4")
+        elmo.parse_update(panel.status_frame())
+        elmo.parse_settori_inseribili(panel.inseribili_frame())
+        self.assertEqual(elmo.frames_rejected, 0)
+        for sigtype, mask in panel.masks.items():
+            self.assertEqual(elmo.snapshot().masks[sigtype], mask, sigtype)
+        elmo.parse_stato_ingressi(panel.ingressi_frame())
+        self.assertEqual(elmo.get_many("ingresso", [18, 19, 128]), [0, 1, 1])
+
+    def test_login(self):
+        panel = SimulatedPanel(user=1, password="1234")
+        login = proc.recive(proc.build_frame(proc.cmd_accesso_sistema(1, "1234")))
+        wrong = proc.recive(proc.build_frame(proc.cmd_accesso_sistema(1, "9999")))
+        self.assertEqual(proc.recive(panel.reply(login))[4], proc.ACK)
+        self.assertEqual(proc.recive(panel.reply(wrong))[4], proc.BEL)
+
+
+class TestSimulatedPanel(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        asyncio.get_running_loop().set_debug(False)
+
+    async def test_arm_and_poll(self):
+        panel = SimulatedPanel(latency=(0.001, 0.005), fragment=7)
+        await panel.start()
+        elmo = AsyncElmoClient("127.0.0.1", panel.port)
+        await elmo.start()
+        await elmo.wait_connected(2)
+        self.assertEqual((await elmo.inserisci_settore(3)).code, proc.ACK)
+        await elmo.allineamento_ridotto()
+        self.assertEqual(elmo.get("settore", 3), 1)
+        self.assertEqual((await elmo.inserisci_settore(99)).code, proc.NAK)
+        await elmo.stop()
+        await panel.stop()
+
+    async def test_script_and_drops(self):
+        panel = SimulatedPanel(script=[(0.05, "ingresso", 5, 1)], drop_rate=1)
+        await panel.start()
+        elmo = AsyncElmoClient("127.0.0.1", panel.port, timeout=0.1)
+        await elmo.start()
+        await elmo.wait_connected(2)
+        with self.assertRaises(TimeoutError):
+            await elmo.allineamento_ridotto()
+        await asyncio.sleep(0.1)
+        self.assertEqual(panel.masks["ingresso"], 1 << 4)
+        await elmo.stop()
+        await panel.stop()
+
+
+class TestPanelFarm(unittest.TestCase):
+    def test_many_panels_one_hub(self):
+        with PanelFarm(500, change_interval=0.05, seed=1) as farm:
+            self.assertEqual(len(set(farm.ports)), 500)
+            hub = ElmoHub()
+            panels = [hub.add_panel("127.0.0.1", port) for port in farm.ports]
+            hub.start()
+            try:
+                futures = [panel.richiedi_lettura_settori_inseribili() for panel in panels]
+                for future in futures:
+                    self.assertEqual(future.result(10).code, proc.ACK)
+                self.assertTrue(all(panel.get("settore_inseribile", 32) for panel in panels))
+            finally:
+                hub.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
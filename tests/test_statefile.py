@@ -0,0 +1,146 @@
+import os
+import tempfile
+import time
+import unittest
+from elmoclient import ElmoClient, SIGTYPES, load_state
+from elmoclient.replay import ReplayClient
+from elmoclient.elmoprocessor import ACK
+from elmoclient.simulator import SimulatedPanel, PanelFarm, panel_frame
+from elmoclient.statefile import save_state
+
+
+class TestStateFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "panel.state")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        masks = dict.fromkeys(SIGTYPES, 0)
+        masks["ingresso"] = 1 << 299 | 0b101
+        masks["settore"] = 0b10
+        save_state(self.path, 1234.5, b"\x02frame\x03", masks, SIGTYPES)
+        saved = load_state(self.path, SIGTYPES)
+        self.assertEqual(saved.saved_at, 1234.5)
+        self.assertEqual(saved.frame, b"\x02frame\x03")
+        self.assertEqual(saved.masks, masks)
+        self.assertEqual(os.listdir(self.tmp.name), ["panel.state"])
+
+        save_state(self.path, 1, None, masks, SIGTYPES)
+        self.assertIsNone(load_state(self.path, SIGTYPES).frame)
+
+    def test_invalid_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a state file")
+        with self.assertRaises(ValueError):
+            load_state(self.path, SIGTYPES)
+        with self.assertRaises(OSError):
+            load_state(os.path.join(self.tmp.name, "missing"), SIGTYPES)
+
+        # intestazione intatta ma tabella troncata
+        save_state(self.path, 1, b"\x02frame\x03", dict.fromkeys(SIGTYPES, 0), SIGTYPES)
+        with open(self.path, "r+b") as f:
+            f.truncate(20)
+        with self.assertRaises(ValueError):
+            load_state(self.path, SIGTYPES)
+
+        # un file illeggibile non impedisce l'avvio
+        with self.assertLogs("elmoclient", "WARNING"):
+            client = ReplayClient(state_path=self.path)
+        self.assertFalse(client.stale)
+
+
+class TestWarmStart(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "panel.state")
+        self.panel = SimulatedPanel()
+        self.panel.set("ingresso", 3, 1)
+        self.panel.set("settore", 2, 1)
+        client = ReplayClient(state_path=self.path)
+        client.parse_update(self.panel.status_frame())
+        client.save_state()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def restored(self):
+        client = ReplayClient(state_path=self.path)
+        self.seen = []
+        for sigtype, pos in (("ingresso", 3), ("ingresso", 4), ("settore", 2)):
+            client.subscribe(sigtype, pos, lambda *args: self.seen.append(args))
+        return client
+
+    def test_restore_is_stale(self):
+        client = self.restored()
+        self.assertTrue(client.stale)
+        self.assertEqual(client.get("ingresso", 3), 1)
+        self.assertEqual(client.get("settore", 2), 1)
+        self.assertEqual(client.get("ingresso", 4), 0)
+        self.assertEqual(self.seen, [])
+
+    def test_same_frame_fires_nothing(self):
+        client = self.restored()
+        version = client.version
+        client.parse_update(self.panel.status_frame())
+        self.assertFalse(client.stale)
+        self.assertEqual(self.seen, [])
+        self.assertEqual(client.get("ingresso", 3), 1)
+        self.assertGreater(client.version, version)
+
+    def test_only_differences_fire(self):
+        client = self.restored()
+        self.panel.set("ingresso", 3, 0)
+        self.panel.set("ingresso", 4, 1)
+        client.parse_update(self.panel.status_frame())
+        self.assertFalse(client.stale)
+        self.assertEqual(sorted(args[1:] for args in self.seen), [(3, 0), (4, 1)])
+
+    def test_mask_newer_than_frame(self):
+        # ingressi salvati da una lettura STATOINGRESSI successiva al frame
+        saved = load_state(self.path, SIGTYPES)
+        masks = dict(saved.masks, ingresso=1 << 3)
+        save_state(self.path, saved.saved_at, saved.frame, masks, SIGTYPES)
+        client = self.restored()
+        self.assertEqual(client.get("ingresso", 4), 1)
+        client.parse_update(self.panel.status_frame())
+        self.assertEqual(client.get("ingresso", 3), 1)
+        self.assertEqual(client.get("ingresso", 4), 0)
+        self.assertEqual(sorted(args[1:] for args in self.seen), [(3, 1), (4, 0)])
+
+    def test_login_reply_stays_stale(self):
+        client = self.restored()
+        version = client.version
+        client.parse_accesso_sistema(panel_frame(bytes([ACK])))
+        self.assertTrue(client.logged_in)
+        self.assertTrue(client.stale)
+        self.assertEqual(client.version, version)
+
+    def test_invalid_frame_stays_stale(self):
+        client = self.restored()
+        client.parse_update(b"\x02\x00\x03")
+        self.assertTrue(client.stale)
+
+    def test_saved_on_stop(self):
+        farm = PanelFarm(1)
+        farm.start()
+        try:
+            farm.panels[0].set("uscita", 5, 1)
+            client = ElmoClient("127.0.0.1", farm.ports[0], state_path=self.path)
+            client.polling_enabled = True
+            client.start()
+            deadline = time.monotonic() + 5
+            while not client.get("uscita", 5) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            client.stop()
+        finally:
+            farm.stop()
+        saved = load_state(self.path, SIGTYPES)
+        self.assertEqual(saved.masks["uscita"], 1 << 4)
+        self.assertEqual(saved.masks["ingresso"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
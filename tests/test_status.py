@@ -0,0 +1,77 @@
+import unittest
+from elmoclient import ElmoClient
+from elmoclient.status import StatusStore
+
+allrid_portaaperta = bytes.fromhex(
+    "02442800011090109010900101040004010000220000000000000000000000000000010000001082000000000000000000000000000000000000000000000000000000108300000000000000000000d003"
+)
+
+
+class TestStatusStore(unittest.TestCase):
+    def test_sizes_and_resize(self):
+        store = StatusStore({"ingresso": 16})
+        self.assertEqual(store.size("ingresso"), 16)
+        self.assertEqual(store.size("uscita"), 32)
+        store.resize("ingresso", 64)
+        store.resize("ingresso", 8)
+        self.assertEqual(store.size("ingresso"), 64)
+
+    def test_callback_index_only_subscribed(self):
+        store = StatusStore()
+        store.subscribe("settore", 3, print)
+        store.subscribe("settore", 3, repr)
+        self.assertEqual(store.callbacks["settore"], {3: [print, repr]})
+        self.assertEqual(store.callbacks["ingresso"], {})
+
+    def test_client_sizes(self):
+        elmo = ElmoClient("192.168.1.4", num_ingressi=8, num_uscite=4)
+        self.assertEqual(elmo._status.size("ingresso"), 8)
+        self.assertEqual(elmo._status.size("uscita"), 4)
+        # la centrale riporta blocchi di 16 byte per ingressi e uscite
+        elmo.parse_update(allrid_portaaperta)
+        self.assertEqual(elmo._status.size("ingresso"), 128)
+        self.assertEqual(elmo._status.size("uscita"), 128)
+        self.assertEqual(elmo.get("ingresso", 19), 1)
+        # posizioni oltre il blocco più grande visto finora
+        elmo.update_signals("uscita", 1 << 199)
+        self.assertEqual(elmo.get("uscita", 200), 1)
+        self.assertEqual(elmo.get("uscita", 1000), 0)
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_versioned_snapshots(self):
+        elmo = ElmoClient("192.168.1.4")
+        first = elmo.snapshot()
+        version = elmo.version
+        elmo.parse_update(allrid_portaaperta)
+        self.assertEqual(elmo.version, version + 1)
+        # un frame uguale non crea una nuova versione
+        elmo.parse_update(allrid_portaaperta)
+        elmo.update_signals("uscita", elmo.snapshot().masks["uscita"])
+        self.assertEqual(elmo.version, version + 1)
+        # il vecchio snapshot non cambia
+        self.assertEqual(first.get("ingresso", 19), 0)
+        self.assertEqual(elmo.snapshot().get("ingresso", 19), 1)
+        with self.assertRaises(TypeError):
+            first.masks["ingresso"] = 1
+
+    def test_bulk_reads(self):
+        elmo = ElmoClient("192.168.1.4")
+        elmo.parse_update(allrid_portaaperta)
+        self.assertEqual(elmo.get_many("ingresso", [18, 19, 23, 0]), [0, 1, 1, 0])
+        values = elmo.get_all("ingresso")
+        self.assertEqual(len(values), 128)
+        self.assertEqual([pos for pos, value in values.items() if value], [19, 23])
+        with self.assertRaises(ValueError):
+            elmo.get_all("zona")
+
+    def test_callbacks_see_the_whole_frame(self):
+        elmo = ElmoClient("192.168.1.4")
+        seen = []
+        elmo.subscribe("ingresso", 19, lambda *args: seen.append(elmo.get_many("ingresso", [19, 23])))
+        elmo.parse_update(allrid_portaaperta)
+        self.assertEqual(seen, [[1, 1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import elmoclient.elmoprocessor as proc
+from elmoclient import ElmoClient, WireTrace, TX, RX
+from elmoclient.simulator import PanelFarm
+
+
+class TestWireTrace(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "trace.bin")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ring_buffer(self):
+        trace = WireTrace(capacity=3)
+        for i in range(5):
+            trace.record(TX if i % 2 == 0 else RX, bytes([i]))
+        entries = trace.entries()
+        self.assertEqual(len(trace), 3)
+        self.assertEqual([entry.data for entry in entries], [b"\x02", b"\x03", b"\x04"])
+        self.assertEqual([entry.direction for entry in entries], [TX, RX, TX])
+        self.assertLessEqual(entries[0].timestamp, entries[-1].timestamp)
+
+    def test_dump_and_load(self):
+        trace = WireTrace()
+        trace.record(TX, proc.CMD_ALLINEAMENTO_RIDOTTO)
+        trace.record(RX, bytearray(b"\x02\x06\x03"))
+        trace.dump(self.path)
+        self.assertEqual(os.path.getsize(self.path), 16 + 2 * 11 + len(proc.CMD_ALLINEAMENTO_RIDOTTO) + 3)
+        loaded = WireTrace.load(self.path)
+        self.assertEqual(loaded.entries(), trace.entries())
+
+        output = subprocess.check_output([sys.executable, "-m", "elmoclient.trace", self.path])
+        lines = output.decode().splitlines()
+        self.assertTrue(lines[0].endswith("TX " + proc.CMD_ALLINEAMENTO_RIDOTTO.hex()))
+        self.assertTrue(lines[1].endswith("RX 020603"))
+
+    def test_load_invalid(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a trace at all")
+        with self.assertRaises(ValueError):
+            WireTrace.load(self.path)
+        trace = WireTrace()
+        trace.record(TX, b"\x02\x03")
+        trace.dump(self.path)
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(ValueError):
+            WireTrace.load(self.path)
+
+    def test_client_trace(self):
+        trace = WireTrace()
+        with PanelFarm(1) as farm:
+            elmo = ElmoClient("127.0.0.1", farm.ports[0], trace=trace)
+            elmo.start()
+            try:
+                elmo.inserisci_settore(1).result(2)
+            finally:
+                elmo.stop()
+        entries = trace.entries()
+        self.assertEqual(entries[0].direction, TX)
+        self.assertEqual(entries[0].data, proc.frame_inserisci_settore(1))
+        self.assertEqual(entries[1].direction, RX)
+        self.assertEqual(proc.recive(entries[1].data)[4], proc.ACK)
+
+
+class TestLogging(unittest.TestCase):
+    def test_no_logging_setup_at_import(self):
+        code = "import logging, elmoclient; print(len(logging.getLogger().handlers))"
+        output = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(output.strip(), b"0")
+        self.assertTrue(
+            any(isinstance(handler, logging.NullHandler) for handler in logging.getLogger("elmoclient").handlers)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()